@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+
+import os
+from os.path import basename, dirname, isfile
+from tempfile import mkstemp
+from typing import Callable
+
+
+def atomicWrite(path: str, content: str | bytes, check: Callable[[str], bool] = None) -> bool:
+    """Replace a file at once, so readers never see it half written and a crash leaves either the old or the new one
+
+    The content is written to a temporary file next to the target and flushed to disk before it replaces the target.
+    The temporary file gets the mode and owner of the old file, new files are only readable by their owner.
+
+    Args:
+        path (string): Location of the file, its directory has to exist
+        content (string|bytes): The new content
+        check (Callable[[str], bool]): Called with the temporary files path, the file is only replaced if it returns True
+
+    Returns:
+        bool: Whether the file was replaced
+    """
+    handle, tmpPath = mkstemp(prefix='.' + basename(path) + '.', dir=dirname(path) or '.')
+    try:
+        with os.fdopen(handle, 'wb' if isinstance(content, bytes) else 'w') as tmpFile:
+            tmpFile.write(content)
+            tmpFile.flush()
+            os.fsync(tmpFile.fileno())
+        # Keep the permissions of the old file
+        if isfile(path):
+            oldStat = os.stat(path)
+            os.chmod(tmpPath, oldStat.st_mode)
+            try:
+                os.chown(tmpPath, oldStat.st_uid, oldStat.st_gid)
+            except PermissionError:
+                pass
+        if None is not check and not check(tmpPath):
+            return False
+        os.replace(tmpPath, path)
+        tmpPath = None
+        return True
+    finally:
+        if None is not tmpPath and isfile(tmpPath):
+            os.remove(tmpPath)
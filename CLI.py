@@ -1,11 +1,23 @@
 #!/usr/bin/python3
 
+import re
+import sys
+from datetime import datetime
 from enum import Enum
+from time import time
 
 from prompt_toolkit import PromptSession
 
+from CertificateQueue import CertificateQueue
 from CliCompleter import CliCompleter
-from ServiceManager import ServiceManager
+from ServiceManager import ModuleStatus, ServiceManager
+# The service manager creates the config file, so it is imported first
+import config
+from Manifest import Manifest
+from Tracing import Tracer
+from modules.LogArchive import LogArchive
+from modules.LogMultiplexer import LogMultiplexer
+from modules.MetricsCollector import MetricSeries
 from modules.ModuleLoader import ModuleLoader
 
 
@@ -31,11 +43,20 @@ class ConsoleMod(Enum):
 class CLI:
     """A command line service manager"""
 
-    def __init__(self):
-        """Start the interactive service manager"""
+    def __init__(self, profile: bool = False):
+        """Start the interactive service manager
+
+        Args:
+            profile (bool): Show where the time went after every command
+        """
         self._service_manager = ServiceManager()
+        self._profile = profile
+        endpoint = getattr(config, 'tracing_endpoint', None)
+        if None is not endpoint:
+            Tracer.serve(*endpoint)
 
-        self._session = PromptSession(completer=CliCompleter(self._service_manager))
+        self._completer = CliCompleter(self._service_manager)
+        self._session = PromptSession(completer=self._completer)
         self.run()
 
     def run(self):
@@ -54,6 +75,32 @@ class CLI:
     def process_command(self, command: str):
         commandParts = command.strip().split(' ')
 
+        # Trace a single command
+        if 'trace' == commandParts[0]:
+            if 1 == len(commandParts) or '' == commandParts[1]:
+                print("Usage:\ttrace COMMAND")
+                print()
+                print("Run a command and show where its time went")
+                return
+            self._traceCommand(commandParts[1:])
+            return
+        if self._profile:
+            self._traceCommand(commandParts)
+            return
+        with Tracer.span('cli.' + commandParts[0]):
+            self._execute(commandParts)
+
+    def _traceCommand(self, commandParts: list[str]):
+        """Run a command and print the time spent in every span of it"""
+        with Tracer.record() as recording:
+            with Tracer.span('cli.' + commandParts[0]):
+                self._execute(commandParts)
+        print()
+        for (path, calls, total, longest) in Tracer.breakdown(recording):
+            print(" ", ("  " * (len(path) - 1) + path[-1]).ljust(32), f"{total * 1000:9.1f}ms",
+                  f"{calls:5d}x", f"max {longest * 1000:.1f}ms")
+
+    def _execute(self, commandParts: list[str]):
         # Domain commands
         if 'domain' == commandParts[0] or 'dm' == commandParts[0]:
             if 2 > len(commandParts):
@@ -70,11 +117,12 @@ class CLI:
                     print(self._service_manager.currentDomain.name)
                 return
             elif 'list' == commandParts[1] or 'ls' == commandParts[1]:
-                if 0 == len(self._service_manager.domains):
+                domains = self._service_manager.inventory.domains()
+                if 0 == len(domains):
                     print("No domains exist")
                 else:
                     print("Existing domains:")
-                    for domain in self._service_manager.domains:
+                    for domain in domains:
                         print(" ", domain)
                 return
             elif 'select' == commandParts[1] or 'create' == commandParts[1]:
@@ -121,12 +169,13 @@ class CLI:
                     print(self._service_manager.currentSubDomain.name)
                 return
             elif 'list' == commandParts[1] or 'ls' == commandParts[1]:
-                if 0 == len(self._service_manager.currentDomain.loadSubDomains()):
+                subDomains = self._service_manager.inventory.subDomains(self._service_manager.currentDomain.name)
+                if 0 == len(subDomains):
                     print("No subdomains exist")
                 else:
                     print("Existing subdomains:")
-                    for subdomain in self._service_manager.currentDomain.subDomains:
-                        print(" ", subdomain)
+                    for (subdomain, entry) in subDomains.items():
+                        print(" ", subdomain, "(" + entry['module'] + ")" if None is not entry['module'] else "")
                 return
             elif 'select' == commandParts[1] or 'create' == commandParts[1]:
                 if 3 == len(commandParts):
@@ -178,27 +227,52 @@ class CLI:
                     module.save()
                     print("Module", commandParts[2], "added")
                     return
-            # TODO: add a command to show container logs
-            # TODO: add a command to show container status
-            # TODO: add a command to show module status (up/down/warning/error)
             # TODO: add a command to show a modules details
-            elif commandParts[1] in ('up', 'down', 'get', 'current', 'log', 'delete', 'rm', 'clean') and self._service_manager.currentSubDomain.activeModule.isNone():
+            elif commandParts[1] in ('up', 'down', 'get', 'current', 'status', 'log', 'delete', 'rm', 'clean') and self._service_manager.currentSubDomain.activeModule.isNone():
                 print("No module configured for this subdomain")
                 return
             elif 'up' == commandParts[1]:
                 self._service_manager.currentSubDomain.activeModule.up()
+                self._completer.completionCache.invalidateContainers(self._service_manager.currentSubDomain)
                 print("Module", self._service_manager.currentSubDomain.activeModule, "is coming up")
                 return
             elif 'down' == commandParts[1]:
                 self._service_manager.currentSubDomain.activeModule.down()
+                self._completer.completionCache.invalidateContainers(self._service_manager.currentSubDomain)
                 print("Module", self._service_manager.currentSubDomain.activeModule, "is going down")
                 return
             elif 'get' == commandParts[1] or 'current' == commandParts[1]:
                 print(self._service_manager.currentSubDomain.activeModule)
                 return
+            elif 'status' == commandParts[1]:
+                subDomain = self._service_manager.currentSubDomain
+                status = ModuleStatus(subDomain.name, str(subDomain.activeModule), subDomain.activeModule.getContainerStates())
+                print(subDomain, "is", self._colorState(status.state))
+                for container in status.containers:
+                    color = ConsoleMod.FAIL if container in status.problems else ConsoleMod.OKGREEN
+                    health = " (" + container['health'] + ")" if None is not container['health'] else ""
+                    print(" ", container['service'], color.value + container['state'] + health + ConsoleMod.ENDC.value,
+                          container['status'])
+                return
             elif 'log' == commandParts[1]:
-                if 3 == len(commandParts):
-                    self._service_manager.currentSubDomain.activeModule.showContainerLogs(commandParts[2])
+                commandParts, options = self._logOptions(commandParts)
+                module = self._service_manager.currentSubDomain.activeModule
+                dockerApi = self._service_manager.containerWatcher.dockerApi
+                if None is not options and 3 >= len(commandParts):
+                    services = commandParts[2:] or None
+                    if any(name in options.keys() for name in ('text', 'since', 'until')):
+                        self._searchLogs([self._service_manager.currentSubDomain.name], services, options)
+                        return
+                    if not dockerApi.available():
+                        # Without the docker socket only a single service can be followed through compose
+                        if None is not services and 0 == len(options):
+                            module.showContainerLogs(services[0])
+                        else:
+                            print("The docker socket is required to follow several containers or filter lines")
+                        return
+                    multiplexer = LogMultiplexer(dockerApi, **options)
+                    multiplexer.addModule(module, services)
+                    self._followLogs(multiplexer)
                     return
             elif 'command' == commandParts[1] or 'cmd' == commandParts[1]:
                 if 3 <= len(commandParts):
@@ -218,20 +292,412 @@ class CLI:
                 print(" ", "up\t\t\tBring all the modules docker containers up")
                 print(" ", "down\t\t\tTear all the modules docker containers down")
                 print(" ", "get\t (current)\tGet the configured module for the selected subdomain")
+                print(" ", "status\t\tShow the state of the modules containers")
                 print(" ", "list\t (ls)\t\tList all available modules")
                 print(" ", "add\t (create)\tSet the module for the selected subdomain")
-                print(" ", "log\t\t\tShow a containers log output")
+                print(" ", "log [SERVICE]\t\tFollow the log output of one or all containers")
+                print("\t\t\t--grep REGEX only shows matching lines, --rate LINES limits lines per second")
+                print("\t\t\t--search WORDS, --since TIME and --until TIME search the archived log output")
                 print(" ", "command\t (cmd)\tRun an interactive command in a container (default: /bin/bash)")
                 print(" ", "delete (rm|clean)\tDelete any module form the selected subdomain")
                 print(" ", "help\t\t\tDisplay this help")
                 return
+        # Bulk commands
+        elif 'bulk' == commandParts[0]:
+            if 3 > len(commandParts) or commandParts[1] not in ServiceManager.bulkActions:
+                pass
+            else:
+                action = commandParts[1]
+                jobs = None
+                if commandParts[-1].isdigit():
+                    jobs = int(commandParts.pop())
+                subDomains = self._targetSubDomains(commandParts[2:])
+                if None is not subDomains:
+                    if 0 == len(subDomains):
+                        print("No matching subdomains")
+                        return
+
+                    def printResult(result):
+                        status = (ConsoleMod.OKGREEN.value + "ok" if result.success else ConsoleMod.FAIL.value + "failed") + ConsoleMod.ENDC.value
+                        print(" ", status, result.subDomain, f"({result.seconds:.1f}s)", result.message)
+
+                    print("Running", action, "on", len(subDomains), "subdomains")
+                    results = self._service_manager.bulk(action, subDomains, jobs, printResult)
+                    self._completer.completionCache.invalidateContainers()
+                    failed = [result for result in results if not result.success]
+                    print(len(results) - len(failed), "succeeded,", len(failed), "failed")
+                    for result in failed:
+                        print(" ", ConsoleMod.FAIL.value + str(result.subDomain) + ConsoleMod.ENDC.value, result.message)
+                    return
+            print("Usage:\tbulk ACTION TARGET [JOBS]")
+            print()
+            print("Available Actions:")
+            print(" ", "up\t\tBring the modules of all targeted subdomains up")
+            print(" ", "down\t\tTear the modules of all targeted subdomains down")
+            print(" ", "restart\tTear the modules of all targeted subdomains down and bring them up again")
+            print()
+            print("Available Targets:")
+            print(" ", "all\t\t\tEvery subdomain of every top level domain")
+            print(" ", "domain (dm) DOMAIN\tEvery subdomain of a top level domain")
+            print(" ", "module (md) MODULE\tEvery subdomain running a module type")
+            print()
+            print("JOBS limits how many modules are handled at the same time (default: bulk_concurrency)")
+            return
+        # Certificate commands
+        elif 'certificate' == commandParts[0] or 'cert' == commandParts[0]:
+            certificateQueue = CertificateQueue.forRootDir(self._service_manager.inventory.rootDir)
+            if 2 > len(commandParts):
+                pass
+            elif 'status' == commandParts[1]:
+                statuses = certificateQueue.statuses()
+                if 0 == len(statuses):
+                    print("No certificates requested")
+                for (name, (state, message, _)) in sorted(statuses.items()):
+                    color = {'issued': ConsoleMod.OKGREEN, 'failed': ConsoleMod.FAIL}.get(state, ConsoleMod.WARNING)
+                    print(" ", color.value + state + ConsoleMod.ENDC.value, name, message)
+                return
+            elif 'expiring' == commandParts[1] or 'renew-expiring' == commandParts[1]:
+                if 3 == len(commandParts) and not commandParts[2].isdigit():
+                    pass
+                else:
+                    days = int(commandParts[2]) if 3 == len(commandParts) else None
+                    if 'expiring' == commandParts[1]:
+                        expiring = self._service_manager.expiringCertificates(days)
+                        if 0 == len(expiring):
+                            print("No certificates expiring")
+                        for (subDomain, notAfter) in expiring:
+                            daysLeft = (notAfter - time()) / 86400
+                            color = ConsoleMod.FAIL if daysLeft < 7 else ConsoleMod.WARNING
+                            print(" ", color.value + f"{daysLeft:.0f} days" + ConsoleMod.ENDC.value, subDomain)
+                    else:
+                        rebuilt, scheduled = self._service_manager.renewExpiringCertificates(days)
+                        for subDomain in rebuilt:
+                            print(" ", ConsoleMod.OKGREEN.value + "rebuilt" + ConsoleMod.ENDC.value, subDomain)
+                        for subDomain in scheduled:
+                            print(" ", ConsoleMod.WARNING.value + "scheduled" + ConsoleMod.ENDC.value, subDomain,
+                                  subDomain.certificateQueue.status(subDomain.name)[1])
+                        print(len(rebuilt), "rebuilt,", len(scheduled), "scheduled for renewal")
+                    return
+            elif 'request' == commandParts[1] or 'renew' == commandParts[1]:
+                if None is self._service_manager.currentSubDomain:
+                    print("No subdomain selected")
+                    return
+                state = certificateQueue.request(self._service_manager.currentSubDomain, 'renew' == commandParts[1])
+                print("Certificate for", self._service_manager.currentSubDomain, "is", state)
+                return
+            print("Usage:\tcertificate COMMAND")
+            print("\tcert COMMAND")
+            print()
+            print("Available Commands:")
+            print(" ", "status\t\tShow the state of all certificate requests")
+            print(" ", "request\tRequest a certificate for the selected subdomain in the background")
+            print(" ", "renew\t\tRenew the certificate of the selected subdomain, even if it is still valid")
+            print(" ", "expiring [DAYS]\tList certificates expiring within DAYS (default: certificate_renewal_days)")
+            print(" ", "renew-expiring [DAYS]\tRenew all certificates expiring within DAYS, spread over time")
+            print(" ", "help\t\tDisplay this help")
+            return
+        # Log output of many subdomains
+        elif 'log' == commandParts[0]:
+            commandParts, options = self._logOptions(commandParts)
+            if 2 == len(commandParts) and 'collect' == commandParts[1]:
+                print("Archived", self._service_manager.collectLogs(), "new lines")
+                return
+            subDomains = self._targetSubDomains(commandParts[1:]) if None is not options else None
+            if None is not subDomains and any(name in options.keys() for name in ('text', 'since', 'until')):
+                self._searchLogs([subDomain.name for subDomain in subDomains], None, options)
+                return
+            if None is not subDomains:
+                dockerApi = self._service_manager.containerWatcher.dockerApi
+                if not dockerApi.available():
+                    print("The docker socket is required to follow several containers")
+                    return
+                multiplexer = LogMultiplexer(dockerApi, **options)
+                for subDomain in subDomains:
+                    if not subDomain.activeModule.isNone():
+                        multiplexer.addModule(subDomain.activeModule)
+                self._followLogs(multiplexer)
+                return
+            print("Usage:\tlog TARGET [--grep REGEX] [--rate LINES]")
+            print("\tlog TARGET [--search WORDS] [--since TIME] [--until TIME] [--grep REGEX]")
+            print("\tlog collect")
+            print()
+            print("Follow the log output of all containers of the targeted subdomains at once,")
+            print("search their archived log output or archive the new output of all containers")
+            print()
+            print("Available Targets:")
+            print(" ", "all\t\t\tEvery subdomain of every top level domain")
+            print(" ", "domain (dm) DOMAIN\tEvery subdomain of a top level domain")
+            print(" ", "module (md) MODULE\tEvery subdomain running a module type")
+            print()
+            print("--grep REGEX only shows lines matching the regular expression")
+            print("--rate LINES shows at most LINES lines per second and container")
+            print("--search WORDS only shows archived lines containing all comma separated words")
+            print("--since/--until TIME limit the search, e.g. 2h, 7d, 2024-05-01 or 2024-05-01T13:30")
+            return
+        # Resource metrics
+        elif 'metrics' == commandParts[0]:
+            collector = self._service_manager.metricsCollector
+            if 2 > len(commandParts):
+                pass
+            elif commandParts[1] in ('top', 'modules') and 4 >= len(commandParts):
+                metric = commandParts[2] if 3 <= len(commandParts) else 'cpu'
+                metric = {'net': 'netRx', 'network': 'netRx', 'block': 'blockWrite', 'mem': 'memory'}.get(metric, metric)
+                count = commandParts[3] if 4 == len(commandParts) else '10'
+                if metric in MetricSeries.metrics and count.isdigit():
+                    if not self._startMetrics():
+                        return
+                    top = collector.top(metric, int(count), 'modules' == commandParts[1])
+                    if 0 == len(top):
+                        print("No samples yet, the first ones are taken within", collector.interval, "seconds")
+                        return
+                    width = max(len(name) for (name, _) in top)
+                    print(" ", "".ljust(width), "CPU".rjust(7), "MEMORY".rjust(10), "NET IN/OUT".rjust(23),
+                          "BLOCK READ/WRITE".rjust(23))
+                    for (name, values) in top:
+                        print(" ", name.ljust(width), f"{values['cpu']:6.1f}%", self._formatBytes(values['memory']).rjust(10),
+                              (self._formatBytes(values['netRx']) + "/s / " + self._formatBytes(values['netTx']) + "/s").rjust(23),
+                              (self._formatBytes(values['blockRead']) + "/s / " + self._formatBytes(values['blockWrite']) + "/s").rjust(23))
+                    return
+            elif 'history' == commandParts[1] and 3 >= len(commandParts):
+                name = commandParts[2] if 3 == len(commandParts) else None
+                if None is name and None is not self._service_manager.currentSubDomain:
+                    name = self._service_manager.currentSubDomain.name
+                if None is not name:
+                    if not self._startMetrics():
+                        return
+                    series = collector.history(name)
+                    if None is series:
+                        print("No samples of", name, "yet")
+                        return
+                    seconds = series.count * collector.interval
+                    print(name, "over the last", f"{seconds:.0f} seconds:" if 120 > seconds else f"{seconds / 60:.0f} minutes:")
+                    for metric in MetricSeries.metrics:
+                        values = series.history(metric)
+                        unit = '' if 'memory' == metric else '/s'
+                        formatted = [f"{value:.1f}%" if 'cpu' == metric else self._formatBytes(value) + unit for value in
+                                     (min(values), sum(values) / len(values), max(values))]
+                        print(" ", metric.ljust(10), self._sparkline(values[-60:]), "min", formatted[0], "avg",
+                              formatted[1], "max", formatted[2])
+                    return
+            print("Usage:\tmetrics COMMAND")
+            print()
+            print("Available Commands:")
+            print(" ", "top [METRIC] [N]\tShow the N subdomains using the most of a metric (default: cpu 10)")
+            print(" ", "modules [METRIC] [N]\tShow the N module types using the most of a metric")
+            print(" ", "history [NAME]\tShow the recent usage of a subdomain or module type (default: selected subdomain)")
+            print(" ", "help\t\t\tDisplay this help")
+            print()
+            print("Metrics: cpu, memory, netRx, netTx, blockRead, blockWrite")
+            return
+        # Declarative manifests
+        elif 'plan' == commandParts[0] or 'apply' == commandParts[0]:
+            jobs = None
+            if 3 == len(commandParts) and 'apply' == commandParts[0] and commandParts[2].isdigit():
+                jobs = int(commandParts.pop())
+            if 2 != len(commandParts) or '' == commandParts[1]:
+                print("Usage:\tplan FILE")
+                print("\tapply FILE [JOBS]")
+                print()
+                print("Show or make the changes needed to bring all subdomains to the state of a manifest")
+                print("JOBS limits how many subdomains are handled at the same time (default: bulk_concurrency)")
+                return
+            try:
+                manifest = Manifest.load(commandParts[1])
+            except (OSError, ValueError) as e:
+                print("Invalid manifest:", str(e).replace("\n", "\n  "))
+                return
+            changes = manifest.plan(self._service_manager)
+            if 0 == len(changes):
+                print("Nothing to do, all subdomains match the manifest")
+                return
+            symbols = {'create': ConsoleMod.OKGREEN.value + "+", 'remove': ConsoleMod.FAIL.value + "-",
+                       'replace': ConsoleMod.FAIL.value + "-/+"}
+            for change in changes:
+                print(" ", symbols.get(change.action, ConsoleMod.WARNING.value + "~"), change.action + ConsoleMod.ENDC.value,
+                      change.subDomainName, change.reason)
+                for (name, (old, new)) in change.env.items():
+                    print("\t", name + ":", old, "->", new)
+            counts = {action: len([change for change in changes if action == change.action])
+                      for action in dict.fromkeys(change.action for change in changes)}
+            print(', '.join(f"{count} to {action}" for (action, count) in counts.items()))
+            if 'plan' == commandParts[0]:
+                return
+
+            def printResult(result):
+                status = (ConsoleMod.OKGREEN.value + "ok" if result.success else ConsoleMod.FAIL.value + "failed") + ConsoleMod.ENDC.value
+                print(" ", status, result.action, result.subDomain, f"({result.seconds:.1f}s)", result.message)
+
+            results = Manifest.apply(self._service_manager, changes, jobs, printResult)
+            self._completer.completionCache.invalidateContainers()
+            failed = [result for result in results if not result.success]
+            print(len(results) - len(failed), "succeeded,", len(failed), "failed")
+            for result in failed:
+                print(" ", ConsoleMod.FAIL.value + str(result.subDomain) + ConsoleMod.ENDC.value, result.message)
+            return
+        # Status of many subdomains
+        elif 'status' == commandParts[0]:
+            if 2 == len(commandParts) and '--all' != commandParts[1]:
+                print("Usage:\tstatus [--all]")
+                print()
+                print("Show the state of every subdomain of the selected top level domain")
+                print("With --all or without a selected domain every subdomain of every top level domain is shown")
+                return
+            domainName = None
+            if 1 == len(commandParts) and None is not self._service_manager.currentDomain:
+                domainName = self._service_manager.currentDomain.name
+            try:
+                statuses = self._service_manager.fleetStatus(domainName)
+            except (OSError, RuntimeError) as e:
+                print("Docker can't be reached:", e)
+                return
+            if 0 == len(statuses):
+                print("No modules configured")
+                return
+            nameWidth = max(len(status.subDomainName) for status in statuses)
+            moduleWidth = max(len(status.module) for status in statuses)
+            for status in statuses:
+                problems = ', '.join(container['service'] + ' ' + (container['health'] or container['state'])
+                                     for container in status.problems)
+                print(" ", status.subDomainName.ljust(nameWidth), status.module.ljust(moduleWidth),
+                      self._colorState(status.state.ljust(8)), f"{status.running}/{len(status.containers)}", problems)
+            counts = {state: len([status for status in statuses if state == status.state])
+                      for state in ('up', 'degraded', 'down')}
+            print(counts['up'], "up,", counts['degraded'], "degraded,", counts['down'], "down")
+            return
         # Display help
         print("Available Commands:")
         print(" ", "domain\t(dm)\tManage top level domains")
         print(" ", "subdomain\t(sd)\tManage subdomains of the currently selected top level domain")
         print(" ", "module\t(md)\tManage the module of the currently selected subdomain")
+        print(" ", "bulk\t\tRun module commands on many subdomains at once")
+        print(" ", "certificate\t(cert)\tManage ssl certificates")
+        print(" ", "log\t\tFollow the log output of many subdomains at once")
+        print(" ", "metrics\t\tShow the resource usage of subdomains and module types")
+        print(" ", "status\t\tShow the state of all subdomains, --all for every top level domain")
+        print(" ", "plan\t\tShow the changes needed to match a manifest file")
+        print(" ", "apply\t\tChange all subdomains to match a manifest file")
+        print(" ", "trace\t\tRun a command and show where its time went")
+
+    def _targetSubDomains(self, target: list[str]) -> list:
+        """Resolve a bulk target (all, domain DOMAIN or module MODULE), None if it is invalid"""
+        if 1 == len(target) and 'all' == target[0]:
+            return self._service_manager.allSubDomains()
+        elif 2 == len(target) and target[0] in ('domain', 'dm'):
+            return self._service_manager.subDomainsOf(target[1])
+        elif 2 == len(target) and target[0] in ('module', 'md'):
+            return self._service_manager.subDomainsWithModule(target[1])
+        return None
+
+    @staticmethod
+    def _logOptions(commandParts: list[str]) -> tuple[list[str], dict]:
+        """Split the options off a log command
+
+        --grep REGEX and --rate LINES are options of the log multiplexer,
+        --search WORDS, --since TIME and --until TIME search the log archive.
+
+        Returns:
+            tuple[list[str], dict]: The remaining command parts and the options, None if an option is invalid
+        """
+        parts = list()
+        options = dict()
+        names = {'--grep': 'pattern', '--rate': 'maxRate', '--search': 'text', '--since': 'since', '--until': 'until'}
+        remaining = iter(commandParts)
+        for part in remaining:
+            if part not in names.keys():
+                parts.append(part)
+                continue
+            value = next(remaining, None)
+            try:
+                if '--grep' == part:
+                    options['pattern'] = re.compile(value).pattern
+                elif '--rate' == part:
+                    options['maxRate'] = float(value)
+                elif '--search' == part:
+                    options['text'] = value.replace(',', ' ')
+                else:
+                    options[names[part]] = CLI._parseTime(value)
+            except (TypeError, ValueError, AttributeError, re.error):
+                return parts, None
+        if any(name in options.keys() for name in ('text', 'since', 'until')) and 'maxRate' in options.keys():
+            return parts, None
+        return parts, options
+
+    @staticmethod
+    def _parseTime(value: str) -> float:
+        """Parse an absolute local time (2024-05-01 or 2024-05-01T13:30) or one relative to now (30m, 2h, 7d)"""
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        if value[-1:] in units.keys() and value[:-1].isdigit():
+            return time() - int(value[:-1]) * units[value[-1]]
+        return datetime.fromisoformat(value).timestamp()
+
+    def _searchLogs(self, subDomainNames: list[str], services: list[str], options: dict):
+        """Print the archived log lines matching the options of a log command"""
+        archive = LogArchive.forRootDir(self._service_manager.rootDir)
+        # Lines written since the last collection are archived first
+        print("Archived", self._service_manager.collectLogs(subDomainNames), "new lines")
+        count = 0
+        for (subDomainName, service, timestamp, streamName, text) in archive.search(subDomainNames, services, **options):
+            localTime = datetime.fromisoformat(timestamp[:19] + '+00:00').astimezone().strftime('%Y-%m-%d %H:%M:%S')
+            print(ConsoleMod.OKBLUE.value + localTime, subDomainName, service, '|' + ConsoleMod.ENDC.value, text)
+            count += 1
+        print(count, "matching lines")
+
+    def _followLogs(self, multiplexer: LogMultiplexer):
+        """Print the lines of a log multiplexer until all containers stopped or Ctrl+C is pressed"""
+        if 0 == len(multiplexer.sources):
+            print("No running containers")
+            return
+        colors = (ConsoleMod.OKBLUE, ConsoleMod.OKGREEN, ConsoleMod.WARNING, ConsoleMod.HEADER)
+        width = max(len(source.label + source.service) + 1 for source in multiplexer.sources)
+        prefixes = {source: (colors[index % len(colors)].value + (source.label + ' ' + source.service).ljust(width)
+                             + ' |' + ConsoleMod.ENDC.value) for (index, source) in enumerate(multiplexer.sources)}
+        multiplexer.start()
+        try:
+            for (source, streamName, text) in multiplexer.lines():
+                if 'notice' == streamName:
+                    text = ConsoleMod.FAIL.value + text + ConsoleMod.ENDC.value
+                print(prefixes[source], text)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            multiplexer.close()
+        print('Log output ended')
+
+    def _startMetrics(self) -> bool:
+        """Start collecting metrics if that didn't happen yet, False if docker can't be reached"""
+        collector = self._service_manager.metricsCollector
+        if collector.running:
+            return True
+        if not collector.dockerApi.available():
+            print("The docker socket is required to collect metrics")
+            return False
+        self._service_manager.startMetrics()
+        print("Started collecting metrics every", collector.interval, "seconds")
+        return True
+
+    @staticmethod
+    def _formatBytes(value: float) -> str:
+        """Format a number of bytes with a binary unit"""
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if 1024 > abs(value):
+                return f"{value:.1f}{unit}" if 'B' != unit else f"{value:.0f}B"
+            value /= 1024
+        return f"{value:.1f}TiB"
+
+    @staticmethod
+    def _sparkline(values: list[float]) -> str:
+        """Draw values as a line of block characters"""
+        blocks = '▁▂▃▄▅▆▇█'
+        highest = max(values, default=0) or 1
+        return ''.join(blocks[min(len(blocks) - 1, int(value / highest * len(blocks)))] for value in values)
+
+    @staticmethod
+    def _colorState(state: str) -> str:
+        """Color a module state for the console"""
+        color = {'up': ConsoleMod.OKGREEN, 'degraded': ConsoleMod.WARNING}.get(state.strip(), ConsoleMod.FAIL)
+        return color.value + state + ConsoleMod.ENDC.value
 
 
 if __name__ == '__main__':
-    # Open the command line interface
-    CLI()
+    # Open the command line interface, --profile traces every command
+    CLI('--profile' in sys.argv[1:])
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import json
+from base64 import b64decode
+from calendar import timegm
+from os import makedirs, stat
+from os.path import dirname, isdir, isfile, join
+from threading import RLock
+from time import strptime, time
+
+from AtomicFile import atomicWrite
+
+
+class CertificateInventory:
+    """Expiry dates of the combined certificate files haproxy uses
+
+    Every certificate is only parsed when its file changed, the dates are kept in `tmp/certificates.json` below the
+    root directory together with the mtime and size of the file they were read from.
+    """
+    # One inventory per root directory
+    _instances: dict[str, 'CertificateInventory'] = dict()
+
+    @classmethod
+    def forRootDir(cls, rootDir: str) -> 'CertificateInventory':
+        """Get the shared certificate inventory of a root directory
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            CertificateInventory: The certificate inventory
+        """
+        if rootDir not in cls._instances.keys():
+            cls._instances[rootDir] = cls(rootDir)
+        return cls._instances[rootDir]
+
+    def __init__(self, rootDir: str):
+        """
+        Args:
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.rootDir = rootDir
+        self.indexFile = join(self.rootDir, 'tmp', 'certificates.json')
+        self._lock = RLock()
+        # Certificate file -> (mtime, size, notAfter)
+        self._entries: dict[str, tuple[int, int, float]] = dict()
+        if isfile(self.indexFile):
+            try:
+                with open(self.indexFile, 'r') as indexFile:
+                    self._entries = {path: tuple(entry) for (path, entry) in json.load(indexFile).items()}
+            except (OSError, ValueError):
+                pass
+
+    def notAfter(self, certificate: str) -> float:
+        """When a certificate expires
+
+        Args:
+            certificate (string): Location of the certificate file
+
+        Returns:
+            float: Expiry as a unix timestamp, None if the file doesn't exist or can't be read
+        """
+        return self.notAfters([certificate]).get(certificate)
+
+    def notAfters(self, certificates: list[str]) -> dict[str, float]:
+        """When certificates expire, only changed files are parsed
+
+        Args:
+            certificates (list[str]): Locations of the certificate files
+
+        Returns:
+            dict[str, float]: Expiry of every readable certificate as a unix timestamp
+        """
+        with self._lock:
+            changed = False
+            result = dict()
+            for certificate in certificates:
+                try:
+                    fileStat = stat(certificate)
+                except OSError:
+                    changed |= None is not self._entries.pop(certificate, None)
+                    continue
+                entry = self._entries.get(certificate)
+                if None is entry or (fileStat.st_mtime_ns, fileStat.st_size) != entry[:2]:
+                    notAfter = self._parseFile(certificate)
+                    if None is notAfter:
+                        continue
+                    entry = (fileStat.st_mtime_ns, fileStat.st_size, notAfter)
+                    self._entries[certificate] = entry
+                    changed = True
+                result[certificate] = entry[2]
+            if changed:
+                self._save()
+            return result
+
+    def expiring(self, certificates: list[str], days: float) -> dict[str, float]:
+        """Certificates expiring within a number of days
+
+        Args:
+            certificates (list[str]): Locations of the certificate files
+            days (float): Number of days from now
+
+        Returns:
+            dict[str, float]: Expiry of the expiring certificates, the soonest first
+        """
+        limit = time() + days * 86400
+        notAfters = self.notAfters(certificates)
+        return {certificate: notAfter for (certificate, notAfter) in sorted(notAfters.items(), key=lambda item: item[1])
+                if notAfter < limit}
+
+    def _save(self):
+        """Write the index file"""
+        if not isdir(dirname(self.indexFile)):
+            makedirs(dirname(self.indexFile))
+        atomicWrite(self.indexFile, json.dumps(self._entries))
+
+    @classmethod
+    def _parseFile(cls, certificate: str) -> float:
+        """Read the expiry of the first certificate in a pem file, None if there is none"""
+        try:
+            with open(certificate, 'r') as certificateFile:
+                pem = certificateFile.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+        begin = pem.find('-----BEGIN CERTIFICATE-----')
+        end = pem.find('-----END CERTIFICATE-----', begin)
+        if -1 == begin or -1 == end:
+            return None
+        try:
+            return cls.parseNotAfter(b64decode(pem[begin + 27:end]))
+        except (ValueError, IndexError):
+            return None
+
+    @classmethod
+    def parseNotAfter(cls, der: bytes) -> float:
+        """Read the expiry of a DER encoded X.509 certificate
+
+        Only the few ASN.1 elements in front of the validity are walked, nothing else is decoded.
+
+        Args:
+            der (bytes): The certificate
+
+        Returns:
+            float: Expiry as a unix timestamp
+        """
+        # Certificate ::= SEQUENCE { tbsCertificate SEQUENCE { ... } ... }
+        _, start, _ = cls._element(der, 0, 0x30)
+        _, offset, _ = cls._element(der, start, 0x30)
+        # Skip the optional explicit version, the serial number, the signature algorithm and the issuer
+        if 0xA0 == der[offset]:
+            offset = cls._element(der, offset)[2]
+        for tag in (0x02, 0x30, 0x30):
+            offset = cls._element(der, offset, tag)[2]
+        # Validity ::= SEQUENCE { notBefore Time, notAfter Time }
+        _, offset, _ = cls._element(der, offset, 0x30)
+        offset = cls._element(der, offset)[2]
+        tag, start, end = cls._element(der, offset)
+        value = der[start:end].decode('ascii')
+        if 0x17 == tag:
+            # UTCTime uses two digit years, 50 to 99 are in the 20th century
+            value = ('19' if '50' <= value[:2] else '20') + value
+        elif 0x18 != tag:
+            raise ValueError('Unexpected ASN.1 time type ' + hex(tag))
+        return float(timegm(strptime(value[:14], '%Y%m%d%H%M%S')))
+
+    @staticmethod
+    def _element(der: bytes, offset: int, expectedTag: int = None) -> tuple[int, int, int]:
+        """Read the header of a DER element
+
+        Args:
+            der (bytes): The DER data
+            offset (int): Where the element starts
+            expectedTag (int): Raise a ValueError if the element has another tag
+
+        Returns:
+            tuple[int, int, int]: The elements tag and where its content starts and ends
+        """
+        tag = der[offset]
+        if None is not expectedTag and expectedTag != tag:
+            raise ValueError(f'Expected ASN.1 tag {hex(expectedTag)}, found {hex(tag)}')
+        length = der[offset + 1]
+        offset += 2
+        if length & 0x80:
+            lengthBytes = length & 0x7f
+            length = int.from_bytes(der[offset:offset + lengthBytes], 'big')
+            offset += lengthBytes
+        if offset + length > len(der):
+            raise ValueError('Truncated ASN.1 element')
+        return tag, offset, offset + length
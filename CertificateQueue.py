@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+
+import json
+from os import makedirs
+from os.path import dirname, getmtime, isdir, isfile, join
+from subprocess import run
+from threading import Condition, Thread
+from time import localtime, strftime, time
+
+import config
+from Haproxy import Haproxy
+from AtomicFile import atomicWrite
+from Tracing import Tracer
+
+
+class CertificateQueue:
+    """Issues ssl certificates with certbot in a background thread
+
+    Requests return immediately, the same subdomain is only queued once. With `certificate_grouping` all queued
+    subdomains of a top level domain are issued together as one certificate with multiple names.
+    certbot is run at most `certificate_rate_limit` times per time window and failed subdomains are retried later
+    with a growing delay, so the certificate authoritys rate limits are never hit.
+    The run history and the names of grouped certificates are kept in `tmp/certificates-queue.json`.
+    """
+    # One queue per root directory
+    _instances: dict[str, 'CertificateQueue'] = dict()
+    # Seconds to wait for more requests before issuing grouped certificates
+    collectDelay = 1
+
+    @classmethod
+    def forRootDir(cls, rootDir: str) -> 'CertificateQueue':
+        """Get the shared certificate queue of a root directory
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            CertificateQueue: The certificate queue
+        """
+        if rootDir not in cls._instances.keys():
+            cls._instances[rootDir] = cls(rootDir)
+        return cls._instances[rootDir]
+
+    def __init__(self, rootDir: str):
+        """
+        Args:
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.rootDir = rootDir
+        self.stateFile = join(self.rootDir, 'tmp', 'certificates-queue.json')
+        self.grouping = getattr(config, 'certificate_grouping', False)
+        self.rateLimit = getattr(config, 'certificate_rate_limit', (5, 3600))
+        self.retryDelay = getattr(config, 'certificate_retry_delay', 600)
+        # Where certbot stores its certificates
+        self.certbotConfigDir = getattr(config, 'certbot_config_dir', join('/', 'etc', 'letsencrypt'))
+        self.liveDir = join(self.certbotConfigDir, 'live')
+        self._condition = Condition()
+        self._worker: Thread = None
+        # Subdomain name -> (subdomain, force renewal) of queued requests
+        self._queued: dict[str, tuple] = dict()
+        # Subdomain name -> (state, message, time) of every request
+        self._status: dict[str, tuple[str, str, float]] = dict()
+        # Subdomain name -> (failed attempts, time of the next attempt)
+        self._failures: dict[str, tuple[int, float]] = dict()
+        # Subdomain name -> earliest time of scheduled requests
+        self._notBefore: dict[str, float] = dict()
+        # Times certbot was run and names of each grouped certificate
+        self._runs: list[float] = list()
+        self._groups: dict[str, list[str]] = dict()
+        self._lastRequest = 0
+        self._load()
+
+    def _load(self):
+        """Load the run history and certificate groups"""
+        if not isfile(self.stateFile):
+            return
+        try:
+            with open(self.stateFile, 'r') as stateFile:
+                state = json.load(stateFile)
+        except (OSError, ValueError):
+            return
+        self._runs = state.get('runs', list())
+        self._groups = state.get('groups', dict())
+
+    def _save(self):
+        """Save the run history and certificate groups"""
+        if not isdir(dirname(self.stateFile)):
+            makedirs(dirname(self.stateFile))
+        atomicWrite(self.stateFile, json.dumps({'runs': self._runs, 'groups': self._groups}))
+
+    def request(self, subDomain, force: bool = False, notBefore: float = None) -> str:
+        """Queue a certificate for a subdomain
+
+        Args:
+            subDomain (SubDomain): The subdomain that needs a certificate
+            force (bool): Renew the certificate even if it is still valid
+            notBefore (float): Unix timestamp the certificate is issued at the earliest, as soon as possible if omitted
+
+        Returns:
+            string: The requests state
+        """
+        with self._condition:
+            name = subDomain.name
+            if name in self._queued.keys() or 'issuing' == self.status(name)[0]:
+                return self.status(name)[0]
+            self._queued[name] = (subDomain, force)
+            self._failures.pop(name, None)
+            self._lastRequest = time()
+            if None is not notBefore and notBefore > time():
+                self._notBefore[name] = notBefore
+                self._setStatus(name, 'scheduled', strftime('at %Y-%m-%d %H:%M', localtime(notBefore)))
+                self._ensureWorker()
+                return 'scheduled'
+            self._notBefore.pop(name, None)
+            self._setStatus(name, 'queued')
+            self._ensureWorker()
+            return 'queued'
+
+    def _ensureWorker(self):
+        """Start the worker thread if it isn't running and wake it up"""
+        with self._condition:
+            if None is self._worker or not self._worker.is_alive():
+                self._worker = Thread(target=self._work, name='CertificateQueue', daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+
+    def status(self, name: str) -> tuple[str, str, float]:
+        """The state of a subdomains latest request
+
+        Args:
+            name (string): Name of the subdomain
+
+        Returns:
+            tuple[str, str, float]: The state (queued, scheduled, waiting, issuing, issued or failed),
+                a message and when the state was reached, None if no certificate was requested
+        """
+        return self._status.get(name, (None, '', None))
+
+    def statuses(self) -> dict[str, tuple[str, str, float]]:
+        """The states of all requests by subdomain name"""
+        with self._condition:
+            return dict(self._status)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until no request is queued or being issued anymore
+
+        Args:
+            timeout (float): Seconds to wait at most
+
+        Returns:
+            bool: Whether all requests are done
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: 0 == len(self._queued) and not self._issuing(), timeout)
+
+    def _issuing(self) -> bool:
+        """Whether certbot is running right now"""
+        return any('issuing' == state for (state, _, _) in self._status.values())
+
+    def _setStatus(self, name: str, state: str, message: str = ''):
+        """Record the state of a request and wake up anyone waiting for it"""
+        self._status[name] = (state, message, time())
+        self._condition.notify_all()
+
+    def _delay(self) -> float:
+        """Seconds until certbot may be run again, 0 if it can be run right away"""
+        now = time()
+        maxRuns, window = self.rateLimit
+        self._runs = [runTime for runTime in self._runs if now - runTime < window]
+        rateDelay = self._runs[0] + window - now if len(self._runs) >= maxRuns else 0
+        # Only retry failed requests once their delay has passed and wait for scheduled requests
+        readyDelay = min(self._readyAt(name, now) - now for name in self._queued.keys())
+        return max(rateDelay, readyDelay, 0)
+
+    def _readyAt(self, name: str, now: float) -> float:
+        """When a queued request may be issued"""
+        return max(self._failures.get(name, (0, now))[1], self._notBefore.get(name, now))
+
+    def _work(self):
+        """Issue queued certificates, one certbot run at a time"""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: 0 < len(self._queued))
+                # Give subdomains that are set up together the chance to share a certificate
+                if self.grouping and time() < self._lastRequest + self.collectDelay:
+                    self._condition.wait(self._lastRequest + self.collectDelay - time())
+                    continue
+                delay = self._delay()
+                if 0 < delay:
+                    for name in self._queued.keys():
+                        (state, message, _) = self.status(name)
+                        if state not in ('waiting', 'scheduled'):
+                            # Keep telling why a failed request is waiting
+                            prefix = message + ', ' if 'failed' == state else ''
+                            self._setStatus(name, 'waiting', f'{prefix}next attempt in {delay:.0f}s')
+                    self._condition.wait(delay)
+                    continue
+                batch = self._nextBatch()
+                for (subDomain, _) in batch:
+                    self._setStatus(subDomain.name, 'issuing')
+            # Any error has to fail the batch, otherwise the worker would end and waiting callers hang
+            try:
+                success, message = self._issue(batch)
+                if success and config.Proxy.haproxy == config.used_proxy:
+                    Haproxy.updateCertificates([subDomain for (subDomain, _) in batch])
+            except Exception as e:
+                success, message = False, str(e)
+            with self._condition:
+                for (subDomain, force) in batch:
+                    if success:
+                        self._setStatus(subDomain.name, 'issued')
+                        continue
+                    # Try again later, waiting longer after every failure
+                    attempts = self._failures.get(subDomain.name, (0, 0))[0] + 1
+                    self._failures[subDomain.name] = (attempts, time() + self.retryDelay * 2 ** (attempts - 1))
+                    self._setStatus(subDomain.name, 'failed', message)
+                    if attempts < 5:
+                        self._queued.setdefault(subDomain.name, (subDomain, force))
+
+    def _nextBatch(self) -> list[tuple]:
+        """Take the requests issued with the next certbot run out of the queue"""
+        now = time()
+        ready = [name for name in self._queued.keys() if self._readyAt(name, now) <= now]
+        for name in ready:
+            self._notBefore.pop(name, None)
+        first = self._queued[ready[0]][0]
+        if self.grouping:
+            names = [name for name in ready if self._queued[name][0].topLevelDomain.name == first.topLevelDomain.name]
+        else:
+            names = ready[:1]
+        return [self._queued.pop(name) for name in names]
+
+    @Tracer.traced('certbot')
+    def _issue(self, batch: list[tuple]) -> tuple[bool, str]:
+        """Run certbot for a batch of subdomains and install the new certificate
+
+        Args:
+            batch (list[tuple]): The subdomains and whether renewal is forced
+
+        Returns:
+            tuple[bool, str]: Whether the certificate was issued and certbots last output line
+        """
+        names = [subDomain.name for (subDomain, _) in batch]
+        if self.grouping:
+            certName = batch[0][0].topLevelDomain.name
+            # Keep all names already on the certificate, certbot would drop them otherwise
+            domains = sorted(set(self._groups.get(certName, list())) | set(names))
+        else:
+            certName = names[0]
+            domains = names
+        args = list(getattr(config, 'certbot_command', ['certbot']))
+        args += ['certonly', '--standalone', '--cert-name', certName, '--config-dir', self.certbotConfigDir]
+        for domain in domains:
+            args += ['-d', domain]
+        args += ['--non-interactive', '--agree-tos', '--expand', '--http-01-port=8888',
+                 '--email', getattr(config, 'certbot_email', 'alexander@h-software.de')]
+        if any(force for (_, force) in batch):
+            args.append('--force-renewal')
+
+        with self._condition:
+            self._runs.append(time())
+            self._save()
+        result = run(args, capture_output=True, text=True)
+        output = (result.stdout + result.stderr).strip().splitlines()
+        message = output[-1] if 0 < len(output) else ''
+        if 0 != result.returncode:
+            return False, message
+
+        if self.grouping:
+            with self._condition:
+                self._groups[certName] = domains
+                self._save()
+        for (subDomain, _) in batch:
+            self._install(subDomain, certName)
+        return True, message
+
+    def certificateName(self, subDomain) -> str:
+        """Name of the certbot certificate a subdomains certificate is built from"""
+        topLevelDomain = subDomain.topLevelDomain.name
+        if subDomain.name in self._groups.get(topLevelDomain, list()):
+            return topLevelDomain
+        return subDomain.name
+
+    def rebuild(self, subDomain) -> bool:
+        """Rebuild the combined certificate file if certbot renewed the certificate on its own
+
+        Args:
+            subDomain (SubDomain): The subdomain
+
+        Returns:
+            bool: Whether the combined file was rebuilt
+        """
+        certName = self.certificateName(subDomain)
+        fullchain = join(self.liveDir, certName, 'fullchain.pem')
+        certFile = subDomain._sslCertificateFile
+        if not isfile(fullchain) or (isfile(certFile) and getmtime(fullchain) <= getmtime(certFile)):
+            return False
+        self._install(subDomain, certName)
+        return True
+
+    def _install(self, subDomain, certName: str):
+        """Create the combined certificate file haproxy uses for a subdomain
+
+        Args:
+            subDomain (SubDomain): The subdomain
+            certName (string): Name of the certbot certificate
+        """
+        certFile = subDomain._sslCertificateFile
+        if not isdir(dirname(certFile)):
+            makedirs(dirname(certFile))
+        keyDir = join(self.liveDir, certName)
+        with open(join(keyDir, 'fullchain.pem'), 'r') as fullchain:
+            content = fullchain.read()
+        with open(join(keyDir, 'privkey.pem'), 'r') as privkey:
+            content += privkey.read()
+        atomicWrite(certFile, content)
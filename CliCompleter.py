@@ -2,29 +2,38 @@ from typing import Generator
 
 from prompt_toolkit.completion import Completer, Completion
 
-from Command import ArgumentContainer, ArgumentModule, Command, ArgumentDomain, ArgumentSubDomain
+from Command import ArgumentContainer, ArgumentModule, ArgumentModuleType, Command, ArgumentDomain, ArgumentSubDomain
+from CompletionCache import CompletionCache
 
 
 class CliCompleter(Completer):
     def __init__(self, service_manager):
         self._service_manager = service_manager
+        self.completionCache = CompletionCache(self._service_manager)
+
+        def bulkTargets() -> list[Command]:
+            return [
+                Command("all"),
+                Command("domain", ["dm"], argList=[ArgumentDomain(self._service_manager, self.completionCache)]),
+                Command("module", ["md"], argList=[ArgumentModuleType(self._service_manager, self.completionCache)]),
+            ]
 
         self._commands: tuple[Command, ...] = (
             Command("domain", ["dm"], [
                 Command("get", ["current"]),
                 Command("list", ["ls"]),
-                Command("select", argList=[ArgumentDomain(self._service_manager)]),
-                Command("create", argList=[ArgumentDomain(self._service_manager)]),
-                Command("delete", argList=[ArgumentDomain(self._service_manager)]),
+                Command("select", argList=[ArgumentDomain(self._service_manager, self.completionCache)]),
+                Command("create", argList=[ArgumentDomain(self._service_manager, self.completionCache)]),
+                Command("delete", argList=[ArgumentDomain(self._service_manager, self.completionCache)]),
                 Command("exit"),
                 Command("help"),
             ]),
             Command("subdomain", ["sd"], [
                 Command("get", ["current"]),
                 Command("list", ["ls"]),
-                Command("select", argList=[ArgumentSubDomain(self._service_manager)]),
-                Command("create", argList=[ArgumentSubDomain(self._service_manager)]),
-                Command("delete", argList=[ArgumentSubDomain(self._service_manager)]),
+                Command("select", argList=[ArgumentSubDomain(self._service_manager, self.completionCache)]),
+                Command("create", argList=[ArgumentSubDomain(self._service_manager, self.completionCache)]),
+                Command("delete", argList=[ArgumentSubDomain(self._service_manager, self.completionCache)]),
                 Command("exit"),
                 Command("help"),
             ]),
@@ -32,13 +41,40 @@ class CliCompleter(Completer):
                 Command("up"),
                 Command("down"),
                 Command("get", ["current"]),
+                Command("status"),
                 Command("list", ["ls"]),
-                Command("add", ["create"], argList=[ArgumentModule(self._service_manager)]),
-                Command("log", argList=[ArgumentContainer(self._service_manager)]),
-                Command("command", ["cmd"], argList=[ArgumentContainer(self._service_manager)]),
+                Command("add", ["create"], argList=[ArgumentModule(self._service_manager, self.completionCache)]),
+                Command("log", argList=[ArgumentContainer(self._service_manager, self.completionCache)]),
+                Command("command", ["cmd"], argList=[ArgumentContainer(self._service_manager, self.completionCache)]),
                 Command("delete", ["rm", "clean"]),
                 Command("help"),
             ]),
+            Command("bulk", [], [
+                Command("up", [], bulkTargets()),
+                Command("down", [], bulkTargets()),
+                Command("restart", [], bulkTargets()),
+            ]),
+            Command("certificate", ["cert"], [
+                Command("status"),
+                Command("request"),
+                Command("renew"),
+                Command("expiring"),
+                Command("renew-expiring"),
+                Command("help"),
+            ]),
+            Command("log", [], bulkTargets() + [Command("collect")]),
+            Command("metrics", [], [
+                Command("top"),
+                Command("modules"),
+                Command("history"),
+                Command("help"),
+            ]),
+            Command("status", [], [
+                Command("--all"),
+            ]),
+            Command("plan"),
+            Command("apply"),
+            Command("trace"),
             Command("help"),
             Command("exit", ["quit"]),
         )
@@ -5,8 +5,8 @@ from typing import Generator
 
 from prompt_toolkit.completion import Completion
 
+from CompletionCache import CompletionCache
 from ServiceManager import ServiceManager
-from modules.ModuleLoader import ModuleLoader
 
 
 class Command:
@@ -53,8 +53,9 @@ class Command:
 
 
 class Argument(ABC):
-    def __init__(self, serviceManager):
+    def __init__(self, serviceManager, completionCache):
         self._serviceManager: ServiceManager = serviceManager
+        self._completionCache: CompletionCache = completionCache
 
     @abstractmethod
     def yieldCompletion(self, firstLevelText: str) -> Generator[Completion, None, None]:
@@ -63,9 +64,8 @@ class Argument(ABC):
 
 class ArgumentDomain(Argument):
     def yieldCompletion(self, text: str) -> Generator[Completion, None, None]:
-        for domain in self._serviceManager.domains.values():
-            if domain.name.startswith(text):
-                yield Completion(domain.name, start_position=-1 * len(text))
+        for (domainName, _) in self._completionCache.domains(text):
+            yield Completion(domainName, start_position=-1 * len(text))
 
 
 class ArgumentSubDomain(Argument):
@@ -73,9 +73,8 @@ class ArgumentSubDomain(Argument):
         if None is self._serviceManager.currentDomain:
             yield Completion(" ", start_position=-1, display="No top level domain selected")
         else:
-            for subdomain in self._serviceManager.currentDomain.loadSubDomains().values():
-                if subdomain.subName.startswith(text):
-                    yield Completion(subdomain.subName, start_position=-1 * len(text), display=subdomain.name)
+            for (subName, name) in self._completionCache.subDomains(self._serviceManager.currentDomain, text):
+                yield Completion(subName, start_position=-1 * len(text), display=name)
 
 
 class ArgumentModule(Argument):
@@ -83,9 +82,8 @@ class ArgumentModule(Argument):
         if None is self._serviceManager.currentSubDomain:
             yield Completion(" ", start_position=-1, display="No subdomain selected")
         else:
-            for module in ModuleLoader.availableModules:
-                if module.startswith(text):
-                    yield Completion(module, start_position=-1 * len(text))
+            for (module, _) in self._completionCache.modules(text):
+                yield Completion(module, start_position=-1 * len(text))
 
 
 class ArgumentContainer(Argument):
@@ -93,6 +91,12 @@ class ArgumentContainer(Argument):
         if None is self._serviceManager.currentSubDomain:
             yield Completion(" ", start_position=-1, display="No subdomain selected")
         else:
-            for containerName in self._serviceManager.currentSubDomain.activeModule.getContainers():
+            for containerName in self._completionCache.containers(self._serviceManager.currentSubDomain):
                 if containerName.startswith(text):
                     yield Completion(containerName, start_position=-1 * len(text))
+
+
+class ArgumentModuleType(Argument):
+    def yieldCompletion(self, text: str) -> Generator[Completion, None, None]:
+        for (module, _) in self._completionCache.modules(text):
+            yield Completion(module, start_position=-1 * len(text))
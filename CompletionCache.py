@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Generator
+
+import config
+from modules.ModuleLoader import ModuleLoader
+
+
+class PrefixTrie:
+    """A prefix tree mapping words to values"""
+    # Key of a nodes value, can't collide with single characters
+    _valueKey = ''
+
+    def __init__(self, words: dict[str, Any] = None):
+        """
+        Args:
+            words (dict[str, Any]): Initial words and their values
+        """
+        self._root: dict = dict()
+        for (word, value) in (words or dict()).items():
+            self.insert(word, value)
+
+    def insert(self, word: str, value: Any = None):
+        """Add a word
+
+        Args:
+            word (string): The word to add
+            value (Any): A value stored with the word
+        """
+        node = self._root
+        for char in word:
+            node = node.setdefault(char, dict())
+        node[self._valueKey] = (word, value)
+
+    def startingWith(self, prefix: str) -> Generator[tuple[str, Any], None, None]:
+        """Get all words starting with a prefix in alphabetical order
+
+        Args:
+            prefix (string): The prefix to look for
+
+        Returns:
+            Generator[tuple[str, Any]]: Matching words and their values
+        """
+        node = self._root
+        for char in prefix:
+            if char not in node.keys():
+                return
+            node = node[char]
+        stack = [node]
+        while 0 < len(stack):
+            node = stack.pop()
+            if self._valueKey in node.keys():
+                yield node[self._valueKey]
+            stack.extend(node[char] for char in sorted(node.keys(), reverse=True) if char != self._valueKey)
+
+
+class CompletionCache:
+    """Prefix indices and cached container names for tab completion
+
+    Domain and subdomain indices are built from the inventory and rebuilt whenever it changes.
+    Container names are kept for `completion_cache_ttl` seconds and refreshed in the background afterwards.
+    While the container watcher is following dockers events they are always current and looked up directly.
+    """
+
+    def __init__(self, serviceManager):
+        """
+        Args:
+            serviceManager (ServiceManager): The service manager to complete for
+        """
+        self._serviceManager = serviceManager
+        self._lock = Lock()
+        self._domainIndex: tuple[tuple, PrefixTrie] = (None, None)
+        self._subDomainIndices: dict[str, tuple[tuple, PrefixTrie]] = dict()
+        self._moduleIndex: tuple[int, PrefixTrie] = (None, None)
+        # Subdomain name -> (time fetched, container names)
+        self._containers: dict[str, tuple[float, list[str]]] = dict()
+        self._refreshing: set[str] = set()
+
+    def domains(self, prefix: str) -> Generator[tuple[str, Any], None, None]:
+        """Domain names starting with a prefix"""
+        inventory = self._serviceManager.inventory
+        inventory.refresh()
+        version = (inventory.generation, len(self._serviceManager.domains))
+        if version != self._domainIndex[0]:
+            names = set(inventory.domains()) | set(self._serviceManager.domains.keys())
+            self._domainIndex = (version, PrefixTrie({name: name for name in names}))
+        yield from self._domainIndex[1].startingWith(prefix)
+
+    def subDomains(self, domain, prefix: str) -> Generator[tuple[str, Any], None, None]:
+        """Subdomain names of a top level domain starting with a prefix
+
+        Args:
+            domain (Domain): The top level domain
+            prefix (string): The prefix to look for
+
+        Returns:
+            Generator[tuple[str, Any]]: Short subdomain names and their full names
+        """
+        inventory = self._serviceManager.inventory
+        inventory.refresh()
+        version = (inventory.generation, len(domain.subDomains))
+        cached = self._subDomainIndices.get(domain.name, (None, None))
+        if version != cached[0]:
+            names = set(inventory.subDomains(domain.name).keys()) | set(domain.subDomains.keys())
+            trie = PrefixTrie()
+            for name in names:
+                trie.insert(name if name == domain.name else name[:-1 * len(domain.name) - 1], name)
+            cached = (version, trie)
+            self._subDomainIndices[domain.name] = cached
+        yield from cached[1].startingWith(prefix)
+
+    def modules(self, prefix: str) -> Generator[tuple[str, Any], None, None]:
+        """Available module names starting with a prefix"""
+        if len(ModuleLoader.availableModules) != self._moduleIndex[0]:
+            names = list(ModuleLoader.availableModules)
+            self._moduleIndex = (len(names), PrefixTrie({name: name for name in names}))
+        yield from self._moduleIndex[1].startingWith(prefix)
+
+    def containers(self, subDomain) -> list[str]:
+        """Container names of a subdomains module
+
+        Only the very first lookup of a subdomain asks docker directly, expired names are returned
+        while they are refreshed in the background.
+
+        Args:
+            subDomain (SubDomain): The subdomain
+
+        Returns:
+            list[str]: The container names
+        """
+        if self._serviceManager.containerWatcher.ready:
+            return self._fetchContainers(subDomain)
+        name = str(subDomain)
+        with self._lock:
+            cached = self._containers.get(name)
+            if None is not cached and monotonic() - cached[0] < getattr(config, 'completion_cache_ttl', 10):
+                return cached[1]
+            if None is not cached:
+                if name not in self._refreshing:
+                    self._refreshing.add(name)
+                    Thread(target=self._fetchContainers, args=(subDomain,), daemon=True).start()
+                return cached[1]
+        return self._fetchContainers(subDomain)
+
+    def _fetchContainers(self, subDomain) -> list[str]:
+        """Ask docker for the container names of a subdomain and cache them"""
+        name = str(subDomain)
+        try:
+            containers = subDomain.activeModule.getContainers()
+        except Exception:
+            containers = list()
+        with self._lock:
+            self._containers[name] = (monotonic(), containers)
+            self._refreshing.discard(name)
+        return containers
+
+    def invalidateContainers(self, subDomain=None):
+        """Forget cached container names, e.g. after a module was brought up or down
+
+        Args:
+            subDomain (SubDomain): The subdomain to forget, all if omitted
+        """
+        with self._lock:
+            if None is subDomain:
+                self._containers.clear()
+            else:
+                self._containers.pop(str(subDomain), None)
@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 
-from os import listdir, makedirs
-from os.path import isfile, isdir, join
+from os import makedirs
+from os.path import isdir, join
 from shutil import rmtree
 
+import config
+from Inventory import Inventory
 from SubDomain import SubDomain
 
 
@@ -22,26 +24,48 @@ class Domain:
             rootDir (string): The root directory all top level domains are in
         """
         self.name: str = name
+        # Index of all existing subdomains
+        self.inventory: Inventory = Inventory.forRootDir(rootDir)
         # This domains top directory
         self.rootDir: str = join(rootDir, self.name)
         # Make sure top level directory exists
         if not isdir(self.rootDir):
             makedirs(self.rootDir)
+            self.inventory.refresh(force=True)
         # Make sure the default folders exist
         for folderName in self.defaultFolderList:
             folderDir = join(self.rootDir, folderName)
             if not isdir(folderDir):
                 makedirs(folderDir)
-        self.loadSubDomains()
+        # In lazy mode subdomains are only looked up on first access
+        self._subDomains: dict[str, SubDomain] = None
+        if not getattr(config, 'lazy_loading', False):
+            self.loadSubDomains()
+
+    @property
+    def subDomains(self) -> dict[str, SubDomain]:
+        """All subdomains of this domain"""
+        if None is self._subDomains:
+            self.loadSubDomains()
+        return self._subDomains
+
+    @subDomains.setter
+    def subDomains(self, subDomains: dict[str, SubDomain]):
+        self._subDomains = subDomains
 
     def loadSubDomains(self):
         """Get all existing subdomains"""
-        self.subDomains = dict()
-        for domainName in listdir(self.rootDir):
-            if domainName in self.nonDomainDirs or isfile(join(self.rootDir, domainName)):
+        # Lazy subdomains that were already used are kept, so they don't have to be loaded again
+        previousSubDomains = dict()
+        if getattr(config, 'lazy_loading', False) and None is not self._subDomains:
+            previousSubDomains = self._subDomains
+        self._subDomains = dict()
+        # The inventory only contains real subdomains
+        for domainName in self.inventory.subDomains(self.name).keys():
+            if domainName in self.nonDomainDirs:
                 continue
-            # Only allow real subdomains
-            if domainName[-1 * len(self.name):] != self.name:
+            if domainName in previousSubDomains.keys():
+                self._subDomains[domainName] = previousSubDomains[domainName]
                 continue
             # Strip the root domain name
             if domainName != self.name:
@@ -91,3 +115,4 @@ class Domain:
             self.deleteSubDomain(subDomain)
         # Delete the top level domain itself
         rmtree(self.rootDir, ignore_errors=True)
+        self.inventory.forget(self.name)
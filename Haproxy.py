@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+
+from contextlib import contextmanager
+from os import remove, stat
+from os.path import isfile, join
+from subprocess import call
+from threading import RLock
+from typing import Callable
+
+import config
+from AtomicFile import atomicWrite
+from HaproxyConfig import HaproxyConfig, HaproxyCrtList, HaproxyMap
+from HaproxyRuntime import HaproxyRuntime
+from Tracing import Tracer
+
+
+class Haproxy:
+    """Writes the rules of subdomains to haproxy.cfg and reloads haproxy
+
+    Inside a `batch()` all changes are only collected and applied with a single write and reload when it ends.
+
+    With `haproxy_routing = 'map'` hosts are routed by a single rule and a map file. Hosts are then added and removed
+    through the runtime API without a reload, only new or changed backends and certificates need one.
+    Backends stay in the config when a subdomain goes down and are only removed when it is purged.
+
+    With `haproxy_certificates = 'crt-list'` the ssl bind line only references a crt-list file and certificates are
+    added to the running haproxy through the runtime API as well.
+    """
+    # Config file location for haproxy
+    configFile = getattr(config, 'haproxy_config_file', join('/', 'etc', 'haproxy', 'haproxy.cfg'))
+    # Route hosts by one acl per subdomain or by a map file
+    routing = getattr(config, 'haproxy_routing', 'acl')
+    mapFile = getattr(config, 'haproxy_map_file', join('/', 'etc', 'haproxy', 'subdomains.map'))
+    # Load certificates on the bind line or from a crt-list
+    certificates = getattr(config, 'haproxy_certificates', 'inline')
+    crtListFile = getattr(config, 'haproxy_crt_list_file', join('/', 'etc', 'haproxy', 'certificates.list'))
+    runtime = HaproxyRuntime(getattr(config, 'haproxy_stats_socket', join('/', 'run', 'haproxy', 'admin.sock')))
+    # Only one thread at a time may change the haproxy config
+    _lock = RLock()
+    # Depth of nested batches
+    _batchDepth = 0
+    # Changes collected during a batch: acl name -> (subdomain, delete, purge)
+    _pending: dict[str, tuple] = dict()
+    # Parsed files by path with the (mtime, size) they were parsed at
+    _files: dict[str, tuple[tuple, object]] = dict()
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """Collect all changes and apply them at once when the outermost batch ends"""
+        with cls._lock:
+            cls._batchDepth += 1
+        try:
+            yield
+        finally:
+            with cls._lock:
+                cls._batchDepth -= 1
+                if 0 == cls._batchDepth:
+                    cls.flush()
+
+    @classmethod
+    def flush(cls):
+        """Apply the changes collected so far, even if a batch is still running"""
+        with cls._lock:
+            if 0 < len(cls._pending):
+                changes = cls._pending
+                cls._pending = dict()
+                cls._apply(changes)
+
+    @classmethod
+    def update(cls, subDomain, delete: bool = False, purge: bool = False):
+        """Add or remove the rules of a subdomain
+
+        Args:
+            subDomain (SubDomain): The subdomain to configure
+            delete (bool): Delete or add the subdomains rules
+            purge (bool): When deleting, also remove the subdomains backend in map routing
+        """
+        with cls._lock:
+            changes = {cls.aclName(subDomain): (subDomain, delete, delete and purge)}
+            if 0 < cls._batchDepth:
+                cls._pending.update(changes)
+            else:
+                cls._apply(changes)
+
+    @staticmethod
+    def aclName(subDomain) -> str:
+        """Name of the acl and backend of a subdomain"""
+        return subDomain.name.replace('.', '-')
+
+    @classmethod
+    @Tracer.traced('haproxy.apply')
+    def _apply(cls, changes: dict[str, tuple]):
+        """Write all changes to haproxy.cfg and reload haproxy once, if the changes need it"""
+        if cls._write(changes):
+            cls.reload()
+
+    @staticmethod
+    def reload():
+        """Load the new configuration"""
+        Tracer.count('haproxy.reloads')
+        with Tracer.span('haproxy.reload'):
+            call(['systemctl', 'reload', 'haproxy'])
+
+    @classmethod
+    def config(cls) -> HaproxyConfig:
+        """The parsed haproxy.cfg"""
+        return cls._cached(cls.configFile, HaproxyConfig.load)
+
+    @classmethod
+    def hostMap(cls) -> HaproxyMap:
+        """The host map file"""
+        return cls._cached(cls.mapFile, HaproxyMap)
+
+    @classmethod
+    def crtList(cls) -> HaproxyCrtList:
+        """The crt-list file"""
+        return cls._cached(cls.crtListFile, HaproxyCrtList)
+
+    @classmethod
+    def _cached(cls, path: str, load: Callable):
+        """A parsed file, it is only parsed again if the file was changed by someone else
+
+        Args:
+            path (string): Location of the file
+            load (Callable): Parses the file at a path
+        """
+        with cls._lock:
+            signature = cls._signature(path)
+            cached = cls._files.get(path)
+            if None is cached or signature != cached[0]:
+                cached = (signature, load(path))
+                cls._files[path] = cached
+            return cached[1]
+
+    @classmethod
+    def _saved(cls, path: str, saved: bool = True):
+        """Remember the signature of a file written from its cached model, or throw away a model that wasn't saved"""
+        if saved:
+            cls._files[path] = (cls._signature(path), cls._files[path][1])
+        else:
+            cls._files.pop(path, None)
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        """The (mtime, size) of a file, None if it doesn't exist"""
+        try:
+            fileStat = stat(path)
+        except FileNotFoundError:
+            return None
+        return fileStat.st_mtime_ns, fileStat.st_size
+
+    @classmethod
+    def _write(cls, changes: dict[str, tuple]) -> bool:
+        """Write the rules of all changed subdomains to haproxy.cfg at once
+
+        Args:
+            changes (dict[str, tuple]): Acl names and their (subdomain, delete, purge) change
+
+        Returns:
+            bool: Whether haproxy has to be reloaded
+        """
+        with cls._lock:
+            model = cls.config()
+            useMap = 'map' == cls.routing
+            useCrtList = 'crt-list' == cls.certificates
+            hostMap = cls.hostMap() if useMap else None
+            crtList = cls.crtList() if useCrtList else None
+            # Host -> (previous backend, new backend) of changed map entries
+            mapChanges: dict[str, tuple[str, str]] = dict()
+            # Certificate -> 'add' or 'remove' from the crt-list
+            certificateChanges: dict[str, str] = dict()
+            needsReload = useMap and model.setMapRule(cls.mapFile)
+            for (aclName, (subDomain, delete, purge)) in changes.items():
+                host = subDomain.name.lower()
+                certificate = subDomain._sslCertificateFile
+                if delete:
+                    model.removeHostRule(aclName)
+                    if useMap:
+                        mapChanges[host] = (hostMap.remove(host), None)
+                    if not useMap or purge:
+                        # Nothing is routed to it anymore, so the running haproxy can keep it until it is reloaded
+                        model.removeBackend(aclName)
+                        model.removeCertificate(certificate)
+                        if useCrtList and crtList.remove(certificate):
+                            certificateChanges[certificate] = 'remove'
+                else:
+                    if useMap:
+                        # Leftovers of acl routing would shadow the map
+                        needsReload |= model.removeHostRule(aclName)
+                        mapChanges[host] = (hostMap.set(host, aclName), aclName)
+                    else:
+                        model.setHostRule(aclName, subDomain.name)
+                    needsReload |= model.setBackend(aclName, cls._backend(subDomain))
+                    # Certificates that are still being issued are added once they exist, haproxy can't load them
+                    if not isfile(certificate):
+                        pass
+                    elif not useCrtList:
+                        needsReload |= model.addCertificate(certificate)
+                    elif crtList.add(certificate):
+                        certificateChanges[certificate] = 'add'
+            if useCrtList:
+                # Move certificates of the bind line to the crt-list
+                for certificate in model.certificates:
+                    model.removeCertificate(certificate)
+                    crtList.add(certificate)
+                # haproxy refuses an ssl bind without any certificate
+                if 0 < len(crtList.entries):
+                    needsReload |= model.setCrtList(cls.crtListFile)
+                else:
+                    model.removeCrtList()
+            if not useMap:
+                needsReload = model.changed
+
+            # haproxy loads the map and crt-list files on its next start or reload and they must exist for validation
+            previous: dict[str, str] = dict()
+            if useMap and hostMap.changed:
+                previous[cls.mapFile] = cls._content(cls.mapFile)
+                hostMap.save()
+                cls._saved(cls.mapFile)
+            if useCrtList and crtList.changed:
+                previous[cls.crtListFile] = cls._content(cls.crtListFile)
+                crtList.save()
+                cls._saved(cls.crtListFile)
+            if not cls._saveConfig(model):
+                # The next reload must not pick up entries of a config that was refused
+                for (path, content) in previous.items():
+                    cls._restore(path, content)
+                return False
+            if not needsReload:
+                needsReload = not (cls._updateRuntimeMap(mapChanges)
+                                   and cls._updateRuntimeCertificates(certificateChanges))
+            return needsReload
+
+    @staticmethod
+    def _content(path: str) -> str:
+        """The content of a file, None if it doesn't exist"""
+        try:
+            with open(path, 'r') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _restore(cls, path: str, content: str):
+        """Put back the content of a file returned by `_content` and forget its cached model"""
+        if None is content:
+            if isfile(path):
+                remove(path)
+        else:
+            atomicWrite(path, content)
+        cls._saved(path, False)
+
+    @classmethod
+    def _saveConfig(cls, model: HaproxyConfig) -> bool:
+        """Save the config if it was changed
+
+        Returns:
+            bool: Whether the config file matches the model, it doesn't if the model failed validation
+        """
+        if not model.changed:
+            return True
+        saved = model.save(cls.configFile, getattr(config, 'haproxy_validate', True))
+        cls._saved(cls.configFile, saved)
+        return saved
+
+    @classmethod
+    def updateCertificates(cls, subDomains: list):
+        """Serve new or renewed certificates of subdomains haproxy is already configured for
+
+        Args:
+            subDomains (list[SubDomain]): The subdomains the certificates are for
+        """
+        # Without haproxy there is no config to read
+        if 0 == len(subDomains) or config.Proxy.haproxy != config.used_proxy:
+            return
+        with cls._lock:
+            model = cls.config()
+            certificates = [subDomain._sslCertificateFile for subDomain in subDomains
+                            if cls.aclName(subDomain) in model.backends.keys()]
+            if 0 == len(certificates):
+                return
+            if 'crt-list' == cls.certificates:
+                crtList = cls.crtList()
+                actions = {certificate: 'add' if crtList.add(certificate) else 'replace' for certificate in certificates}
+                if crtList.changed:
+                    crtList.save()
+                    cls._saved(cls.crtListFile)
+                needsReload = model.setCrtList(cls.crtListFile)
+                if not cls._saveConfig(model):
+                    return
+                if needsReload or not cls._updateRuntimeCertificates(actions):
+                    cls.reload()
+            else:
+                # haproxy only reads certificates on the bind line when it is reloaded
+                for certificate in certificates:
+                    model.addCertificate(certificate)
+                if cls._saveConfig(model):
+                    cls.reload()
+
+    @classmethod
+    @Tracer.traced('haproxy.runtime')
+    def _updateRuntimeMap(cls, mapChanges: dict[str, tuple[str, str]]) -> bool:
+        """Apply map changes to the running haproxy
+
+        Args:
+            mapChanges (dict[str, tuple[str, str]]): Hosts and their previous and new backend, None if there is none
+
+        Returns:
+            bool: Whether all changes were applied, haproxy has to be reloaded otherwise
+        """
+        mapChanges = {host: change for (host, change) in mapChanges.items() if change[0] != change[1]}
+        if 0 == len(mapChanges):
+            return True
+        if not cls.runtime.available():
+            return False
+        try:
+            for (host, (previous, backend)) in mapChanges.items():
+                if None is backend:
+                    cls.runtime.delMap(cls.mapFile, host)
+                elif None is previous:
+                    cls.runtime.addMap(cls.mapFile, host, backend)
+                else:
+                    cls.runtime.setMap(cls.mapFile, host, backend)
+        except (OSError, RuntimeError) as e:
+            print('Updating the haproxy map failed, reloading instead:', e)
+            return False
+        return True
+
+    @classmethod
+    @Tracer.traced('haproxy.runtime')
+    def _updateRuntimeCertificates(cls, certificateChanges: dict[str, str]) -> bool:
+        """Add, replace and remove certificates of the running haproxys crt-list
+
+        Args:
+            certificateChanges (dict[str, str]): Certificates and whether to 'add', 'replace' or 'remove' them
+
+        Returns:
+            bool: Whether all changes were applied, haproxy has to be reloaded otherwise
+        """
+        if 0 == len(certificateChanges):
+            return True
+        if not cls.runtime.available():
+            return False
+        try:
+            for (certificate, action) in certificateChanges.items():
+                if action in ('add', 'replace'):
+                    with open(certificate, 'r') as certificateFile:
+                        cls.runtime.loadCertificate(certificate, certificateFile.read())
+                    if 'add' == action:
+                        cls.runtime.addCrtList(cls.crtListFile, certificate)
+                else:
+                    cls.runtime.delCrtList(cls.crtListFile, certificate)
+                    cls.runtime.delCertificate(certificate)
+        except (OSError, RuntimeError) as e:
+            print('Updating the haproxy certificates failed, reloading instead:', e)
+            return False
+        return True
+
+    @staticmethod
+    def _backend(subDomain) -> list[str]:
+        """The backend lines of a subdomain"""
+        return [
+            '\toption httpclose\n',
+            '\toption forwardfor\n',
+            '\thttp-request set-header X-Forwarded-Port %[dst_port]\n',
+            '\thttp-request add-header X-Forwarded-Proto https if { ssl_fc }\n',
+            '\tserver ' + subDomain.activeModule.name + ' 127.0.0.1:' + str(subDomain.activeModule.exposedPort)
+            + ' check fall 3 rise 2\n',
+        ]
@@ -0,0 +1,443 @@
+#!/usr/bin/python3
+
+from os.path import isfile
+from shutil import which
+from subprocess import run
+
+from AtomicFile import atomicWrite
+
+
+def _readEntries(path: str) -> list[list[str]]:
+    """The tokens of all lines of a map or crt-list file, without empty lines and comments"""
+    if not isfile(path):
+        return list()
+    with open(path, 'r') as entryFile:
+        return [line.split() for line in entryFile if '' != line.strip() and not line.lstrip().startswith('#')]
+
+
+class HaproxySection:
+    """A section of haproxy.cfg, e.g. `frontend http`
+
+    Lines are kept as single item lists, so they can be removed in O(1) through an index.
+    New lines are inserted in front of the `# END OF SERVICES` marker of the section, if it has one.
+    """
+
+    def __init__(self, keyword: str = None, name: str = None, header: str = None):
+        """
+        Args:
+            keyword (string): The sections keyword like `backend`, None for lines before the first section
+            name (string): The sections name
+            header (string): The raw header line
+        """
+        self.keyword = keyword
+        self.name = name
+        self.header = header
+        self.lines: list[list[str]] = list()
+        self.removed = False
+        # Marker line new lines are inserted in front of and the inserted lines
+        self._insertBefore: list[str] = None
+        self._inserted: list[list[str]] = list()
+
+    def append(self, line: str) -> list[str]:
+        """Add a parsed line to the end of the section"""
+        cell = [line]
+        self.lines.append(cell)
+        if HaproxyConfig.servicesMarker == line.strip() and line[:1].isspace():
+            self._insertBefore = cell
+        return cell
+
+    def insert(self, line: str) -> list[str]:
+        """Add a new line in front of the sections marker"""
+        cell = [line]
+        if None is self._insertBefore:
+            self.lines.append(cell)
+        else:
+            self._inserted.append(cell)
+        return cell
+
+    def serialize(self) -> str:
+        """Get the section as it is written to the file"""
+        if self.removed:
+            return ''
+        output = [self.header] if None is not self.header else list()
+        for cell in self.lines:
+            if cell is self._insertBefore:
+                output.extend(inserted[0] for inserted in self._inserted if None is not inserted[0])
+            if None is not cell[0]:
+                output.append(cell[0])
+        return ''.join(output)
+
+
+class HaproxyConfig:
+    """An in memory model of haproxy.cfg
+
+    The file is parsed once into sections. Backends are indexed by name and the host rules (`acl` and `use_backend`)
+    of the `http` frontend by the name they refer to, so adding, updating and removing a subdomain is O(1).
+    Whitespace differences in the file don't matter.
+    All changing methods return whether they actually changed something, `changed` tells if anything changed since
+    the config was loaded or saved.
+    """
+    # Keywords that start a new section
+    sectionKeywords = ('global', 'defaults', 'frontend', 'backend', 'listen', 'resolvers', 'peers', 'userlist',
+                       'mailers', 'program', 'http-errors', 'ring', 'cache')
+    # Marks where new rules and backends are added
+    servicesMarker = '# END OF SERVICES'
+    # Name of the frontend host rules are added to
+    frontendName = 'http'
+
+    def __init__(self, text: str = ''):
+        """
+        Args:
+            text (string): Content of a haproxy config file
+        """
+        self.sections: list[HaproxySection] = [HaproxySection()]
+        self.backends: dict[str, HaproxySection] = dict()
+        self.frontend: HaproxySection = None
+        # Frontend lines referring to a backend name
+        self._rules: dict[str, list[list[str]]] = dict()
+        # Certificates and crt-list of the ssl bind line
+        self._bindCell: list[str] = None
+        self._bindPrefix = '\tbind *:443 ssl'
+        self._certificates: dict[str, None] = dict()
+        self._crtList: str = None
+        # Marker section new backends are inserted in front of and the inserted backends
+        self._servicesMarker: HaproxySection = None
+        self._insertedSections: list[HaproxySection] = list()
+        self._parse(text)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: str) -> 'HaproxyConfig':
+        """Parse a config file
+
+        Args:
+            path (string): Location of the config file
+
+        Returns:
+            HaproxyConfig: The parsed config
+        """
+        with open(path, 'r') as configFile:
+            return cls(configFile.read())
+
+    def _parse(self, text: str):
+        """Split the config into sections and build the indices"""
+        section = self.sections[0]
+        for line in text.splitlines(keepends=True):
+            if not line.endswith('\n'):
+                line += '\n'
+            tokens = line.split()
+            isTopLevel = not line[:1].isspace()
+            if isTopLevel and 0 < len(tokens) and tokens[0] in self.sectionKeywords:
+                section = HaproxySection(tokens[0], tokens[1] if 1 < len(tokens) else None, line)
+                self.sections.append(section)
+                if 'backend' == section.keyword:
+                    self.backends[section.name] = section
+                elif 'frontend' == section.keyword and self.frontendName == section.name:
+                    self.frontend = section
+                continue
+            if isTopLevel and self.servicesMarker == line.strip():
+                section = HaproxySection('#', None, line)
+                self.sections.append(section)
+                self._servicesMarker = section
+                continue
+            cell = section.append(line)
+            if section is self.frontend:
+                self._indexFrontendLine(cell, tokens)
+
+    def _indexFrontendLine(self, cell: list[str], tokens: list[str]):
+        """Remember frontend lines that are changed later on"""
+        if 2 <= len(tokens) and tokens[0] in ('acl', 'use_backend'):
+            self._rules.setdefault(tokens[1], list()).append(cell)
+        elif 3 <= len(tokens) and ['bind', '*:443', 'ssl'] == tokens[:3] and None is self._bindCell:
+            self._bindCell = cell
+            self._certificates = {tokens[i + 1]: None for i in range(3, len(tokens) - 1) if 'crt' == tokens[i]}
+            self._crtList = next((tokens[i + 1] for i in range(3, len(tokens) - 1) if 'crt-list' == tokens[i]), None)
+            self._bindOptions = [token for (i, token) in enumerate(tokens[3:], 3)
+                                 if token not in ('crt', 'crt-list') and tokens[i - 1] not in ('crt', 'crt-list')]
+
+    # Backends
+    def setBackend(self, name: str, lines: list[str]) -> bool:
+        """Add or replace a backend
+
+        Args:
+            name (string): Name of the backend
+            lines (list[str]): The backends body lines, without the header
+        """
+        section = self.backends.get(name)
+        if None is section:
+            section = HaproxySection('backend', name, 'backend ' + name + '\n')
+            self.backends[name] = section
+            self._insertedSections.append(section)
+        elif [line.split() for line in lines] == [cell[0].split() for cell in section.lines if None is not cell[0]
+                                                  and '' != cell[0].strip()]:
+            return False
+        section.lines = [[line] for line in lines]
+        self.changed = True
+        return True
+
+    def removeBackend(self, name: str) -> bool:
+        """Remove a backend if it exists"""
+        section = self.backends.pop(name, None)
+        if None is section:
+            return False
+        section.removed = True
+        self.changed = True
+        return True
+
+    # Host rules
+    def setHostRule(self, name: str, host: str) -> bool:
+        """Route requests for a host to the backend of the same name
+
+        Args:
+            name (string): Name of the acl and the backend
+            host (string): The host to route
+        """
+        rules = ['\tacl ' + name + ' req.hdr(Host) ' + host + '\n', '\tuse_backend ' + name + ' if ' + name + '\n']
+        if [rule.split() for rule in rules] == [cell[0].split() for cell in self._rules.get(name, list())]:
+            return False
+        self.removeHostRule(name)
+        self._rules[name] = [self._frontend().insert(rule) for rule in rules]
+        self.changed = True
+        return True
+
+    def removeHostRule(self, name: str) -> bool:
+        """Remove the routing rules of a backend if they exist"""
+        cells = self._rules.pop(name, list())
+        for cell in cells:
+            cell[0] = None
+        self.changed |= 0 < len(cells)
+        return 0 < len(cells)
+
+    def hasHostRule(self, name: str) -> bool:
+        """Whether routing rules for a backend exist"""
+        return name in self._rules.keys()
+
+    @staticmethod
+    def _mapRuleName(mapFile: str) -> str:
+        """The backend expression of a map rule"""
+        return '%[req.hdr(host),lower,map(' + mapFile + ')]'
+
+    def setMapRule(self, mapFile: str) -> bool:
+        """Route requests to the backend their host is mapped to in a map file
+
+        Args:
+            mapFile (string): Location of the map file
+        """
+        name = self._mapRuleName(mapFile)
+        if name in self._rules.keys():
+            return False
+        self._rules[name] = [self._frontend().insert('\tuse_backend ' + name + '\n')]
+        self.changed = True
+        return True
+
+    def removeMapRule(self, mapFile: str) -> bool:
+        """Stop routing requests by a map file"""
+        return self.removeHostRule(self._mapRuleName(mapFile))
+
+    def _frontend(self) -> HaproxySection:
+        """The frontend rules are added to"""
+        if None is self.frontend:
+            raise ValueError('haproxy config has no frontend ' + self.frontendName)
+        return self.frontend
+
+    # Certificates
+    @property
+    def certificates(self) -> list[str]:
+        """Certificates loaded directly on the ssl bind line"""
+        return list(self._certificates.keys())
+
+    def setCrtList(self, path: str) -> bool:
+        """Load the certificates listed in a crt-list file on the ssl bind line
+
+        Args:
+            path (string): Location of the crt-list file
+        """
+        if path == self._crtList:
+            return False
+        self._crtList = path
+        self._updateBindLine()
+        return True
+
+    def removeCrtList(self) -> bool:
+        """Stop loading a crt-list file"""
+        if None is self._crtList:
+            return False
+        self._crtList = None
+        self._updateBindLine()
+        return True
+
+    def addCertificate(self, path: str) -> bool:
+        """Load a certificate on the ssl bind line
+
+        Args:
+            path (string): Location of the certificate
+        """
+        if path in self._certificates.keys():
+            return False
+        self._certificates[path] = None
+        self._updateBindLine()
+        return True
+
+    def removeCertificate(self, path: str) -> bool:
+        """Stop loading a certificate, the ssl bind line is removed with its last certificate
+
+        Args:
+            path (string): Location of the certificate
+        """
+        if path not in self._certificates.keys():
+            return False
+        del self._certificates[path]
+        self._updateBindLine()
+        return True
+
+    def _updateBindLine(self):
+        """Write the current certificates to the ssl bind line"""
+        self.changed = True
+        if None is self._bindCell:
+            # Add the ssl bind right after the plain http bind
+            self._bindCell = [None]
+            self._bindOptions = list()
+            bindIndex = next((index + 1 for (index, cell) in enumerate(self._frontend().lines)
+                              if None is not cell[0] and ['bind', '*:80'] == cell[0].split()), 0)
+            self.frontend.lines.insert(bindIndex, self._bindCell)
+        if 0 == len(self._certificates) and None is self._crtList:
+            self._bindCell[0] = None
+        else:
+            self._bindCell[0] = self._bindPrefix + ''.join(' crt ' + cert for cert in self._certificates) \
+                                + ('' if None is self._crtList else ' crt-list ' + self._crtList) \
+                                + ''.join(' ' + option for option in self._bindOptions) + '\n'
+
+    # Serialization
+    def serialize(self) -> str:
+        """Get the config as it is written to the file"""
+        output = list()
+        for section in self.sections:
+            if section is self._servicesMarker:
+                output.extend(inserted.serialize() for inserted in self._insertedSections)
+            output.append(section.serialize())
+        if None is self._servicesMarker:
+            output.extend(inserted.serialize() for inserted in self._insertedSections)
+        return ''.join(output)
+
+    @staticmethod
+    def validate(path: str) -> tuple[bool, str]:
+        """Check a config file with `haproxy -c`, if haproxy is installed
+
+        Args:
+            path (string): Location of the config file
+
+        Returns:
+            tuple[bool, str]: Whether the config is valid and haproxys output
+        """
+        if None is which('haproxy'):
+            return True, ''
+        result = run(['haproxy', '-c', '-f', path], capture_output=True, text=True)
+        return 0 == result.returncode, (result.stdout + result.stderr).strip()
+
+    def save(self, path: str, validate: bool = True) -> bool:
+        """Atomically replace a config file with this config
+
+        The config is validated before it replaces the old file, so haproxy never sees a broken or half written file.
+
+        Args:
+            path (string): Location of the config file
+            validate (bool): Check the config before replacing the old one
+
+        Returns:
+            bool: Whether the config was saved, it is not if validation failed
+        """
+        def check(tmpPath: str) -> bool:
+            valid, output = self.validate(tmpPath)
+            if not valid:
+                print('Invalid haproxy config, keeping', path)
+                print(output)
+            return valid
+
+        saved = atomicWrite(path, self.serialize(), check if validate else None)
+        self.changed &= not saved
+        return saved
+
+
+class HaproxyMap:
+    """A haproxy map file of hosts and the backends they are routed to"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (string): Location of the map file, it is loaded if it exists
+        """
+        self.path = path
+        self.entries: dict[str, str] = dict()
+        for tokens in _readEntries(path):
+            if 2 <= len(tokens):
+                self.entries[tokens[0]] = tokens[1]
+        self.changed = False
+
+    def set(self, key: str, value: str) -> str:
+        """Map a key to a value
+
+        Returns:
+            string: The previous value, None if the key is new
+        """
+        previous = self.entries.get(key)
+        if value != previous:
+            self.entries[key] = value
+            self.changed = True
+        return previous
+
+    def remove(self, key: str) -> str:
+        """Remove a key if it exists
+
+        Returns:
+            string: The removed value, None if the key didn't exist
+        """
+        previous = self.entries.pop(key, None)
+        self.changed |= None is not previous
+        return previous
+
+    def save(self):
+        """Atomically replace the map file"""
+        atomicWrite(self.path, ''.join(key + ' ' + value + '\n' for (key, value) in sorted(self.entries.items())))
+        self.changed = False
+
+
+class HaproxyCrtList:
+    """A haproxy crt-list file of the certificates loaded on the ssl bind line"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (string): Location of the crt-list file, it is loaded if it exists
+        """
+        self.path = path
+        # Certificate -> its whole line, which may contain ssl options and sni filters
+        self.entries: dict[str, str] = {tokens[0]: ' '.join(tokens) for tokens in _readEntries(path)}
+        self.changed = False
+
+    def add(self, certificate: str) -> bool:
+        """Add a certificate if it isn't listed yet
+
+        Returns:
+            bool: Whether the certificate was added
+        """
+        if certificate in self.entries.keys():
+            return False
+        self.entries[certificate] = certificate
+        self.changed = True
+        return True
+
+    def remove(self, certificate: str) -> bool:
+        """Remove a certificate if it is listed
+
+        Returns:
+            bool: Whether the certificate was removed
+        """
+        if None is self.entries.pop(certificate, None):
+            return False
+        self.changed = True
+        return True
+
+    def save(self):
+        """Atomically replace the crt-list file"""
+        atomicWrite(self.path, ''.join(line + '\n' for line in self.entries.values()))
+        self.changed = False
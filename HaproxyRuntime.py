@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import socket
+from os.path import exists
+
+
+class HaproxyRuntime:
+    """Client for the haproxy runtime API on the stats socket
+
+    Every command opens its own connection, haproxy closes it after answering.
+    """
+    # Seconds to wait for haproxy to answer
+    timeout = 5
+
+    def __init__(self, socketPath: str):
+        """
+        Args:
+            socketPath (string): Location of the unix stats socket, it needs `level admin`
+        """
+        self.socketPath = socketPath
+
+    def available(self) -> bool:
+        """Whether the stats socket exists"""
+        return exists(self.socketPath)
+
+    def command(self, command: str) -> str:
+        """Run a runtime API command
+
+        Args:
+            command (string): The command, e.g. `show map`
+
+        Returns:
+            string: haproxys answer
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socketPath)
+            connection.sendall(command.encode() + b'\n')
+            answer = b''
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                answer += chunk
+        return answer.decode(errors='replace')
+
+    def _change(self, command: str, success: str = ''):
+        """Run a command that changes something
+
+        Args:
+            command (string): The command
+            success (string): Text haproxys answer contains on success, an empty answer is expected if omitted
+        """
+        answer = self.command(command).strip()
+        if ('' == success and '' != answer) or success not in answer:
+            raise RuntimeError('haproxy: ' + command.splitlines()[0] + ': ' + answer)
+
+    # Maps
+    def addMap(self, mapFile: str, key: str, value: str):
+        """Add an entry to a loaded map, it must not exist yet"""
+        self._change(f'add map {mapFile} {key} {value}')
+
+    def setMap(self, mapFile: str, key: str, value: str):
+        """Change an existing entry of a loaded map"""
+        self._change(f'set map {mapFile} {key} {value}')
+
+    def delMap(self, mapFile: str, key: str):
+        """Remove an entry from a loaded map"""
+        self._change(f'del map {mapFile} {key}')
+
+    def showMap(self, mapFile: str) -> dict[str, str]:
+        """All entries of a loaded map
+
+        Args:
+            mapFile (string): Location of the map file as it is referenced in the config
+
+        Returns:
+            dict[str, str]: The maps keys and values
+        """
+        entries = dict()
+        for line in self.command(f'show map {mapFile}').splitlines():
+            # Lines look like `0x55d2c0d1e0 key value`
+            tokens = line.split()
+            if 3 <= len(tokens):
+                entries[tokens[1]] = tokens[2]
+        return entries
+
+    # Certificates
+    def loadCertificate(self, certificate: str, pem: str):
+        """Load a new certificate into haproxys certificate store or replace a loaded one
+
+        Args:
+            certificate (string): Location of the certificate, it is used as its name
+            pem (string): The certificates chain and private key
+        """
+        try:
+            self._change(f'new ssl cert {certificate}', 'New empty certificate store')
+        except RuntimeError as e:
+            if 'already exists' not in str(e):
+                raise
+        # The payload ends with the first empty line
+        payload = '\n'.join(line for line in pem.splitlines() if '' != line.strip())
+        self._change(f'set ssl cert {certificate} <<\n{payload}\n', 'Transaction')
+        self._change(f'commit ssl cert {certificate}', 'Success!')
+
+    def addCrtList(self, crtList: str, certificate: str):
+        """Start serving a certificate of the store on the bind lines using a crt-list"""
+        self._change(f'add ssl crt-list {crtList} {certificate}', 'Success!')
+
+    def delCrtList(self, crtList: str, certificate: str):
+        """Stop serving a certificate from a crt-list"""
+        self._change(f'del ssl crt-list {crtList} {certificate}', 'deleted')
+
+    def delCertificate(self, certificate: str):
+        """Remove an unused certificate from haproxys certificate store"""
+        self._change(f'del ssl cert {certificate}', 'deleted')
@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+
+import json
+from contextlib import contextmanager
+from os import listdir, makedirs, stat
+from os.path import isdir, join
+from threading import RLock
+from time import monotonic
+
+import config
+from AtomicFile import atomicWrite
+from modules.Module import Module
+
+
+class Inventory:
+    """A persistent index of all domains, subdomains and their modules
+
+    The index is kept in `tmp/inventory.json` below the root directory and checked against the modification times
+    of the directories it was built from. `.module`/`.env`-files are only looked at once their directory changed,
+    which every write through `EnvStore` does, as it replaces the file. Only entries that changed are read again.
+    """
+    # A list of directories to ignore when looking for domains
+    nonDomainDirs = ('bin', 'tmp')
+    # Environment variables stored in the index
+    indexedEnvVars = ('DOMAIN_ESCAPED', 'COMPOSE_PROJECT_NAME', 'HTTP_PORT', 'DOMAIN_URL')
+    # Version of the index file format, older files are rebuilt
+    formatVersion = 2
+    # One inventory per root directory
+    _instances: dict[str, 'Inventory'] = dict()
+
+    @classmethod
+    def forRootDir(cls, rootDir: str) -> 'Inventory':
+        """Get the shared inventory of a root directory
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            Inventory: The inventory
+        """
+        if rootDir not in cls._instances.keys():
+            cls._instances[rootDir] = cls(rootDir)
+        return cls._instances[rootDir]
+
+    def __init__(self, rootDir: str):
+        """Load the index file if it exists
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.rootDir = rootDir
+        self.indexFile = join(self.rootDir, 'tmp', 'inventory.json')
+        self._lock = RLock()
+        self._lastRefresh = None
+        # Increased on every change, so users of the index know when to rebuild derived data
+        self.generation = 0
+        # Writes are deferred until the outermost batch ends
+        self._batchDepth = 0
+        self._dirty = False
+        # Top level domain of each subdomain, rebuilt when the index changes
+        self._domainOf: dict[str, str] = None
+        self._data = {'version': self.formatVersion, 'mtime': None, 'domains': dict()}
+        try:
+            with open(self.indexFile, 'r') as indexFile:
+                data = json.load(indexFile)
+            if self.formatVersion == data.get('version'):
+                self._data = data
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _mtime(path: str):
+        """Modification time of a path or None if it doesn't exist"""
+        try:
+            return stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force: bool = False, deep: bool = False) -> bool:
+        """Bring the index up to date with the disk
+
+        To keep lookups cheap, the disk is checked at most every `inventory_refresh_interval` seconds
+        and only directories are checked, not the files in them.
+
+        Args:
+            force (bool): Check the disk regardless of when it was last checked
+            deep (bool): Also check files that were changed in place, without replacing them
+
+        Returns:
+            bool: Whether anything changed
+        """
+        with self._lock:
+            interval = getattr(config, 'inventory_refresh_interval', 2)
+            if not force and None is not self._lastRefresh and monotonic() - self._lastRefresh < interval:
+                return False
+            self._lastRefresh = monotonic()
+            changed = False
+            domains = self._data['domains']
+
+            # Look for new and deleted domains
+            rootMtime = self._mtime(self.rootDir)
+            if rootMtime != self._data['mtime']:
+                self._data['mtime'] = rootMtime
+                domainNames = set()
+                if isdir(self.rootDir):
+                    domainNames = {name for name in listdir(self.rootDir)
+                                   if name not in self.nonDomainDirs and isdir(join(self.rootDir, name))}
+                for name in domainNames - domains.keys():
+                    domains[name] = {'mtime': None, 'subDomains': dict()}
+                for name in domains.keys() - domainNames:
+                    del domains[name]
+                changed = True
+
+            for (domainName, domain) in domains.items():
+                changed = self._refreshDomain(domainName, domain, deep) or changed
+
+            if changed:
+                self._save()
+            return changed
+
+    def _refreshDomain(self, domainName: str, domain: dict, deep: bool = False) -> bool:
+        """Bring a single domain of the index up to date
+
+        Args:
+            domainName (string): Name of the domain
+            domain (dict): The domains index entry
+            deep (bool): Also check the files of subdomains whose directory didn't change
+
+        Returns:
+            bool: Whether anything changed
+        """
+        changed = False
+        domainDir = join(self.rootDir, domainName)
+        # Look for new and deleted subdomains
+        domainMtime = self._mtime(domainDir)
+        if domainMtime != domain['mtime']:
+            domain['mtime'] = domainMtime
+            subDomainNames = set()
+            if isdir(domainDir):
+                subDomainNames = {name for name in listdir(domainDir)
+                                  if name not in self.nonDomainDirs and name.endswith(domainName)
+                                  and isdir(join(domainDir, name))}
+            for name in subDomainNames - domain['subDomains'].keys():
+                domain['subDomains'][name] = {'signature': None}
+            for name in domain['subDomains'].keys() - subDomainNames:
+                del domain['subDomains'][name]
+            changed = True
+
+        for (name, entry) in domain['subDomains'].items():
+            changed = self._refreshSubDomain(join(domainDir, name), entry, deep) or changed
+        return changed
+
+    def _refreshSubDomain(self, subDomainDir: str, entry: dict, deep: bool = False) -> bool:
+        """Read a subdomains module and environment variables again, if its files changed
+
+        Args:
+            subDomainDir (string): The subdomains directory
+            entry (dict): The subdomains index entry
+            deep (bool): Check the files even if the directory didn't change
+
+        Returns:
+            bool: Whether anything changed
+        """
+        subDomainMtime = self._mtime(subDomainDir)
+        # Replacing or creating a file changes its directory, so the files only have to be checked then
+        if not deep and None is not entry['signature'] and subDomainMtime == entry['signature'][0]:
+            return False
+        moduleFile = join(subDomainDir, '.module')
+        envFile = join(subDomainDir, '.env')
+        signature = [subDomainMtime, self._mtime(moduleFile), self._mtime(envFile)]
+        if signature == entry['signature']:
+            return False
+        envVars = Module.fileToDict(envFile)
+        port = envVars.get('HTTP_PORT', '')
+        entry.clear()
+        entry.update({
+            'signature': signature,
+            'module'   : Module.fileToDict(moduleFile).get('MODULE_NAME'),
+            'port'     : int(port) if port.isdigit() else None,
+            'ports'    : {name: int(value) for (name, value) in envVars.items() if name.endswith('_PORT') and value.isdigit()},
+            'env'      : {name: envVars[name] for name in self.indexedEnvVars if name in envVars.keys()},
+        })
+        return True
+
+    @contextmanager
+    def batch(self):
+        """Write the index only once when the outermost batch ends, instead of after every change"""
+        with self._lock:
+            self._batchDepth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batchDepth -= 1
+                if 0 == self._batchDepth and self._dirty:
+                    self._save()
+
+    def _save(self):
+        """Write the index to disk"""
+        self._domainOf = None
+        self.generation += 1
+        if 0 < self._batchDepth:
+            self._dirty = True
+            return
+        self._dirty = False
+        indexDir = join(self.rootDir, 'tmp')
+        try:
+            if not isdir(indexDir):
+                makedirs(indexDir)
+            atomicWrite(self.indexFile, json.dumps(self._data))
+        except OSError:
+            # The index is only a cache, it is rebuilt on the next start
+            pass
+
+    def update(self, subDomain):
+        """Read a subdomain again after it was changed by this process
+
+        Args:
+            subDomain (SubDomain): The changed subdomain
+        """
+        with self._lock:
+            domainName = subDomain.topLevelDomain.name
+            domain = self._data['domains'].setdefault(domainName, {'mtime': None, 'subDomains': dict()})
+            entry = domain['subDomains'].setdefault(subDomain.name, {'signature': None})
+            entry['signature'] = None
+            self._refreshSubDomain(subDomain.rootDir, entry)
+            self._save()
+
+    def forget(self, domainName: str, subDomainName: str = None):
+        """Remove a deleted domain or subdomain from the index
+
+        Args:
+            domainName (string): Name of the top level domain
+            subDomainName (string): Full name of the subdomain, the whole domain is removed if omitted
+        """
+        with self._lock:
+            if domainName not in self._data['domains'].keys():
+                return
+            if None is subDomainName:
+                del self._data['domains'][domainName]
+            else:
+                self._data['domains'][domainName]['subDomains'].pop(subDomainName, None)
+            self._save()
+
+    def domains(self) -> list[str]:
+        """Names of all top level domains"""
+        self.refresh()
+        with self._lock:
+            return list(self._data['domains'].keys())
+
+    def subDomains(self, domainName: str) -> dict[str, dict]:
+        """All subdomains of a top level domain
+
+        Args:
+            domainName (string): Name of the top level domain
+
+        Returns:
+            dict[str, dict]: Full subdomain names and copies of their entries with the keys `module`, `port` and `env`
+        """
+        self.refresh()
+        # Copied, as other threads refresh the index while the caller iterates it
+        with self._lock:
+            if domainName not in self._data['domains'].keys():
+                return dict()
+            return {name: dict(entry) for (name, entry) in self._data['domains'][domainName]['subDomains'].items()}
+
+    def subDomain(self, subDomainName: str) -> dict:
+        """Get the entry of a single subdomain
+
+        Args:
+            subDomainName (string): Full name of the subdomain
+
+        Returns:
+            dict: The subdomains entry or None if it doesn't exist
+        """
+        self.refresh()
+        with self._lock:
+            if None is self._domainOf:
+                self._domainOf = {subDomainName: domainName
+                                  for (domainName, domain) in self._data['domains'].items()
+                                  for subDomainName in domain['subDomains'].keys()}
+            if subDomainName not in self._domainOf.keys():
+                return None
+            return dict(self._data['domains'][self._domainOf[subDomainName]]['subDomains'][subDomainName])
+
+    def subDomainsWithModule(self, moduleName: str) -> list[tuple[str, str]]:
+        """Find all subdomains running a module
+
+        Args:
+            moduleName (string): Name of the module type
+
+        Returns:
+            list[tuple[str, str]]: Top level domain and full subdomain name of each match
+        """
+        self.refresh()
+        with self._lock:
+            return [(domainName, subDomainName)
+                    for (domainName, domain) in self._data['domains'].items()
+                    for (subDomainName, entry) in domain['subDomains'].items()
+                    if moduleName == entry['module']]
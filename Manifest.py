@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+
+import asyncio
+import json
+from os.path import join
+from time import perf_counter
+from typing import Callable
+
+from Haproxy import Haproxy
+from ServiceManager import BulkResult, ServiceManager
+# The service manager creates the config file, so it is imported first
+import config
+from SubDomain import SubDomain
+from modules.ComposeEngine import ComposeEngine
+from modules.EnvStore import EnvStore
+from modules.ModuleLoader import ModuleLoader
+
+
+class ManifestChange:
+    """A change needed to bring a subdomain to the state of the manifest"""
+    # Actions taking containers down or removing modules, they run before all others
+    downActions = ('remove', 'stop')
+
+    def __init__(self, domainName: str, subName: str, action: str, module: str = None, currentModule: str = None,
+                 env: dict[str, tuple[str, str]] = None, up: bool = False, reason: str = ''):
+        """
+        Args:
+            domainName (string): The top level domain
+            subName (string): The subdomain name as it is used in the manifest, e.g. `blog`
+            action (string): One of `create`, `replace`, `update`, `start`, `stop` and `remove`
+            module (string): The module type of the manifest
+            currentModule (string): The module type installed right now
+            env (dict[str, tuple[str, str]]): Changed variables and their (current, new) values
+            up (bool): Whether the module is brought up afterwards
+            reason (string): Why the change is needed
+        """
+        self.domainName = domainName
+        self.subName = subName
+        self.action = action
+        self.module = module
+        self.currentModule = currentModule
+        self.env = env or dict()
+        self.up = up
+        self.reason = reason
+
+    @property
+    def subDomainName(self) -> str:
+        """The full subdomain name"""
+        return self.subName if self.subName == self.domainName else self.subName + '.' + self.domainName
+
+    def __repr__(self):
+        return f'{self.action} {self.subDomainName} {self.reason}'.strip()
+
+
+class Manifest:
+    """The desired state of many top level domains, their subdomains, module types and environment variables
+
+    A manifest is a JSON file mapping top level domains to their subdomains:
+
+        {"example.com": {
+            "blog": {"module": "WordPress", "env": {"SMTP_HOST": "mail.example.com"}},
+            "cloud": {"module": "Nextcloud", "state": "down"},
+            "old": null
+        }}
+
+    `env` overrides variables of the modules .env file and `state` is either `up` (the default) or `down`.
+    A subdomain set to null has its module removed, including all of its data. Subdomains and top level domains
+    that aren't listed are left alone.
+    """
+    states = ('up', 'down')
+
+    def __init__(self, domains: dict[str, dict[str, dict]]):
+        """
+        Args:
+            domains (dict[str, dict[str, dict]]): Top level domains, their subdomains and their validated entries
+        """
+        self.domains = domains
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        """Read and validate a manifest file
+
+        Args:
+            path (string): Location of the manifest
+
+        Returns:
+            Manifest: The manifest
+
+        Raises:
+            ValueError: If the manifest is invalid, with all problems in its message
+        """
+        with open(path, 'r') as manifestFile:
+            data = json.load(manifestFile)
+        if not isinstance(data, dict):
+            raise ValueError('A manifest maps top level domains to their subdomains')
+        problems = list()
+        domains = dict()
+        for (domainName, subDomains) in data.items():
+            if not isinstance(subDomains, dict):
+                problems.append(domainName + ': expected an object of subdomains')
+                continue
+            domains[domainName] = dict()
+            for (subName, entry) in subDomains.items():
+                name = subName + '.' + domainName if subName != domainName else subName
+                if None is entry:
+                    domains[domainName][subName] = None
+                elif not isinstance(entry, dict):
+                    problems.append(name + ': expected an object or null')
+                elif entry.get('module') not in ModuleLoader.availableModules.keys():
+                    problems.append(name + ': unknown module ' + str(entry.get('module')))
+                elif entry.get('state', 'up') not in cls.states:
+                    problems.append(name + ': state must be one of ' + ', '.join(cls.states))
+                elif not isinstance(entry.get('env', dict()), dict):
+                    problems.append(name + ': env must be an object')
+                else:
+                    domains[domainName][subName] = {
+                        'module': entry['module'],
+                        'env'   : {str(key): str(value) for (key, value) in entry.get('env', dict()).items()},
+                        'state' : entry.get('state', 'up'),
+                    }
+        if 0 < len(problems):
+            raise ValueError('\n'.join(problems))
+        return cls(domains)
+
+    def plan(self, serviceManager: ServiceManager) -> list[ManifestChange]:
+        """Compare the manifest to the subdomains on disk and their containers
+
+        Nothing is created or changed, no module is loaded: the modules and variables come from the inventory and
+        the .env files, the containers of all subdomains are fetched at once. Subdomains matching the manifest are
+        compared to the state they were last brought up with, to check whether their configuration changed.
+
+        Args:
+            serviceManager (ServiceManager): The service manager
+
+        Returns:
+            list[ManifestChange]: The changes needed, sorted by subdomain
+        """
+        try:
+            statuses = {status.subDomainName: status for status in serviceManager.fleetStatus()}
+        except (OSError, RuntimeError):
+            # Without docker, the applied state tells whether a module was brought up
+            statuses = None
+        changes = list()
+        for (domainName, subDomains) in sorted(self.domains.items()):
+            existing = serviceManager.inventory.subDomains(domainName)
+            for (subName, entry) in sorted(subDomains.items()):
+                change = self._planSubDomain(serviceManager, domainName, subName, entry, existing, statuses)
+                if None is not change:
+                    changes.append(change)
+        return changes
+
+    @staticmethod
+    def _planSubDomain(serviceManager: ServiceManager, domainName: str, subName: str, entry: dict,
+                       existing: dict[str, dict], statuses: dict) -> ManifestChange:
+        """The change needed for a single subdomain, None if it matches the manifest"""
+        name = subName if subName == domainName else subName + '.' + domainName
+        currentModule = existing[name]['module'] if name in existing.keys() else None
+        if None is entry:
+            if None is currentModule:
+                return None
+            return ManifestChange(domainName, subName, 'remove', None, currentModule, reason=currentModule)
+
+        up = 'up' == entry['state']
+        if None is currentModule:
+            env = {key: (None, value) for (key, value) in entry['env'].items()}
+            return ManifestChange(domainName, subName, 'create', entry['module'], None, env, up, entry['module'])
+        if currentModule != entry['module']:
+            env = {key: (None, value) for (key, value) in entry['env'].items()}
+            return ManifestChange(domainName, subName, 'replace', entry['module'], currentModule, env, up,
+                                  currentModule + ' -> ' + entry['module'])
+
+        rootDir = join(serviceManager.rootDir, domainName, name)
+        fileVars = EnvStore.read(join(rootDir, '.env'))
+        env = {key: (fileVars.get(key), value) for (key, value) in entry['env'].items() if value != fileVars.get(key)}
+        appliedState = ModuleLoader.availableModules[currentModule].appliedStateOf(rootDir)
+        if None is statuses:
+            running = None is not appliedState
+            complete = running
+        else:
+            status = statuses.get(name)
+            running = None is not status and 0 < status.running
+            complete = None is not status and 0 < len(status.containers) and status.running == len(status.containers)
+        if not up:
+            if running:
+                return ManifestChange(domainName, subName, 'stop', entry['module'], currentModule, env)
+            if 0 < len(env):
+                return ManifestChange(domainName, subName, 'update', entry['module'], currentModule, env)
+            return None
+        if 0 < len(env):
+            return ManifestChange(domainName, subName, 'update', entry['module'], currentModule, env, True,
+                                  ', '.join(env.keys()))
+        if not complete:
+            return ManifestChange(domainName, subName, 'start', entry['module'], currentModule, up=True)
+        # Templates and images may have changed since the module was brought up
+        if appliedState != ModuleLoader.availableModules[currentModule].stateOf(rootDir):
+            return ManifestChange(domainName, subName, 'update', entry['module'], currentModule, up=True,
+                                  reason='configuration changed since the last up')
+        return None
+
+    @staticmethod
+    def apply(serviceManager: ServiceManager, changes: list[ManifestChange], concurrency: int = None,
+              callback: Callable[[BulkResult], None] = None) -> list[BulkResult]:
+        """Carry out planned changes, see `applyAsync`"""
+        return ComposeEngine.sync(Manifest.applyAsync(serviceManager, changes, concurrency, callback))
+
+    @staticmethod
+    async def applyAsync(serviceManager: ServiceManager, changes: list[ManifestChange], concurrency: int = None,
+                         callback: Callable[[BulkResult], None] = None) -> list[BulkResult]:
+        """Carry out planned changes, many subdomains at the same time
+
+        Modules are removed and stopped first. The others are brought up grouped by the start order of their
+        module type, like bulk operations do. All haproxy changes are written at once after every group.
+
+        Args:
+            serviceManager (ServiceManager): The service manager
+            changes (list[ManifestChange]): The changes returned by `plan`
+            concurrency (int): How many subdomains are handled at the same time, defaults to `bulk_concurrency`
+            callback (Callable[[BulkResult], None]): Called as soon as a single subdomain is done
+
+        Returns:
+            list[BulkResult]: The outcome of every change
+        """
+        if None is concurrency:
+            concurrency = getattr(config, 'bulk_concurrency', 4)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def limitedRun(change: ManifestChange, subDomain: SubDomain) -> BulkResult:
+            async with semaphore:
+                return await Manifest._applyChange(change, subDomain)
+
+        # Creating subdomains changes the domains, so it isn't done in parallel
+        subDomains = {change.subDomainName: serviceManager.domain(change.domainName).subDomain(change.subName)
+                      for change in changes}
+        groups: dict[int, list[ManifestChange]] = dict()
+        for change in changes:
+            if change.action not in ManifestChange.downActions:
+                groups.setdefault(ModuleLoader.availableModules[change.module].startOrder, list()).append(change)
+        phases = [[change for change in changes if change.action in ManifestChange.downActions]] + \
+                 [groups[order] for order in sorted(groups.keys())]
+
+        results = list()
+        with serviceManager.transaction():
+            for (index, phase) in enumerate(phases):
+                # Modules that came up earlier have to be reachable before the next group starts
+                if 1 < index:
+                    Haproxy.flush()
+                for future in asyncio.as_completed([limitedRun(change, subDomains[change.subDomainName]) for change in phase]):
+                    result = await future
+                    results.append(result)
+                    if None is not callback:
+                        callback(result)
+        return results
+
+    @staticmethod
+    async def _applyChange(change: ManifestChange, subDomain: SubDomain) -> BulkResult:
+        """Carry out the change of a single subdomain"""
+        start = perf_counter()
+        prefix = str(subDomain)
+        exitCode = 0
+        try:
+            module = await asyncio.to_thread(Manifest._install, change, subDomain)
+            if 'stop' == change.action:
+                exitCode = await module.downAsync(prefix=prefix)
+            elif change.up:
+                exitCode = await module.upAsync(prefix=prefix)
+        except Exception as e:
+            return BulkResult(subDomain, change.action, False, f'{type(e).__name__}: {e}', perf_counter() - start)
+        if exitCode:
+            return BulkResult(subDomain, change.action, False, f'docker compose exited with {exitCode}',
+                              perf_counter() - start)
+        return BulkResult(subDomain, change.action, True, change.reason, perf_counter() - start)
+
+    @staticmethod
+    def _install(change: ManifestChange, subDomain: SubDomain):
+        """Remove, add or change the module of a subdomain as the change requires, returns its module"""
+        # The old module is removed before the new one creates its files
+        if change.action in ('remove', 'replace'):
+            subDomain.deleteModule()
+        if change.action in ('create', 'replace'):
+            module = ModuleLoader.new(change.module, subDomain)
+            subDomain.addModule(module)
+            module.save()
+        module = subDomain.activeModule
+        if 0 < len(change.env):
+            module.setEnvVars({name: new for (name, (_, new)) in change.env.items()})
+        return module
@@ -1,7 +1,10 @@
 #!/usr/bin/python3
+import asyncio
 import shutil
-from os import listdir
+from contextlib import contextmanager
 from os.path import isfile, join, dirname
+from time import perf_counter, time
+from typing import Callable
 
 # Create config file if nonexistent
 if not isfile(join(dirname(__file__), "config.py")):
@@ -10,8 +13,76 @@ if not isfile(join(dirname(__file__), "config.py")):
 
 import config
 
+from CertificateInventory import CertificateInventory
+from CertificateQueue import CertificateQueue
 from Domain import Domain
+from Haproxy import Haproxy
+from Inventory import Inventory
 from SubDomain import SubDomain
+from modules.ComposeEngine import ComposeEngine
+from modules.ContainerWatcher import ContainerWatcher
+from modules.DockerApi import DockerApi
+from modules.LogArchive import LogArchive
+from modules.MetricsCollector import MetricsCollector
+from modules.Module import Module
+
+
+class BulkResult:
+    """The outcome of a bulk operation on a single subdomain"""
+
+    def __init__(self, subDomain: SubDomain, action: str, success: bool, message: str = '', seconds: float = 0):
+        """
+        Args:
+            subDomain (SubDomain): The subdomain the action was run on
+            action (string): The action that was run
+            success (bool): Whether the action succeeded
+            message (string): Details about the outcome
+            seconds (float): How long the action took
+        """
+        self.subDomain = subDomain
+        self.action = action
+        self.success = success
+        self.message = message
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f'{self.subDomain} {self.action}: {"ok" if self.success else "failed"} {self.message}'.strip()
+
+
+class ModuleStatus:
+    """The state of a single subdomains containers"""
+
+    def __init__(self, subDomainName: str, module: str, containers: list[dict]):
+        """
+        Args:
+            subDomainName (string): Full name of the subdomain
+            module (string): Name of the subdomains module type
+            containers (list[dict]): The containers as described in `DockerApi.containerState()`
+        """
+        self.subDomainName = subDomainName
+        self.module = module
+        self.containers = sorted(containers, key=lambda container: container['service'] or '')
+
+    @property
+    def running(self) -> int:
+        """Number of running containers"""
+        return len([container for container in self.containers if 'running' == container['state']])
+
+    @property
+    def problems(self) -> list[dict]:
+        """Containers that aren't running or aren't healthy"""
+        return [container for container in self.containers
+                if 'running' != container['state'] or container['health'] in ('unhealthy', 'starting')]
+
+    @property
+    def state(self) -> str:
+        """up if all containers are running and healthy, down if none is running, degraded otherwise"""
+        if 0 == self.running:
+            return 'down'
+        return 'degraded' if 0 < len(self.problems) else 'up'
+
+    def __repr__(self):
+        return f'{self.subDomainName} ({self.module}): {self.state}'
 
 
 class ServiceManager:
@@ -22,15 +93,36 @@ class ServiceManager:
     nonDomainDirs = ('bin', 'tmp')
     # All available top level domains
     domains: dict[str, Domain] = dict()
+    # Actions that can be run on many subdomains at once
+    bulkActions = ('up', 'down', 'restart')
 
     def __init__(self):
         """Load all available domains"""
         self._currentDomain: Domain = None
         self._currentSubDomain: SubDomain = None
+        # Index of all existing domains, subdomains and modules
+        self.inventory: Inventory = Inventory.forRootDir(self.rootDir)
+        # Expiry dates of all ssl certificates
+        self.certificateInventory: CertificateInventory = CertificateInventory.forRootDir(self.rootDir)
+        # Live state of all containers, kept up to date from dockers event stream
+        self.containerWatcher: ContainerWatcher = ContainerWatcher.forSocket(
+            getattr(config, 'docker_socket', join('/', 'var', 'run', 'docker.sock')), self.rootDir)
+        if getattr(config, 'docker_events', True):
+            self.containerWatcher.start()
+        # Compressed log output of all containers
+        self.logArchive: LogArchive = LogArchive.forRootDir(self.rootDir)
+        # Only collected in the background if the config asks for it
+        interval = getattr(config, 'log_archive_interval', 0)
+        if 0 < interval:
+            self.logArchive.startCollector(self.collectLogs, interval)
+        # Resource usage of all subdomains, only collected once it is needed
+        self.metricsCollector: MetricsCollector = MetricsCollector.forSocket(self.containerWatcher.dockerApi.socketPath)
+        if getattr(config, 'metrics_autostart', False):
+            self.startMetrics()
 
         # Load all available domains
-        for f in listdir(self.rootDir):
-            if f in self.nonDomainDirs or isfile(join(self.rootDir, f)):
+        for f in self.inventory.domains():
+            if f in self.nonDomainDirs:
                 continue
             self.domain(f)
 
@@ -82,3 +174,239 @@ class ServiceManager:
         domain.delete()
         # Forget about the domain
         del self.domains[name]
+
+    @contextmanager
+    def transaction(self):
+        """Batch changes of many subdomains
+
+        All haproxy changes made inside are written to the config at once, followed by a single reload.
+        The inventory index is also only written once.
+        """
+        with Haproxy.batch(), self.inventory.batch():
+            yield
+
+    def subDomainsOf(self, domainName: str) -> list[SubDomain]:
+        """Get all subdomains of a top level domain
+
+        Args:
+            domainName (string): Name of the top level domain
+
+        Returns:
+            list[SubDomain]: The subdomains
+        """
+        if domainName not in self.inventory.domains():
+            return list()
+        return list(self.domain(domainName).loadSubDomains().values())
+
+    def subDomainsWithModule(self, moduleName: str) -> list[SubDomain]:
+        """Get all subdomains running a module type
+
+        Args:
+            moduleName (string): Name of the module type
+
+        Returns:
+            list[SubDomain]: The subdomains
+        """
+        return [self.domain(domainName).subDomains[subDomainName]
+                for (domainName, subDomainName) in self.inventory.subDomainsWithModule(moduleName)]
+
+    def allSubDomains(self) -> list[SubDomain]:
+        """Get the subdomains of all top level domains"""
+        return [subDomain for domainName in self.inventory.domains() for subDomain in self.subDomainsOf(domainName)]
+
+    def expiringCertificates(self, days: float = None) -> list[tuple[SubDomain, float]]:
+        """Get all subdomains whose certificate expires within a number of days
+
+        Args:
+            days (float): Number of days from now, defaults to `certificate_renewal_days`
+
+        Returns:
+            list[tuple[SubDomain, float]]: The subdomains and their certificates expiry, the soonest first
+        """
+        days = getattr(config, 'certificate_renewal_days', 30) if None is days else days
+        subDomains = {subDomain._sslCertificateFile: subDomain for subDomain in self.allSubDomains()}
+        expiring = self.certificateInventory.expiring(list(subDomains.keys()), days)
+        return [(subDomains[certificate], notAfter) for (certificate, notAfter) in expiring.items()]
+
+    def renewExpiringCertificates(self, days: float = None, spread: float = None) -> tuple[list, list]:
+        """Renew all certificates expiring within a number of days
+
+        Certificates certbot already renewed on its own are only rebuilt and swapped in haproxy right away.
+        All others are renewed in the background, spread evenly over `spread` seconds, the soonest expiring first.
+
+        Args:
+            days (float): Number of days from now, defaults to `certificate_renewal_days`
+            spread (float): Seconds to spread the renewals over, defaults to `certificate_renewal_spread`
+
+        Returns:
+            tuple[list[SubDomain], list[SubDomain]]: The rebuilt and the scheduled subdomains
+        """
+        spread = getattr(config, 'certificate_renewal_spread', 3600) if None is spread else spread
+        certificateQueue = CertificateQueue.forRootDir(self.rootDir)
+        expiring = [subDomain for (subDomain, _) in self.expiringCertificates(days)]
+        rebuilt = [subDomain for subDomain in expiring if certificateQueue.rebuild(subDomain)]
+        if 0 < len(rebuilt) and config.Proxy.haproxy == config.used_proxy:
+            Haproxy.updateCertificates(rebuilt)
+
+        scheduled = [subDomain for subDomain in expiring if subDomain not in rebuilt]
+        # Subdomains sharing a certificate are renewed together
+        certificateNames = list(dict.fromkeys(certificateQueue.certificateName(subDomain) for subDomain in scheduled))
+        start = time()
+        for subDomain in scheduled:
+            slot = certificateNames.index(certificateQueue.certificateName(subDomain))
+            certificateQueue.request(subDomain, True, start + spread * slot / len(certificateNames))
+        return rebuilt, scheduled
+
+    def fleetStatus(self, domainName: str = None) -> list[ModuleStatus]:
+        """Get the state of every subdomain with a module
+
+        The containers of all compose projects are fetched at once and joined with the inventory,
+        so neither subdomains nor modules have to be built and no compose command is run.
+
+        Args:
+            domainName (string): Only subdomains of this top level domain, all if omitted
+
+        Returns:
+            list[ModuleStatus]: The state of every subdomain, sorted by name
+        """
+        projects = self.containerWatcher.projects()
+        if None is projects:
+            projects = dict()
+            for container in self.containerWatcher.dockerApi.containers(stopped=True):
+                projects.setdefault(container['Labels'][DockerApi.projectLabel], list()).append(
+                    DockerApi.containerState(container))
+
+        statuses = list()
+        domainNames = self.inventory.domains() if None is domainName else [domainName]
+        for name in domainNames:
+            for (subDomainName, entry) in self.inventory.subDomains(name).items():
+                if None is entry['module']:
+                    continue
+                project = Module.composeProjectName(subDomainName, entry['env'])
+                statuses.append(ModuleStatus(subDomainName, entry['module'], projects.get(project, list())))
+        return sorted(statuses, key=lambda status: status.subDomainName)
+
+    def startMetrics(self):
+        """Start collecting the resource usage of all running containers, see `MetricsCollector`"""
+        def runningContainers() -> list[tuple[str, str, dict]]:
+            return [(status.subDomainName, status.module, container) for status in self.fleetStatus()
+                    for container in status.containers if 'running' == container['state']]
+
+        self.metricsCollector.start(runningContainers)
+
+    def collectLogs(self, subDomainNames: list[str] = None) -> int:
+        """Archive the new log output of all containers, see `LogArchive`
+
+        Args:
+            subDomainNames (list[str]): Only containers of these subdomains, all if omitted
+
+        Returns:
+            int: Number of archived lines
+        """
+        try:
+            statuses = self.fleetStatus()
+        except (OSError, RuntimeError):
+            return 0
+        subDomainNames = set(subDomainNames) if None is not subDomainNames else None
+        return self.logArchive.collect([(status.subDomainName, container) for status in statuses
+                                        for container in status.containers
+                                        if None is subDomainNames or status.subDomainName in subDomainNames])
+
+    def bulk(self, action: str, subDomains: list[SubDomain], concurrency: int = None,
+             callback: Callable[[BulkResult], None] = None) -> list[BulkResult]:
+        """Run an action on the modules of many subdomains in parallel, see `bulkAsync`"""
+        return ComposeEngine.sync(self.bulkAsync(action, subDomains, concurrency, callback))
+
+    async def bulkAsync(self, action: str, subDomains: list[SubDomain], concurrency: int = None,
+                        callback: Callable[[BulkResult], None] = None) -> list[BulkResult]:
+        """Run an action on the modules of many subdomains in parallel
+
+        Compose output of every subdomain is prefixed with its name.
+
+        Modules are grouped by their start order: when bringing modules up, groups with a lower start order
+        are completed before the next group starts, when taking them down the order is reversed.
+        A restart takes all modules down before bringing them up again.
+
+        Args:
+            action (string): One of `bulkActions`
+            subDomains (list[SubDomain]): The subdomains to run the action on
+            concurrency (int): How many modules are handled at the same time, defaults to `bulk_concurrency`
+            callback (Callable[[BulkResult], None]): Called as soon as a single subdomain is done
+
+        Returns:
+            list[BulkResult]: The result of every subdomain
+        """
+        if action not in self.bulkActions:
+            raise ValueError('Unknown bulk action ' + action)
+        if None is concurrency:
+            concurrency = getattr(config, 'bulk_concurrency', 4)
+        phases = ('down', 'up') if 'restart' == action else (action,)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def limitedRun(phase: str, subDomain: SubDomain) -> BulkResult:
+            async with semaphore:
+                return await self._bulkRun(phase, subDomain)
+
+        results: dict[str, BulkResult] = dict()
+        # Collect all haproxy changes, so haproxy is only reloaded once
+        with self.transaction():
+            for phase in phases:
+                # Subdomains that already failed in a previous phase are not touched again
+                pending = [subDomain for subDomain in subDomains if str(subDomain) not in results.keys()]
+                for (index, group) in enumerate(self._orderedGroups(pending, reverse='down' == phase)):
+                    # Modules that came up earlier have to be reachable before the next group starts
+                    if 'up' == phase and 0 < index:
+                        Haproxy.flush()
+                    for future in asyncio.as_completed([limitedRun(phase, subDomain) for subDomain in group]):
+                        result = await future
+                        result.action = action
+                        # A restart is only reported once it is complete or failed
+                        if phase != phases[-1] and result.success:
+                            continue
+                        results[str(result.subDomain)] = result
+                        if None is not callback:
+                            callback(result)
+        return [results[str(subDomain)] for subDomain in subDomains if str(subDomain) in results.keys()]
+
+    @staticmethod
+    def _orderedGroups(subDomains: list[SubDomain], reverse: bool = False) -> list[list[SubDomain]]:
+        """Group subdomains by the start order of their modules
+
+        Args:
+            subDomains (list[SubDomain]): The subdomains to group
+            reverse (bool): Whether the highest start order comes first
+
+        Returns:
+            list[list[SubDomain]]: The groups in the order they have to be handled
+        """
+        groups: dict[int, list[SubDomain]] = dict()
+        for subDomain in subDomains:
+            groups.setdefault(subDomain.activeModule.startOrder, list()).append(subDomain)
+        return [groups[order] for order in sorted(groups.keys(), reverse=reverse)]
+
+    @staticmethod
+    async def _bulkRun(action: str, subDomain: SubDomain) -> BulkResult:
+        """Run a single action of a bulk operation
+
+        Args:
+            action (string): Either `up` or `down`
+            subDomain (SubDomain): The subdomain to run the action on
+
+        Returns:
+            BulkResult: The outcome
+        """
+        start = perf_counter()
+        module = subDomain.activeModule
+        if module.isNone():
+            return BulkResult(subDomain, action, True, 'skipped, no module configured')
+        try:
+            if 'up' == action:
+                exitCode = await module.upAsync(prefix=str(subDomain))
+            else:
+                exitCode = await module.downAsync(prefix=str(subDomain))
+        except Exception as e:
+            return BulkResult(subDomain, action, False, f'{type(e).__name__}: {e}', perf_counter() - start)
+        if exitCode:
+            return BulkResult(subDomain, action, False, f'docker compose exited with {exitCode}', perf_counter() - start)
+        return BulkResult(subDomain, action, True, str(module), perf_counter() - start)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from inspect import iscoroutinefunction
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Callable
+
+
+class Tracer:
+    """Times spans of work and keeps counters and latency histograms of them
+
+    Spans nest: a span started while another one is running in the same thread or asyncio task is its child.
+    Every finished span is counted in a histogram by name, which can be exported in the Prometheus text format.
+    Inside `record()` all finished spans are also collected, to show where the time of a single command went.
+    """
+    # Upper bounds of the histogram buckets in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    # Path of the running span, e.g. ('cli.module', 'module.up', 'compose.up')
+    _path: ContextVar[tuple] = ContextVar('tracingPath', default=())
+    # Finished spans of the running recording, shared by all tasks and threads started inside of it
+    _recording: ContextVar[list] = ContextVar('tracingRecording', default=None)
+    _lock = Lock()
+    # Span name -> bucket counts, followed by the number of spans and their total seconds
+    _histograms: dict[str, list] = dict()
+    # Counter name -> value
+    _counters: dict[str, float] = dict()
+    _server: ThreadingHTTPServer = None
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str):
+        """Time the work done inside
+
+        Args:
+            name (string): Name of the span, e.g. `compose.up`
+        """
+        path = cls._path.get() + (name,)
+        token = cls._path.set(path)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            cls._path.reset(token)
+            cls.observe(name, seconds)
+            recording = cls._recording.get()
+            if None is not recording:
+                recording.append((path, seconds))
+
+    @classmethod
+    def traced(cls, name: str) -> Callable:
+        """Decorate a function or coroutine function to run it inside a span
+
+        Args:
+            name (string): Name of the span
+        """
+        def decorator(function: Callable) -> Callable:
+            if iscoroutinefunction(function):
+                @wraps(function)
+                async def asyncWrapper(*args, **kwargs):
+                    with cls.span(name):
+                        return await function(*args, **kwargs)
+                return asyncWrapper
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with cls.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def observe(cls, name: str, seconds: float):
+        """Add a duration to a histogram"""
+        with cls._lock:
+            histogram = cls._histograms.get(name)
+            if None is histogram:
+                histogram = [0] * (len(cls.buckets) + 2)
+                cls._histograms[name] = histogram
+            index = bisect_left(cls.buckets, seconds)
+            if index < len(cls.buckets):
+                histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @classmethod
+    def count(cls, name: str, value: float = 1):
+        """Increase a counter
+
+        Args:
+            name (string): Name of the counter, e.g. `haproxy.reloads`
+            value (float): Amount to add
+        """
+        with cls._lock:
+            cls._counters[name] = cls._counters.get(name, 0) + value
+
+    @classmethod
+    @contextmanager
+    def record(cls):
+        """Collect all spans finished inside
+
+        Yields:
+            list[tuple[tuple, float]]: The path and seconds of every finished span, filled while the context runs
+        """
+        recording = list()
+        token = cls._recording.set(recording)
+        try:
+            yield recording
+        finally:
+            cls._recording.reset(token)
+
+    @staticmethod
+    def breakdown(recording: list[tuple[tuple, float]]) -> list[tuple[tuple, int, float, float]]:
+        """Sum up recorded spans by their path
+
+        Args:
+            recording (list[tuple[tuple, float]]): The spans collected by `record()`
+
+        Returns:
+            list[tuple[tuple, int, float, float]]: The path, number of spans, total and longest seconds,
+                every path directly follows its parent
+        """
+        totals: dict[tuple, list] = dict()
+        for (path, seconds) in recording:
+            # Parents finish after their children, so they are added in front of them
+            for depth in range(1, len(path)):
+                totals.setdefault(path[:depth], [0, 0.0, 0.0])
+            total = totals.setdefault(path, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+        return [(path,) + tuple(totals[path]) for path in sorted(totals.keys())]
+
+    @classmethod
+    def exposition(cls) -> str:
+        """All counters and histograms in the Prometheus text exposition format"""
+        lines = list()
+        with cls._lock:
+            if 0 < len(cls._counters):
+                lines += ['# HELP servicemanager_events_total Number of events', '# TYPE servicemanager_events_total counter']
+                for (name, value) in sorted(cls._counters.items()):
+                    lines.append(f'servicemanager_events_total{{event="{name}"}} {value:g}')
+            if 0 < len(cls._histograms):
+                lines += ['# HELP servicemanager_span_seconds Duration of operations',
+                          '# TYPE servicemanager_span_seconds histogram']
+                for (name, histogram) in sorted(cls._histograms.items()):
+                    cumulative = 0
+                    for (bound, bucketCount) in zip(cls.buckets, histogram):
+                        cumulative += bucketCount
+                        lines.append(f'servicemanager_span_seconds_bucket{{span="{name}",le="{bound:g}"}} {cumulative}')
+                    lines.append(f'servicemanager_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[-2]}')
+                    lines.append(f'servicemanager_span_seconds_sum{{span="{name}"}} {histogram[-1]:.6f}')
+                    lines.append(f'servicemanager_span_seconds_count{{span="{name}"}} {histogram[-2]}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def serve(cls, address: str, port: int):
+        """Serve `exposition()` at /metrics over HTTP in a background thread
+
+        Args:
+            address (string): Address to listen on
+            port (int): Port to listen on
+        """
+        if None is not cls._server:
+            return
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if '/metrics' != self.path:
+                    self.send_error(404)
+                    return
+                body = cls.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        cls._server = ThreadingHTTPServer((address, port), MetricsHandler)
+        cls._server.daemon_threads = True
+        Thread(target=cls._server.serve_forever, name='Tracing', daemon=True).start()
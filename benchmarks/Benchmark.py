@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from os.path import dirname, isdir, isfile, join
+from shutil import rmtree
+from statistics import median
+from subprocess import PIPE, run
+from tempfile import gettempdir
+
+from SyntheticFleet import SyntheticFleet
+
+
+class Benchmark:
+    """Times ServiceManager on a synthetic fleet and compares the timings to a stored baseline
+
+    Every suite runs in a new process, so the caches filled by one suite don't speed up the next.
+    docker compose, systemctl, haproxy and certbot are replaced by the scripts in `fakebin`, which only sleep to
+    simulate their latency. It can be changed through `BENCHMARK_DOCKER_LATENCY`, `BENCHMARK_PS_LATENCY`,
+    `BENCHMARK_RELOAD_LATENCY`, `BENCHMARK_VALIDATE_LATENCY` and `BENCHMARK_CERTBOT_LATENCY` (seconds), but the
+    baseline is recorded with the defaults.
+    """
+    benchmarkDir = dirname(__file__)
+    # Suites in the order they are run
+    suites = ('startup', 'completion', 'haproxy', 'bulk', 'certificates')
+
+    def __init__(self, fleet: SyntheticFleet, repeat: int, sample: int, bulk: int):
+        """
+        Args:
+            fleet (SyntheticFleet): The fleet to run on
+            repeat (int): How often every benchmark is run
+            sample (int): Number of subdomains the haproxy benchmarks change
+            bulk (int): Number of subdomains bulk operations run on
+        """
+        self.fleet = fleet
+        self.options = {**fleet.parameters, 'repeat': repeat, 'sample': sample, 'bulk': bulk}
+
+    @property
+    def environment(self) -> dict[str, str]:
+        """Environment of the suite processes, with the fake executables first on the path"""
+        environment = dict(os.environ)
+        environment['PATH'] = self.fleet.fakeBinDir + os.pathsep + environment.get('PATH', '')
+        return environment
+
+    def prepare(self, regenerate: bool = False):
+        """Generate the fleet, unless one of the same size exists already
+
+        Args:
+            regenerate (bool): Generate it even if it exists
+        """
+        if self.fleet.exists() and not regenerate:
+            # Keep the config up to date with the benchmark suite
+            self.fleet.writeConfig()
+            return
+        print("Generating", self.fleet.domains * self.fleet.subDomains, "subdomains in", self.fleet.workDir)
+        if isdir(self.fleet.rootDir):
+            rmtree(self.fleet.rootDir)
+        if isfile(self.fleet.haproxyConfigFile):
+            os.remove(self.fleet.haproxyConfigFile)
+        self.fleet.writeConfig()
+        self._runSuite('setup')
+
+    def run(self) -> dict[str, list[float]]:
+        """Run all suites
+
+        Returns:
+            dict[str, list[float]]: Seconds of every sample of every benchmark
+        """
+        timings: dict[str, list[float]] = dict()
+        for suite in self.suites:
+            print("Running", suite)
+            # Startup has to be measured in new processes, so every sample is one run
+            runs = [dict(cold=cold) for cold in (True, False) for _ in range(self.options['repeat'])] \
+                if 'startup' == suite else [dict()]
+            for options in runs:
+                for (name, samples) in self._runSuite(suite, options).items():
+                    timings.setdefault(name, list()).extend(samples)
+        return timings
+
+    def _runSuite(self, suite: str, options: dict = None) -> dict[str, list[float]]:
+        """Run a suite in a new process and return its timings"""
+        process = run([sys.executable, join(self.benchmarkDir, 'Suites.py'), self.fleet.workDir, suite,
+                       json.dumps({**self.options, **(options or dict())})],
+                      stdout=PIPE, env=self.environment, text=True)
+        if 0 != process.returncode:
+            raise RuntimeError('Suite ' + suite + ' failed with exit code ' + str(process.returncode))
+        return json.loads(process.stdout)
+
+    def report(self, timings: dict[str, list[float]], baseline: dict = None, tolerance: float = 0.25) -> list[str]:
+        """Print the median of every benchmark next to its baseline
+
+        Args:
+            timings (dict[str, list[float]]): Samples of every benchmark
+            baseline (dict): A baseline stored by `baselineOf`
+            tolerance (float): How much slower than the baseline a benchmark may get, 0.25 is 25%
+
+        Returns:
+            list[str]: Names of the benchmarks that got slower than allowed
+        """
+        baselineResults = dict()
+        if None is not baseline:
+            if baseline['options'] == self.options:
+                baselineResults = baseline['results']
+            else:
+                print("The baseline was recorded with other options, not comparing:", baseline['options'])
+        regressions = list()
+        print()
+        print("  " + "benchmark".ljust(26), "runs".rjust(5), "median".rjust(11), "min".rjust(11),
+              "baseline".rjust(11), "change".rjust(8))
+        for (name, samples) in timings.items():
+            current = median(samples)
+            line = "  " + name.ljust(26) + f"{len(samples):6d} {current * 1000:9.2f}ms {min(samples) * 1000:9.2f}ms"
+            if name in baselineResults.keys():
+                previous = baselineResults[name]
+                change = (current - previous) / previous if 0 < previous else 0
+                line += f" {previous * 1000:9.2f}ms {change:+8.0%}"
+                # Differences below a millisecond are noise
+                if change > tolerance and current - previous > 0.001:
+                    regressions.append(name)
+                    line += "  REGRESSION"
+            print(line)
+        return regressions
+
+    def baselineOf(self, timings: dict[str, list[float]]) -> dict:
+        """The medians of all benchmarks together with the options they were measured with"""
+        return {'options': self.options, 'results': {name: median(samples) for (name, samples) in timings.items()}}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Time ServiceManager on a synthetic fleet and compare to a baseline")
+    parser.add_argument('--work-dir', default=join(gettempdir(), 'servicemanager-benchmark'),
+                        help="where the fleet is generated, it is reused by later runs")
+    parser.add_argument('--domains', type=int, default=200, help="number of top level domains")
+    parser.add_argument('--subdomains', type=int, default=10, help="number of subdomains per top level domain")
+    parser.add_argument('--repeat', type=int, default=5, help="how often every benchmark is run")
+    parser.add_argument('--sample', type=int, default=20, help="subdomains changed by the haproxy benchmarks")
+    parser.add_argument('--bulk', type=int, default=100, help="subdomains brought up and down by bulk operations")
+    parser.add_argument('--baseline', default=join(Benchmark.benchmarkDir, 'baseline.json'),
+                        help="file with the baseline timings")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument('--save-baseline', action='store_true', help="store the timings as the new baseline")
+    parser.add_argument('--regenerate', action='store_true', help="generate the fleet again")
+    arguments = parser.parse_args()
+
+    benchmark = Benchmark(SyntheticFleet(arguments.work_dir, arguments.domains, arguments.subdomains),
+                          arguments.repeat, arguments.sample, arguments.bulk)
+    benchmark.prepare(arguments.regenerate)
+    timings = benchmark.run()
+    baseline = None
+    if isfile(arguments.baseline):
+        with open(arguments.baseline, 'r') as baselineFile:
+            baseline = json.load(baselineFile)
+    regressions = benchmark.report(timings, baseline, arguments.tolerance)
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w') as baselineFile:
+            json.dump(benchmark.baselineOf(timings), baselineFile, indent=4)
+            baselineFile.write('\n')
+        print("Baseline saved to", arguments.baseline)
+    elif 0 < len(regressions):
+        print(len(regressions), "benchmarks got slower than the baseline allows")
+        sys.exit(1)
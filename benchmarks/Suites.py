@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+from contextlib import contextmanager
+from os.path import abspath, dirname, isfile, join
+from time import perf_counter
+
+from SyntheticFleet import SyntheticFleet
+
+
+class Suites:
+    """The timed parts of the benchmark
+
+    Every suite runs in its own process started by `Benchmark`, with the fleets config.py first on the path.
+    ServiceManager is only imported inside the suites, as importing it reads the config.
+    """
+
+    def __init__(self, workDir: str, options: dict):
+        """
+        Args:
+            workDir (string): Directory of the synthetic fleet
+            options (dict): Size of the fleet and of the samples, see `Benchmark`
+        """
+        self.options = options
+        self.fleet = SyntheticFleet(workDir, options['domains'], options['subDomains'])
+        # Benchmark name -> seconds of every sample
+        self.timings: dict[str, list[float]] = dict()
+
+    @contextmanager
+    def timed(self, name: str):
+        """Add the time spent inside as a sample of a benchmark"""
+        start = perf_counter()
+        yield
+        self.timings.setdefault(name, list()).append(perf_counter() - start)
+
+    def _sample(self, serviceManager, count: int) -> list:
+        """Subdomains spread evenly over the fleet, with their modules already loaded"""
+        subDomains = serviceManager.allSubDomains()
+        step = max(1, len(subDomains) // max(1, count))
+        sample = subDomains[::step][:count]
+        for subDomain in sample:
+            subDomain.activeModule
+        return sample
+
+    def setup(self):
+        """Generate the fleet, create the .env files of all modules and route all subdomains through haproxy"""
+        from modules.ModuleLoader import ModuleLoader
+        from ServiceManager import ServiceManager
+        self.fleet.generate(sorted(ModuleLoader.availableModules.keys()))
+        serviceManager = ServiceManager()
+        with serviceManager.transaction():
+            for subDomain in serviceManager.allSubDomains():
+                subDomain.haproxyConfig()
+        self.fleet.markGenerated()
+
+    def startup(self):
+        """Import ServiceManager and load all domains, with or without an existing inventory index"""
+        cold = self.options.get('cold', False)
+        indexFile = join(self.fleet.rootDir, 'tmp', 'inventory.json')
+        if cold and isfile(indexFile):
+            os.remove(indexFile)
+        with self.timed('startup.import'):
+            from ServiceManager import ServiceManager
+        with self.timed('startup.cold' if cold else 'startup.warm'):
+            ServiceManager()
+
+    def completion(self):
+        """Complete typical command lines, the first round fills the completion caches"""
+        from prompt_toolkit.document import Document
+        from CliCompleter import CliCompleter
+        from ServiceManager import ServiceManager
+        serviceManager = ServiceManager()
+        completer = CliCompleter(serviceManager)
+        domainNames = sorted(serviceManager.inventory.domains())
+        serviceManager.currentDomain = serviceManager.domain(domainNames[len(domainNames) // 2])
+        serviceManager.currentSubDomain = self._sample(serviceManager, 1)[0]
+        commandLines = {
+            'completion.command': 'b',
+            'completion.domain': 'dm select ',
+            'completion.domainPrefix': 'dm select ' + domainNames[-1][:-5],
+            'completion.subDomain': 'sd select ',
+            'completion.moduleType': 'bulk up md ',
+            'completion.container': 'md log ',
+        }
+        for _ in range(self.options['repeat']):
+            for (name, commandLine) in commandLines.items():
+                with self.timed(name):
+                    list(completer.get_completions(Document(commandLine), None))
+
+    def haproxy(self):
+        """Remove and add the routing of single subdomains, then of all sampled subdomains at once"""
+        from ServiceManager import ServiceManager
+        serviceManager = ServiceManager()
+        sample = self._sample(serviceManager, self.options['sample'])
+        for subDomain in sample:
+            with self.timed('haproxy.remove'):
+                subDomain.haproxyConfig(delete=True, purge=True)
+        for subDomain in sample:
+            with self.timed('haproxy.add'):
+                subDomain.haproxyConfig()
+        for _ in range(self.options['repeat']):
+            with self.timed('haproxy.batchRemove'), serviceManager.transaction():
+                for subDomain in sample:
+                    subDomain.haproxyConfig(delete=True, purge=True)
+            with self.timed('haproxy.batchAdd'), serviceManager.transaction():
+                for subDomain in sample:
+                    subDomain.haproxyConfig()
+
+    def bulk(self):
+        """Take many modules down and bring them up again, like the fleet was before"""
+        from ServiceManager import ServiceManager
+        serviceManager = ServiceManager()
+        sample = self._sample(serviceManager, self.options['bulk'])
+        for _ in range(self.options['repeat']):
+            for action in ('down', 'up'):
+                with self.timed('bulk.' + action):
+                    results = serviceManager.bulk(action, sample)
+                if not all(result.success for result in results):
+                    raise RuntimeError('bulk ' + action + ' failed: ' +
+                                       ', '.join(str(result) for result in results if not result.success))
+
+    def certificates(self):
+        """Renew the certificates of all subdomains of two top level domains and wait until haproxy serves them
+
+        They are issued one certbot run per subdomain first, then grouped into one run per top level domain.
+        """
+        import config
+        from CertificateQueue import CertificateQueue
+        from ServiceManager import ServiceManager
+        serviceManager = ServiceManager()
+        sample = [subDomain for domainName in sorted(serviceManager.inventory.domains())[:2]
+                  for subDomain in serviceManager.subDomainsOf(domainName)]
+        # Modules are loaded first, so only the renewals below request certificates
+        for subDomain in sample:
+            subDomain.activeModule
+        config.handle_ssl_certificates = True
+        certificateQueue = CertificateQueue.forRootDir(serviceManager.rootDir)
+        for grouping in (False, True):
+            certificateQueue.grouping = grouping
+            name = 'certificates.grouped' if grouping else 'certificates.single'
+            for _ in range(self.options['repeat']):
+                with self.timed(name):
+                    with self.timed('certificates.request'):
+                        for subDomain in sample:
+                            subDomain._setupSsl(forceRenewal=True)
+                    certificateQueue.wait()
+                failed = [subDomain for subDomain in sample if 'issued' != certificateQueue.status(subDomain.name)[0]]
+                if 0 < len(failed):
+                    raise RuntimeError('certificates failed: ' + ', '.join(
+                        str(subDomain) + ' ' + certificateQueue.status(subDomain.name)[1] for subDomain in failed))
+
+
+if __name__ == '__main__':
+    # Usage: Suites.py WORK_DIR SUITE OPTIONS_JSON, the timings are written to stdout as json
+    workDir, suite, options = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+    # The fleets config.py has to shadow the one of the repository
+    sys.path[:0] = [workDir, dirname(dirname(abspath(__file__)))]
+    suites = Suites(workDir, options)
+    # Keep output of the service manager and of the processes it starts out of the timings
+    timingsOutput = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    with open(os.devnull, 'w') as devNull:
+        os.dup2(devNull.fileno(), sys.stdout.fileno())
+        getattr(suites, suite)()
+    json.dump(suites.timings, timingsOutput)
+    timingsOutput.close()
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+import json
+from os import makedirs
+from os.path import dirname, isfile, join
+from shutil import copyfile
+
+
+class SyntheticFleet:
+    """A generated root directory with many top level domains and subdomains
+
+    Everything lives in a work directory next to a config.py pointing ServiceManager at it, at the haproxy.cfg
+    and certificate directories of the work directory and at the fake executables, so nothing outside of the work
+    directory is touched.
+    """
+    # Directory of the benchmark suite
+    benchmarkDir = dirname(__file__)
+    # Names subdomains are built from, a number is added once they run out
+    subDomainNames = ('www', 'blog', 'cloud', 'shop', 'git', 'wiki', 'chat', 'crm', 'docs', 'status', 'helpdesk',
+                      'office', 'registry', 'links', 'vpn', 'dmarc')
+
+    def __init__(self, workDir: str, domains: int, subDomains: int):
+        """
+        Args:
+            workDir (string): Directory the fleet and its config are created in
+            domains (int): Number of top level domains
+            subDomains (int): Number of subdomains per top level domain
+        """
+        self.workDir = workDir
+        self.domains = domains
+        self.subDomains = subDomains
+        self.rootDir = join(workDir, 'root')
+        self.haproxyConfigFile = join(workDir, 'haproxy.cfg')
+        self.fakeBinDir = join(self.benchmarkDir, 'fakebin')
+        # Parameters of the generated fleet, it is only reused if they match
+        self.stateFile = join(workDir, 'fleet.json')
+
+    @property
+    def parameters(self) -> dict:
+        """Size of the fleet"""
+        return {'domains': self.domains, 'subDomains': self.subDomains}
+
+    def exists(self) -> bool:
+        """Whether a fleet of this size was already generated in the work directory"""
+        if not isfile(self.stateFile):
+            return False
+        with open(self.stateFile, 'r') as stateFile:
+            return json.load(stateFile) == self.parameters
+
+    def writeConfig(self):
+        """Write the config.py of the fleet and the initial haproxy.cfg, unless the fleet already has one"""
+        makedirs(self.rootDir, exist_ok=True)
+        if not isfile(self.haproxyConfigFile):
+            copyfile(join(self.benchmarkDir, 'haproxy.cfg'), self.haproxyConfigFile)
+        with open(join(self.workDir, 'config.py'), 'w') as configFile:
+            configFile.write('\n'.join([
+                '# Generated by the benchmark suite',
+                'from config_example import *',
+                '',
+                'used_proxy = Proxy.haproxy',
+                f'root_dir = {self.rootDir!r}',
+                f'haproxy_config_file = {self.haproxyConfigFile!r}',
+                f'haproxy_map_file = {join(self.workDir, "subdomains.map")!r}',
+                f'haproxy_crt_list_file = {join(self.workDir, "certificates.list")!r}',
+                f'haproxy_stats_socket = {join(self.workDir, "admin.sock")!r}',
+                f'docker_compose_command = [{join(self.fakeBinDir, "docker")!r}, "compose"]',
+                f'certbot_command = [{join(self.fakeBinDir, "certbot")!r}]',
+                f'certbot_config_dir = {join(self.workDir, "letsencrypt")!r}',
+                f'ssl_dir = {join(self.workDir, "ssl")!r}',
+                # Certificates are only requested by the certificates suite, which times the whole queue
+                'handle_ssl_certificates = False',
+                'certificate_rate_limit = (1000000, 1)',
+                # Without a docker daemon everything goes through the fake docker compose
+                f'docker_socket = {join(self.workDir, "docker.sock")!r}',
+                'docker_events = False',
+                'log_archive_interval = 0',
+                '',
+            ]))
+
+    def generate(self, moduleNames: list[str]):
+        """Create the directories of all subdomains, every module type is used in turn
+
+        Args:
+            moduleNames (list[str]): The module types to install
+        """
+        index = 0
+        for domainIndex in range(self.domains):
+            domainName = f'customer{domainIndex:04d}.com'
+            for subIndex in range(self.subDomains):
+                subName = self.subDomainNames[subIndex % len(self.subDomainNames)]
+                if subIndex >= len(self.subDomainNames):
+                    subName += str(subIndex // len(self.subDomainNames))
+                subDomainDir = join(self.rootDir, domainName, subName + '.' + domainName)
+                makedirs(subDomainDir, exist_ok=True)
+                with open(join(subDomainDir, '.module'), 'w') as moduleFile:
+                    moduleFile.write('MODULE_NAME=' + moduleNames[index % len(moduleNames)] + '\n')
+                index += 1
+
+    def markGenerated(self):
+        """Remember the fleet as complete, so the next run can reuse it"""
+        with open(self.stateFile, 'w') as stateFile:
+            json.dump(self.parameters, stateFile)
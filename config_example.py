@@ -10,6 +10,69 @@ class Proxy:
 used_proxy: Proxy = Proxy.traefik
 proxy_network_name = 'proxy'
 handle_ssl_certificates: bool = False
+# Certificates are issued in the background with certbot
+certbot_command: list[str] = ["certbot"]
+certbot_email = 'alexander@h-software.de'
+# Passed to certbot as --config-dir, it keeps the issued certificates in its live folder
+certbot_config_dir = join('/', 'etc', 'letsencrypt')
+# The combined certificate file haproxy loads for a subdomain is kept in ssl_dir/SUBDOMAIN/cert.pem
+ssl_dir = join('/', 'etc', 'ssl')
+# Issue one certificate for all queued subdomains of a top level domain
+certificate_grouping: bool = False
+# Run certbot at most this many times per number of seconds
+certificate_rate_limit: tuple[int, float] = (5, 3600)
+# Seconds before a failed certificate is requested again, doubled after every further failure
+certificate_retry_delay: float = 600
+# Renew certificates expiring within this many days, spread over this many seconds
+certificate_renewal_days: float = 30
+certificate_renewal_spread: float = 3600
+
+haproxy_config_file = join('/', 'etc', 'haproxy', 'haproxy.cfg')
+# Check a new haproxy config with `haproxy -c` before it replaces the old one
+haproxy_validate: bool = True
+# Route hosts with one acl per subdomain ('acl') or with a single rule and a map file ('map'),
+# map entries are changed through the stats socket without reloading haproxy
+haproxy_routing: str = 'acl'
+haproxy_map_file = join('/', 'etc', 'haproxy', 'subdomains.map')
+# Load certificates directly on the ssl bind line ('inline') or from a crt-list file ('crt-list'),
+# crt-list entries are changed through the stats socket without reloading haproxy
+haproxy_certificates: str = 'inline'
+haproxy_crt_list_file = join('/', 'etc', 'haproxy', 'certificates.list')
+# Needs `level admin`, e.g. `stats socket /run/haproxy/admin.sock mode 660 level admin` in the global section
+haproxy_stats_socket = join('/', 'run', 'haproxy', 'admin.sock')
 
 docker_compose_command: list[str] = ["docker", "compose"]
+# Containers are queried through the docker daemons socket, docker compose is only used if it can't be reached
+docker_socket = join('/', 'var', 'run', 'docker.sock')
+# Keep the state of all containers in memory, updated from dockers event stream
+docker_events: bool = True
 root_dir = join('/', 'srv', 'services')
+# Only build subdomains and their modules the first time they are used
+lazy_loading: bool = True
+# Additional modules by name and dotted path, e.g. {'MyModule': 'mypackage.MyModule:MyModule'}
+extra_modules: dict[str, str] = dict()
+# Seconds the inventory index (root_dir/tmp/inventory.json) is trusted before checking the disk for changes
+inventory_refresh_interval: float = 2
+# Host ports handed out to modules (first, last)
+port_range: tuple[int, int] = (20000, 29999)
+# Seconds container names are cached for tab completion
+completion_cache_ttl: float = 10
+# Existing lines shown when following container logs
+log_tail_lines: int = 10
+# Lines buffered per container while following logs, the oldest are dropped when the output can't keep up
+log_buffer_lines: int = 1000
+# Seconds between archiving the new log output of all containers to root_dir/tmp/logs, e.g. 300, 0 disables it
+log_archive_interval: float = 0
+# Days archived log output is kept
+log_archive_days: float = 14
+# Size of the word index of every archived hour of a service, larger is more precise
+log_archive_bloom_bits: int = 32768
+# Collect resource metrics from the start instead of when they are first shown
+metrics_autostart: bool = False
+# Seconds between two metric samples and number of samples kept per subdomain and module type
+metrics_interval: float = 10
+metrics_history: int = 360
+# How many modules bulk commands handle at the same time
+bulk_concurrency: int = 4
+# Serve latency histograms and counters at http://ADDRESS:PORT/metrics for Prometheus, e.g. ('127.0.0.1', 9464)
+tracing_endpoint: tuple[str, int] = None
@@ -15,5 +15,5 @@ class Collabora(Module):
 
     def _getCustomEnvVars(self) -> dict[str, str]:
         return {
-            'ADMIN_PASSWORD': self.password(),
+            'ADMIN_PASSWORD': self.password,
         }
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from subprocess import CompletedProcess
+from typing import Coroutine, TextIO
+
+
+class ComposeEngine:
+    """
+    Runs docker compose processes with asyncio, so many of them can be driven at the same time.
+
+    Output is either passed through to the terminal or streamed line by line with a prefix,
+    it is never buffered completely unless it is explicitly captured.
+    """
+    # Longest line kept in memory, longer lines are split
+    maxLineLength = 64 * 1024
+    # Seconds a process has to exit after being terminated, before it is killed
+    terminateTimeout = 10
+
+    @classmethod
+    async def call(cls, args: list[str], prefix: str = None, timeout: float = None, output: TextIO = None) -> int:
+        """
+        Run a process until it exits.
+
+        Args:
+            args (list[str]): The command and its arguments
+            prefix (str): Prefix every output line with this, the output is passed through unchanged if omitted
+            timeout (float): Seconds after which the process is terminated and `TimeoutError` is raised
+            output (TextIO): Where prefixed output is written to, defaults to stdout
+
+        Returns:
+            int: Exit code of the process
+        """
+        if None is prefix:
+            # Pass the terminal through, so interactive commands keep working
+            process = await asyncio.create_subprocess_exec(*args)
+            return await cls._wait(process, timeout)
+
+        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT)
+        pump = asyncio.create_task(cls._pump(process.stdout, prefix, output or sys.stdout))
+        try:
+            return await cls._wait(process, timeout)
+        finally:
+            await pump
+
+    @classmethod
+    async def run(cls, args: list[str], timeout: float = None) -> CompletedProcess:
+        """
+        Run a process until it exits and capture its text output.
+
+        Args:
+            args (list[str]): The command and its arguments
+            timeout (float): Seconds after which the process is terminated and `TimeoutError` is raised
+
+        Returns:
+            CompletedProcess: Exit code and output of the process
+        """
+        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            await cls._terminate(process)
+            raise
+        return CompletedProcess(args, process.returncode, stdout.decode(errors='replace'),
+                                stderr.decode(errors='replace'))
+
+    @classmethod
+    async def _wait(cls, process: asyncio.subprocess.Process, timeout: float = None) -> int:
+        """Wait for a process to exit, terminating it on timeout or cancellation"""
+        try:
+            return await asyncio.wait_for(process.wait(), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            await cls._terminate(process)
+            raise
+
+    @classmethod
+    async def _terminate(cls, process: asyncio.subprocess.Process):
+        """Stop a process, killing it if it doesn't exit in time"""
+        if None is not process.returncode:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), cls.terminateTimeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    @classmethod
+    async def _pump(cls, stream: asyncio.StreamReader, prefix: str, output: TextIO):
+        """Copy a stream to the output line by line, prefixing each line"""
+        buffer = b''
+        while True:
+            chunk = await stream.read(cls.maxLineLength)
+            if not chunk:
+                break
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            # Don't let a single endless line fill up the memory
+            if len(buffer) >= cls.maxLineLength:
+                lines.append(buffer)
+                buffer = b''
+            for line in lines:
+                output.write(f'{prefix} | {line.decode(errors="replace").rstrip()}\n')
+            output.flush()
+        if buffer:
+            output.write(f'{prefix} | {buffer.decode(errors="replace").rstrip()}\n')
+            output.flush()
+
+    @staticmethod
+    def sync(coroutine: Coroutine):
+        """
+        Run a coroutine to completion from synchronous code.
+
+        If this thread already runs an event loop, the coroutine is run in a separate thread.
+
+        Args:
+            coroutine (Coroutine): The coroutine to run
+
+        Returns:
+            The coroutine's result
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Context variables, like the running tracing span, are carried over into the thread
+            return executor.submit(copy_context().run, asyncio.run, coroutine).result()
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+from http.client import HTTPException
+from os.path import join
+from threading import Lock, Thread
+from time import sleep
+
+from .DockerApi import DockerApi
+
+
+class ContainerWatcher:
+    """Keeps the state of all containers of the managed compose projects in memory
+
+    The state is listed once and then updated from the docker event stream, so looking it up is a dictionary access.
+    Only projects below the root directory are tracked. While the stream is down, e.g. because the docker daemon is
+    restarted, the cache is not `ready` and callers ask docker directly.
+    """
+    # One watcher per docker socket
+    _instances: dict[str, 'ContainerWatcher'] = dict()
+    # Events that change a containers state
+    watchedEvents = ('create', 'start', 'restart', 'die', 'stop', 'pause', 'unpause', 'destroy', 'health_status')
+    # Seconds to wait before reconnecting to the event stream
+    reconnectDelay = 5
+
+    @classmethod
+    def forSocket(cls, socketPath: str, rootDir: str) -> 'ContainerWatcher':
+        """Get the shared watcher of a docker socket
+
+        Args:
+            socketPath (string): Location of the docker socket
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            ContainerWatcher: The watcher
+        """
+        if socketPath not in cls._instances.keys():
+            cls._instances[socketPath] = cls(DockerApi.forSocket(socketPath), rootDir)
+        return cls._instances[socketPath]
+
+    def __init__(self, dockerApi: DockerApi, rootDir: str):
+        """
+        Args:
+            dockerApi (DockerApi): Client for the docker daemon
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.dockerApi = dockerApi
+        self.rootDir = join(rootDir, '')
+        self.ready = False
+        # Incremented with every change, so users can tell if their copies are outdated
+        self.generation = 0
+        self._lock = Lock()
+        self._thread: Thread = None
+        # Compose project -> container id -> container state
+        self._projects: dict[str, dict[str, dict]] = dict()
+
+    def start(self):
+        """Start watching in a background thread, if the docker socket exists"""
+        if (None is self._thread or not self._thread.is_alive()) and self.dockerApi.available():
+            self._thread = Thread(target=self._run, name='ContainerWatcher', daemon=True)
+            self._thread.start()
+
+    def containerStates(self, project: str) -> list[dict]:
+        """The state of all containers of a compose project
+
+        Args:
+            project (string): Name of the compose project
+
+        Returns:
+            list[dict]: The containers as described in `DockerApi.containerState()`, None if the cache isn't ready
+        """
+        if not self.ready:
+            return None
+        with self._lock:
+            return [dict(state) for state in self._projects.get(project, dict()).values()]
+
+    def projects(self) -> dict[str, list[dict]]:
+        """The state of all containers by compose project, None if the cache isn't ready"""
+        if not self.ready:
+            return None
+        with self._lock:
+            return {project: [dict(state) for state in containers.values()]
+                    for (project, containers) in self._projects.items()}
+
+    def _run(self):
+        """Follow the event stream, reconnecting whenever it ends"""
+        while True:
+            try:
+                self._watch()
+            except (OSError, RuntimeError, ValueError, HTTPException):
+                pass
+            self.ready = False
+            sleep(self.reconnectDelay)
+
+    def _watch(self):
+        """Take a snapshot of all containers and apply events to it until the stream ends"""
+        events = self.dockerApi.stream('/events', filters={
+            'type': ['container'],
+            'label': [DockerApi.projectLabel],
+            'event': list(self.watchedEvents),
+        })
+        try:
+            # The stream is already open, so events happening while the snapshot is taken are applied afterwards
+            projects = dict()
+            for container in self.dockerApi.containers(stopped=True):
+                labels = container.get('Labels', dict())
+                if self._isManaged(labels):
+                    projects.setdefault(labels[DockerApi.projectLabel], dict())[container['Id']] = \
+                        DockerApi.containerState(container)
+            with self._lock:
+                self._projects = projects
+                self.generation += 1
+            self.ready = True
+            for event in events:
+                self._apply(event)
+        finally:
+            events.close()
+
+    def _isManaged(self, labels: dict) -> bool:
+        """Whether a container belongs to a project below the root directory"""
+        return join(labels.get(DockerApi.workingDirLabel, ''), '').startswith(self.rootDir)
+
+    def _apply(self, event: dict):
+        """Update the state of a container from an event"""
+        actor = event.get('Actor', dict())
+        attributes = actor.get('Attributes', dict())
+        if not self._isManaged(attributes):
+            return
+        project = attributes[DockerApi.projectLabel]
+        containerId = actor.get('ID', event.get('id'))
+        action = event.get('Action', event.get('status', ''))
+        with self._lock:
+            containers = self._projects.setdefault(project, dict())
+            if 'destroy' == action:
+                containers.pop(containerId, None)
+                if 0 == len(containers):
+                    del self._projects[project]
+            else:
+                state = containers.setdefault(containerId, {
+                    'id': containerId, 'service': attributes.get(DockerApi.serviceLabel), 'name': attributes.get('name'),
+                    'state': 'created', 'status': 'Created', 'health': None,
+                })
+                if action.startswith('health_status'):
+                    state['health'] = action.split(':', 1)[-1].strip()
+                elif action in ('start', 'restart', 'unpause'):
+                    state.update({'state': 'running', 'status': 'Up'})
+                    if 'unpause' != action:
+                        state['health'] = None
+                elif 'die' == action:
+                    state.update({'state': 'exited', 'status': f'Exited ({attributes.get("exitCode", 0)})',
+                                  'health': None})
+                # Stopping a container also emits a die event, which carries the exit code
+                elif 'stop' == action and 'exited' != state['state']:
+                    state.update({'state': 'exited', 'status': 'Exited', 'health': None})
+                elif 'pause' == action:
+                    state.update({'state': 'paused', 'status': 'Up (Paused)'})
+            self.generation += 1
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+import json
+import re
+import socket
+from http.client import HTTPConnection, HTTPException, HTTPResponse
+from os.path import exists
+from queue import Empty, Full, LifoQueue
+from typing import Generator
+from urllib.parse import quote, urlencode
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """An HTTP connection over a unix socket"""
+
+    def __init__(self, socketPath: str, timeout: float = None):
+        """
+        Args:
+            socketPath (string): Location of the unix socket
+            timeout (float): Seconds to wait for the socket
+        """
+        super().__init__('localhost', timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if None is not self.timeout:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+class LogStream:
+    """The log output of a container, split into lines
+
+    Without a terminal docker multiplexes stdout and stderr into frames with an 8 byte header:
+    the stream type, three zero bytes and the big endian payload size. With a terminal the output is sent as is.
+    """
+    # Longest line kept in memory, longer lines are split
+    maxLineLength = 64 * 1024
+
+    def __init__(self, connection: UnixHTTPConnection, response: HTTPResponse, tty: bool):
+        """
+        Args:
+            connection (UnixHTTPConnection): The connection the logs were requested on
+            response (HTTPResponse): The answer, its body wasn't read yet
+            tty (bool): Whether the container has a terminal attached
+        """
+        self._connection = connection
+        self._response = response
+        self.tty = tty
+
+    def __iter__(self) -> Generator[tuple[str, bytes], None, None]:
+        """The stream name (stdout or stderr) and content of every line, until the stream ends or is closed"""
+        try:
+            if self.tty:
+                while True:
+                    line = self._response.readline(self.maxLineLength)
+                    if not line:
+                        return
+                    yield 'stdout', line.rstrip(b'\r\n')
+            partial = {'stdout': b'', 'stderr': b''}
+            while True:
+                header = self._response.read(8)
+                if 8 > len(header):
+                    break
+                streamName = 'stderr' if 2 == header[0] else 'stdout'
+                lines = (partial[streamName] + self._response.read(int.from_bytes(header[4:], 'big'))).split(b'\n')
+                partial[streamName] = lines.pop()
+                if len(partial[streamName]) > self.maxLineLength:
+                    lines.append(partial[streamName])
+                    partial[streamName] = b''
+                for line in lines:
+                    yield streamName, line.rstrip(b'\r')
+            for (streamName, line) in partial.items():
+                if line:
+                    yield streamName, line
+        except (OSError, ValueError, HTTPException):
+            # The stream was closed from another thread
+            return
+        finally:
+            self._connection.close()
+
+    def close(self):
+        """End the stream, also while another thread is waiting for the next line"""
+        sock = self._connection.sock
+        if None is not sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class DockerApi:
+    """A small client for the read-only parts of the Docker Engine API
+
+    Requests are sent over the docker socket with keep-alive connections that are reused from a pool,
+    so no process has to be started and no compose file has to be parsed to query containers.
+    """
+    # Labels docker compose puts on every container of a project
+    projectLabel = 'com.docker.compose.project'
+    serviceLabel = 'com.docker.compose.service'
+    workingDirLabel = 'com.docker.compose.project.working_dir'
+    # One client per socket
+    _instances: dict[str, 'DockerApi'] = dict()
+
+    @classmethod
+    def forSocket(cls, socketPath: str) -> 'DockerApi':
+        """Get the shared client of a docker socket
+
+        Args:
+            socketPath (string): Location of the docker socket
+
+        Returns:
+            DockerApi: The client
+        """
+        if socketPath not in cls._instances.keys():
+            cls._instances[socketPath] = cls(socketPath)
+        return cls._instances[socketPath]
+
+    def __init__(self, socketPath: str, poolSize: int = 4, timeout: float = 10):
+        """
+        Args:
+            socketPath (string): Location of the docker socket
+            poolSize (int): How many idle connections are kept open
+            timeout (float): Seconds to wait for an answer
+        """
+        self.socketPath = socketPath
+        self.timeout = timeout
+        self._pool: LifoQueue[UnixHTTPConnection] = LifoQueue(poolSize)
+
+    def available(self) -> bool:
+        """Whether the docker socket exists"""
+        return exists(self.socketPath)
+
+    def get(self, path: str, **query) -> object:
+        """Send a GET request and decode the JSON answer
+
+        Args:
+            path (string): The API path, e.g. `/containers/json`
+            **query: Query parameters, dictionaries and lists are encoded as JSON
+
+        Returns:
+            object: The decoded answer
+        """
+        path = self._path(path, query)
+        status, body = self.request('GET', path)
+        self._checkStatus(path, status, body)
+        return json.loads(body)
+
+    def stream(self, path: str, **query) -> Generator[object, None, None]:
+        """Send a GET request on its own connection and decode the answer line by line while it is streamed
+
+        The request is sent before this returns, reading from the generator blocks until the next line arrives.
+
+        Args:
+            path (string): The API path, e.g. `/events`
+            **query: Query parameters, dictionaries and lists are encoded as JSON
+
+        Returns:
+            Generator[object]: The decoded lines, until the daemon ends the stream or the generator is closed
+        """
+        # The request is sent right away, so nothing happening from now on is missed
+        return self._lines(*self._open(path, query))
+
+    def _open(self, path: str, query: dict) -> tuple[UnixHTTPConnection, HTTPResponse]:
+        """Send a GET request on its own connection and return it before the answer is read"""
+        path = self._path(path, query)
+        # Streams can be quiet for a long time, so they never time out
+        connection = UnixHTTPConnection(self.socketPath)
+        try:
+            connection.request('GET', path, headers={'Host': 'docker'})
+            response = connection.getresponse()
+            if 400 <= response.status:
+                self._checkStatus(path, response.status, response.read())
+        except BaseException:
+            connection.close()
+            raise
+        return connection, response
+
+    @staticmethod
+    def _lines(connection: UnixHTTPConnection, response: HTTPResponse) -> Generator[object, None, None]:
+        """Decode a streamed answer line by line and close its connection afterwards"""
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _path(path: str, query: dict) -> str:
+        """Append query parameters to a path"""
+        if 0 == len(query):
+            return path
+        return path + '?' + urlencode({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                       for (key, value) in query.items()})
+
+    @staticmethod
+    def _checkStatus(path: str, status: int, body: bytes):
+        """Raise a RuntimeError with the daemons message for failed requests"""
+        if 400 > status:
+            return
+        try:
+            message = json.loads(body).get('message', '')
+        except ValueError:
+            message = body.decode(errors='replace')
+        raise RuntimeError(f'docker: GET {path}: {status} {message}')
+
+    def request(self, method: str, path: str) -> tuple[int, bytes]:
+        """Send a request on a pooled connection
+
+        A connection the daemon closed in the meantime is replaced and the request is sent once more.
+
+        Args:
+            method (string): The HTTP method
+            path (string): The path including the query
+
+        Returns:
+            tuple[int, bytes]: The status code and body of the answer
+        """
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, headers={'Host': 'docker'})
+                response: HTTPResponse = connection.getresponse()
+                body = response.read()
+            except (HTTPException, ConnectionError):
+                connection.close()
+                if 2 == attempt:
+                    raise
+                continue
+            except OSError:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, body
+
+    def _connection(self) -> UnixHTTPConnection:
+        """An idle connection from the pool or a new one"""
+        try:
+            return self._pool.get_nowait()
+        except Empty:
+            return UnixHTTPConnection(self.socketPath, self.timeout)
+
+    def _release(self, connection: UnixHTTPConnection):
+        """Put a connection back into the pool, closing it if the pool is full"""
+        try:
+            self._pool.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def containers(self, project: str = None, stopped: bool = False) -> list[dict]:
+        """List containers
+
+        Args:
+            project (string): Only containers of this compose project, containers of all projects if omitted
+            stopped (bool): Also list stopped containers
+
+        Returns:
+            list[dict]: The containers as returned by the API
+        """
+        label = self.projectLabel + ('=' + project if None is not project else '')
+        return self.get('/containers/json', all=int(stopped), filters={'label': [label]})
+
+    @classmethod
+    def containerState(cls, container: dict) -> dict:
+        """The state of a container from a container list
+
+        Args:
+            container (dict): The container as returned by `containers()`
+
+        Returns:
+            dict: The containers `id`, `service`, `name`, `state` (e.g. running), `status` (e.g. Up 2 hours)
+                and `health` (healthy, unhealthy, starting or None)
+        """
+        # The list doesn't contain the health, but the status ends with it, e.g. "Up 2 hours (healthy)"
+        health = re.search(r'\((?:health: )?(healthy|unhealthy|starting)\)', container.get('Status', ''))
+        return {
+            'id': container.get('Id'),
+            'service': container.get('Labels', dict()).get(cls.serviceLabel),
+            'name': (container.get('Names') or ['/'])[0][1:],
+            'state': container.get('State'),
+            'status': container.get('Status'),
+            'health': health.group(1) if None is not health else None,
+        }
+
+    def logs(self, container: str, follow: bool = True, tail: str = '0', tty: bool = None, since: str = None,
+             timestamps: bool = False) -> 'LogStream':
+        """Read the log output of a container
+
+        Args:
+            container (string): Id or name of the container
+            follow (bool): Keep reading new output until the container stops or the stream is closed
+            tail (string): Number of existing lines to start with, `all` for all of them
+            tty (bool): Whether the container has a terminal attached, looked up if omitted
+            since (string): Only lines written after this unix timestamp, with up to nine fractional digits
+            timestamps (bool): Start every line with its RFC 3339 timestamp and a space
+
+        Returns:
+            LogStream: The output lines
+        """
+        if None is tty:
+            tty = self.inspect(container).get('Config', dict()).get('Tty', False)
+        query = {'follow': int(follow), 'stdout': 1, 'stderr': 1, 'tail': tail, 'timestamps': int(timestamps)}
+        if None is not since:
+            query['since'] = since
+        return LogStream(*self._open('/containers/' + quote(container, safe='') + '/logs', query), tty)
+
+    def inspect(self, container: str) -> dict:
+        """Details of a container
+
+        Args:
+            container (string): Id or name of the container
+
+        Returns:
+            dict: The container as returned by the API
+        """
+        return self.get('/containers/' + quote(container, safe='') + '/json')
+
+    def image(self, name: str) -> dict:
+        """Details of a local image
+
+        Args:
+            name (string): Name, tag or id of the image, e.g. `postgres:15`
+
+        Returns:
+            dict: The image as returned by the API
+        """
+        # Names of images from other registries contain slashes, the API expects them unescaped
+        return self.get('/images/' + quote(name, safe='/:') + '/json')
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+from os import stat
+from threading import RLock
+
+from AtomicFile import atomicWrite
+
+
+class EnvStore:
+    """Reads and writes files of `NAME=value` lines, like `.env` and `.module`
+
+    Parsed files are cached by their inode, modification time and size, so an unchanged file is only read once.
+    Files are only written if their variables really changed, and then replaced at once through a temporary file,
+    so a crash never leaves a half written file behind.
+    """
+    _lock = RLock()
+    # Path -> (signature, variables) of every read file
+    _cache: dict[str, tuple[tuple, dict[str, str]]] = dict()
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        """The (inode, mtime, size) of a file, None if it doesn't exist"""
+        try:
+            fileStat = stat(path)
+        except FileNotFoundError:
+            return None
+        return fileStat.st_ino, fileStat.st_mtime_ns, fileStat.st_size
+
+    @staticmethod
+    def parse(text: str) -> dict[str, str]:
+        """Get the variables of a file's content, lines without a `=` are skipped"""
+        variables = dict()
+        for line in text.splitlines():
+            splitLine = line.strip().split('=', 1)
+            if len(splitLine) != 2:
+                continue
+            variables[splitLine[0]] = splitLine[1]
+        return variables
+
+    @staticmethod
+    def serialize(variables: dict[str, str]) -> str:
+        """Get the content of a file holding the given variables"""
+        return ''.join(f'{name}={value}\n' for (name, value) in variables.items())
+
+    @classmethod
+    def read(cls, path: str) -> dict[str, str]:
+        """Get the variables of a file
+
+        Args:
+            path (string): Location of the file
+
+        Returns:
+            dict[str, str]: The variables, empty if the file doesn't exist
+        """
+        with cls._lock:
+            return dict(cls._read(path))
+
+    @classmethod
+    def _read(cls, path: str) -> dict[str, str]:
+        """The cached variables of a file, they must not be changed"""
+        signature = cls._signature(path)
+        if None is signature:
+            cls._cache.pop(path, None)
+            return dict()
+        cached = cls._cache.get(path)
+        if None is not cached and signature == cached[0]:
+            return cached[1]
+        with open(path, 'r') as file:
+            variables = cls.parse(file.read())
+        cls._cache[path] = (signature, variables)
+        return variables
+
+    @classmethod
+    def write(cls, path: str, variables: dict[str, str]) -> bool:
+        """Replace all variables of a file, if they differ from the current ones
+
+        Args:
+            path (string): Location of the file
+            variables (dict[str, str]): The variables in the order they are written, values are converted to strings
+
+        Returns:
+            bool: Whether the file was written
+        """
+        # Values are read back as strings
+        variables = {name: str(value) for (name, value) in variables.items()}
+        with cls._lock:
+            if None is not cls._signature(path) and list(variables.items()) == list(cls._read(path).items()):
+                return False
+            atomicWrite(path, cls.serialize(variables))
+            cls._cache[path] = (cls._signature(path), variables)
+            return True
+
+    @classmethod
+    def update(cls, path: str, variables: dict[str, str]) -> bool:
+        """Set some variables of a file, keeping all others
+
+        Args:
+            path (string): Location of the file
+            variables (dict[str, str]): The variables to set
+
+        Returns:
+            bool: Whether the file was written
+        """
+        with cls._lock:
+            return cls.write(path, cls.read(path) | variables)
+
@@ -26,13 +26,13 @@ class Leantime(Module):
             'LEAN_APP_URL'            : 'https://' + str(self.subDomain),
             'LEAN_APP_DIR'            : '',
             'LEAN_DEBUG'              : 0,
-            'MARIADB_ROOT_PASSWORD'   : self.password(),
+            'MARIADB_ROOT_PASSWORD'   : self.password,
             'LEAN_DB_HOST'            : 'db',
             'LEAN_DB_USER'            : 'lean',
-            'LEAN_DB_PASSWORD'        : self.password(200),
+            'LEAN_DB_PASSWORD'        : lambda: self.password(200),
             'LEAN_DB_DATABASE'        : 'leantime',
             'LEAN_DB_PORT'            : '3306',
-            'LEAN_SESSION_PASSWORD'   : self.password(),
+            'LEAN_SESSION_PASSWORD'   : self.password,
             'LEAN_SESSION_EXPIRATION' : 28800,
             'LEAN_SESSION_SECURE'     : True,
             # Email
@@ -11,6 +11,7 @@ class LinkStack(Module):
 
     LinkStack is an alternative to LinkTree.
     """
+    portVariables = ('HTTP_PORT',)
 
     def __init__(self, subDomain):
         self.requiredDirs = ['src']
@@ -19,8 +20,8 @@ class LinkStack(Module):
         chown(join(self.subDomain.rootDir, 'src'), 100, 101)
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
+            'HTTP_PORT'  : self.getFreePort,
             'ADMIN_EMAIL': 'invalid@example.com',
             'TIMEZONE'   : 'Europe/Berlin'
         }
@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+
+import gzip
+import heapq
+import json
+import re
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from http.client import HTTPException
+from os import listdir, makedirs, remove
+from os.path import getsize, isdir, isfile, join
+from shutil import rmtree
+from threading import RLock, Thread
+from time import gmtime, sleep, strftime, strptime, time
+from typing import Callable, Generator
+
+import config
+from AtomicFile import atomicWrite
+from .DockerApi import DockerApi
+
+
+class LogArchive:
+    """Keeps the log output of all containers in compressed hourly segments
+
+    Logs are stored in `tmp/logs/SUBDOMAIN/SERVICE/` below the root directory, one segment per hour named after it,
+    e.g. `2024-05-01T13.log.gz`. Every collection only asks docker for lines newer than the last archived one and
+    appends them to the segment as a separate gzip member. Next to each segment are two small index files:
+    `.idx` lists the time span and byte range of every member, so a time range is read without decompressing
+    the rest of the segment, and `.bloom` is a bloom filter of the words in the segment, so segments that can't
+    contain a searched word are skipped without reading them at all.
+    Lines are stored as `TIMESTAMP STREAM TEXT`, with the timestamp in UTC and always nine fractional digits,
+    so timestamps compare as strings.
+    """
+    # One archive per root directory
+    _instances: dict[str, 'LogArchive'] = dict()
+    # Words are runs of at least three letters, digits or underscores
+    wordPattern = re.compile(r'[a-z0-9_]{3,}')
+    # Hash functions of the bloom filters
+    bloomHashes = 3
+
+    @classmethod
+    def forRootDir(cls, rootDir: str) -> 'LogArchive':
+        """Get the shared log archive of a root directory
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            LogArchive: The log archive
+        """
+        if rootDir not in cls._instances.keys():
+            cls._instances[rootDir] = cls(rootDir)
+        return cls._instances[rootDir]
+
+    def __init__(self, rootDir: str):
+        """
+        Args:
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.rootDir = rootDir
+        self.archiveDir = join(self.rootDir, 'tmp', 'logs')
+        self.cursorFile = join(self.archiveDir, 'cursors.json')
+        self.bloomBits = getattr(config, 'log_archive_bloom_bits', 32768)
+        self._lock = RLock()
+        self._collector: Thread = None
+        # SUBDOMAIN/SERVICE -> timestamp of the last archived line
+        self._cursors: dict[str, str] = dict()
+        if isfile(self.cursorFile):
+            try:
+                with open(self.cursorFile, 'r') as cursorFile:
+                    self._cursors = json.load(cursorFile)
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def timestamp(unixTime: float) -> str:
+        """Format a unix timestamp the way archived lines are stamped"""
+        seconds = int(unixTime)
+        return strftime('%Y-%m-%dT%H:%M:%S', gmtime(seconds)) + '.%09dZ' % int((unixTime - seconds) * 1e9)
+
+    @staticmethod
+    def _normalize(timestamp: str) -> str:
+        """Pad the fraction of a docker timestamp to nine digits, e.g. 2024-05-01T13:00:00.5Z"""
+        seconds, _, fraction = timestamp.rstrip('Z').partition('.')
+        return seconds + '.' + fraction[:9].ljust(9, '0') + 'Z'
+
+    @staticmethod
+    def _unixTime(timestamp: str) -> str:
+        """Convert an archive timestamp to the seconds.nanoseconds format dockers `since` parameter expects"""
+        return str(timegm(strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S'))) + '.' + timestamp[20:29]
+
+    def _serviceDir(self, subDomainName: str, service: str) -> str:
+        """Where the segments of a service are stored"""
+        return join(self.archiveDir, subDomainName, service)
+
+    def collect(self, containers: list[tuple[str, dict]], workers: int = None) -> int:
+        """Archive the new log lines of many containers
+
+        Args:
+            containers (list[tuple[str, dict]]): The subdomain name and state (as described in
+                `DockerApi.containerState()`) of every container
+            workers (int): How many containers are read at the same time, defaults to `bulk_concurrency`
+
+        Returns:
+            int: Number of archived lines
+        """
+        dockerApi = DockerApi.forSocket(getattr(config, 'docker_socket', join('/', 'var', 'run', 'docker.sock')))
+        if not dockerApi.available() or 0 == len(containers):
+            return 0
+        workers = max(1, workers or getattr(config, 'bulk_concurrency', 4))
+        # Containers of a scaled service share their segments, so they are read one after the other
+        services: dict[tuple[str, str], list[dict]] = dict()
+        for (subDomainName, container) in containers:
+            services.setdefault((subDomainName, container['service']), list()).append(container)
+        with self._lock, ThreadPoolExecutor(workers) as executor:
+            lines = sum(executor.map(lambda service: self._collectService(dockerApi, *service), services.items()))
+            self._prune()
+            self._saveCursors()
+        return lines
+
+    def _collectService(self, dockerApi: DockerApi, service: tuple[str, str], containers: list[dict]) -> int:
+        """Archive the new log lines of the containers of a single service, see `collect`"""
+        key = '/'.join(service)
+        # Lines older than the retention would be pruned right away, so they aren't read at all
+        cursor = self._cursors.get(key, self._retentionLimit())
+        return sum(self._collectContainer(dockerApi, *service, container['id'], cursor) for container in containers)
+
+    def _collectContainer(self, dockerApi: DockerApi, subDomainName: str, service: str, containerId: str,
+                          cursor: str) -> int:
+        """Archive the log lines of a single container written after the cursor"""
+        key = subDomainName + '/' + service
+        try:
+            stream = dockerApi.logs(containerId, follow=False, tail='all', timestamps=True,
+                                    since=self._unixTime(cursor) if None is not cursor else None)
+            # Lines by segment, docker returns them in order
+            segments: dict[str, list[str]] = dict()
+            for (streamName, line) in stream:
+                timestamp, _, text = line.decode(errors='replace').partition(' ')
+                timestamp = self._normalize(timestamp)
+                # docker includes lines stamped exactly at the cursor
+                if None is not cursor and timestamp <= cursor:
+                    continue
+                segments.setdefault(timestamp[:13], list()).append(f'{timestamp} {streamName} {text}\n')
+        except (OSError, RuntimeError, HTTPException, ValueError):
+            return 0
+        count = 0
+        for (hour, lines) in segments.items():
+            self._append(self._serviceDir(subDomainName, service), hour, lines)
+            count += len(lines)
+            self._cursors[key] = max(self._cursors.get(key, ''), lines[-1][:30])
+        return count
+
+    def _append(self, serviceDir: str, hour: str, lines: list[str]):
+        """Add lines to a segment as a new gzip member and update its indices"""
+        if not isdir(serviceDir):
+            makedirs(serviceDir)
+        segment = join(serviceDir, hour + '.log.gz')
+        member = gzip.compress(''.join(lines).encode())
+        offset = getsize(segment) if isfile(segment) else 0
+        with open(segment, 'ab') as segmentFile:
+            segmentFile.write(member)
+        with open(join(serviceDir, hour + '.idx'), 'a') as indexFile:
+            indexFile.write(f'{lines[0][:30]} {lines[-1][:30]} {offset} {len(member)}\n')
+
+        bloomFile = join(serviceDir, hour + '.bloom')
+        try:
+            with open(bloomFile, 'rb') as bloom:
+                bits = bytearray(bloom.read())
+        except OSError:
+            bits = bytearray()
+        if len(bits) * 8 != self.bloomBits:
+            bits = bytearray(self.bloomBits // 8)
+        for word in set(self.wordPattern.findall(''.join(line[30:] for line in lines).lower())):
+            for position in self._bloomPositions(word, len(bits) * 8):
+                bits[position // 8] |= 1 << position % 8
+        atomicWrite(bloomFile, bytes(bits))
+
+    @classmethod
+    def _bloomPositions(cls, word: str, bitCount: int) -> list[int]:
+        """The bits of a bloom filter a word sets"""
+        digest = blake2b(word.encode(), digest_size=4 * cls.bloomHashes).digest()
+        return [int.from_bytes(digest[index:index + 4], 'big') % bitCount for index in range(0, len(digest), 4)]
+
+    def _mayContain(self, bloomFile: str, words: set[str]) -> bool:
+        """Whether a segment may contain all words, only the bits checked are read from its bloom filter"""
+        if 0 == len(words):
+            return True
+        try:
+            with open(bloomFile, 'rb') as bloom:
+                bitCount = getsize(bloomFile) * 8
+                for word in words:
+                    for position in self._bloomPositions(word, bitCount):
+                        bloom.seek(position // 8)
+                        if not bloom.read(1)[0] & 1 << position % 8:
+                            return False
+        except (OSError, IndexError, ZeroDivisionError):
+            # Without a filter the segment has to be read
+            pass
+        return True
+
+    def search(self, subDomainNames: list[str] = None, services: list[str] = None, text: str = None,
+               pattern: str = None, since: float = None, until: float = None
+               ) -> Generator[tuple[str, str, str, str, str], None, None]:
+        """Search the archived lines in a time range
+
+        Args:
+            subDomainNames (list[str]): Only these subdomains, all if omitted
+            services (list[str]): Only these compose services, all if omitted
+            text (string): Only lines containing all words of this text, case insensitive
+            pattern (string): Only lines matching this regular expression
+            since (float): Unix timestamp of the earliest line
+            until (float): Unix timestamp of the latest line
+
+        Returns:
+            Generator[tuple[str, str, str, str, str]]: The subdomain, service, timestamp, stream name and text of
+                every matching line in chronological order
+        """
+        first = self.timestamp(since) if None is not since else ''
+        last = self.timestamp(until) if None is not until else '~'
+        words = set(self.wordPattern.findall(text.lower())) if None is not text else set()
+        regex = re.compile(pattern) if None is not pattern else None
+
+        readers = list()
+        for subDomainName in sorted(subDomainNames if None is not subDomainNames else self._listDir(self.archiveDir)):
+            for service in sorted(self._listDir(join(self.archiveDir, subDomainName))):
+                if None is services or service in services:
+                    readers.append(self._searchService(subDomainName, service, first, last, words, regex))
+        yield from heapq.merge(*readers, key=lambda line: line[2])
+
+    @staticmethod
+    def _listDir(path: str) -> list[str]:
+        """The subdirectories of a directory"""
+        return [name for name in listdir(path) if isdir(join(path, name))] if isdir(path) else list()
+
+    def _searchService(self, subDomainName: str, service: str, first: str, last: str, words: set[str],
+                       regex: re.Pattern) -> Generator[tuple[str, str, str, str, str], None, None]:
+        """Search the segments of a single service, see `search`"""
+        serviceDir = self._serviceDir(subDomainName, service)
+        hours = sorted(name[:-7] for name in listdir(serviceDir) if name.endswith('.log.gz'))
+        for hour in hours:
+            if hour < first[:13] or hour > last[:13]:
+                continue
+            if not self._mayContain(join(serviceDir, hour + '.bloom'), words):
+                continue
+            try:
+                with open(join(serviceDir, hour + '.idx'), 'r') as indexFile:
+                    members = [entry.split() for entry in indexFile]
+                with open(join(serviceDir, hour + '.log.gz'), 'rb') as segment:
+                    for (memberFirst, memberLast, offset, length) in members:
+                        # Only members overlapping the time range are decompressed
+                        if memberLast < first or memberFirst > last:
+                            continue
+                        segment.seek(int(offset))
+                        for line in gzip.decompress(segment.read(int(length))).decode(errors='replace').splitlines():
+                            timestamp, streamName, content = (line.split(' ', 2) + ['', ''])[:3]
+                            if timestamp < first or timestamp > last:
+                                continue
+                            if 0 < len(words) and not words.issubset(self.wordPattern.findall(content.lower())):
+                                continue
+                            if None is not regex and None is regex.search(content):
+                                continue
+                            yield subDomainName, service, timestamp, streamName, content
+            except (OSError, ValueError, EOFError, gzip.BadGzipFile):
+                continue
+
+    def _retentionLimit(self) -> str:
+        """Timestamp of the oldest line kept in the archive"""
+        return self.timestamp(time() - getattr(config, 'log_archive_days', 14) * 86400)
+
+    def _prune(self):
+        """Delete segments older than `log_archive_days`"""
+        oldest = self._retentionLimit()
+        # Cursors are kept, otherwise the next collection reads the whole log of quiet containers again,
+        # only cursors behind the limit can go, as collecting starts there without one anyway
+        self._cursors = {key: cursor for (key, cursor) in self._cursors.items() if cursor > oldest}
+        limit = oldest[:13]
+        for subDomainName in self._listDir(self.archiveDir):
+            for service in self._listDir(join(self.archiveDir, subDomainName)):
+                serviceDir = join(self.archiveDir, subDomainName, service)
+                for name in listdir(serviceDir):
+                    if name[:13] < limit:
+                        remove(join(serviceDir, name))
+                if 0 == len(listdir(serviceDir)):
+                    rmtree(serviceDir)
+
+    def _saveCursors(self):
+        """Write the cursors of all services"""
+        if not isdir(self.archiveDir):
+            makedirs(self.archiveDir)
+        atomicWrite(self.cursorFile, json.dumps(self._cursors))
+
+    def startCollector(self, containers: Callable[[], list[tuple[str, dict]]], interval: float):
+        """Collect logs in a background thread every few seconds
+
+        Args:
+            containers (Callable[[], list[tuple[str, dict]]]): Returns the containers to collect, see `collect`
+            interval (float): Seconds between two collections
+        """
+        if None is not self._collector and self._collector.is_alive():
+            return
+
+        def run():
+            while True:
+                sleep(interval)
+                try:
+                    self.collect(containers())
+                except (OSError, RuntimeError, HTTPException):
+                    pass
+
+        self._collector = Thread(target=run, name='LogArchive', daemon=True)
+        self._collector.start()
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+import re
+from collections import deque
+from http.client import HTTPException
+from threading import Condition, Thread
+from time import monotonic
+from typing import Generator
+
+import config
+from .DockerApi import DockerApi, LogStream
+
+
+class LogSource:
+    """A single container followed by the log multiplexer"""
+
+    def __init__(self, label: str, service: str, containerId: str):
+        """
+        Args:
+            label (string): Prefix of the containers lines, usually the subdomain name
+            service (string): The compose service of the container
+            containerId (string): Id of the container
+        """
+        self.label = label
+        self.service = service
+        self.containerId = containerId
+        # Lines waiting to be read, as (stream name, text)
+        self.buffer: deque[tuple[str, str]] = deque()
+        # Lines lost because the buffer was full or the rate limit was exceeded since they were last reported
+        self.dropped = 0
+        self.skipped = 0
+        self.reportedAt = 0.0
+        self.done = False
+        self.error: str = None
+        self.stream: LogStream = None
+        # Token bucket of the rate limit
+        self.tokens: float = None
+        self.lastRefill = monotonic()
+
+
+class LogMultiplexer:
+    """Follows the log output of many containers at once
+
+    Every container is read in its own thread into a bounded buffer, the oldest lines are dropped when it is full.
+    The buffers are read round-robin, a few lines at a time, so a noisy container can neither exhaust memory
+    nor hold back the lines of the others. Lines are filtered by a regular expression and limited to a rate per
+    container before they are buffered, dropped and skipped lines are reported in their place.
+    Only containers existing when following starts are read.
+    """
+    # Lines taken from a buffer before the next one is read
+    batchSize = 16
+
+    def __init__(self, dockerApi: DockerApi, pattern: str = None, maxRate: float = None, tail: int = None,
+                 bufferLines: int = None):
+        """
+        Args:
+            dockerApi (DockerApi): Client for the docker daemon
+            pattern (string): Only lines matching this regular expression
+            maxRate (float): Lines per second and container at most, all lines if omitted
+            tail (int): Number of existing lines to start with, defaults to `log_tail_lines`
+            bufferLines (int): Lines kept per container while waiting to be read, defaults to `log_buffer_lines`
+        """
+        self.dockerApi = dockerApi
+        self.pattern = re.compile(pattern) if None is not pattern else None
+        self.maxRate = maxRate
+        self.tail = getattr(config, 'log_tail_lines', 10) if None is tail else tail
+        self.bufferLines = getattr(config, 'log_buffer_lines', 1000) if None is bufferLines else bufferLines
+        self.sources: list[LogSource] = list()
+        self._condition = Condition()
+        self._closed = False
+
+    def add(self, label: str, container: dict):
+        """Follow a container
+
+        Args:
+            label (string): Prefix of the containers lines, usually the subdomain name
+            container (dict): The container as described in `DockerApi.containerState()`
+        """
+        self.sources.append(LogSource(label, container['service'], container['id']))
+
+    def addModule(self, module, services: list[str] = None):
+        """Follow the running containers of a module
+
+        Args:
+            module (Module): The module
+            services (list[str]): Only these compose services, all if omitted
+        """
+        for container in module.getContainerStates():
+            if 'running' == container['state'] and (None is services or container['service'] in services):
+                self.add(str(module.subDomain), container)
+
+    def start(self):
+        """Start reading all containers"""
+        for source in self.sources:
+            Thread(target=self._read, args=(source,), name='LogMultiplexer', daemon=True).start()
+
+    def _read(self, source: LogSource):
+        """Read a containers lines into its buffer until the stream ends"""
+        try:
+            source.stream = self.dockerApi.logs(source.containerId, tail=str(self.tail))
+            if self._closed:
+                source.stream.close()
+            for (streamName, line) in source.stream:
+                text = line.decode(errors='replace')
+                if None is not self.pattern and None is self.pattern.search(text):
+                    continue
+                with self._condition:
+                    if not self._allow(source):
+                        source.skipped += 1
+                        continue
+                    if len(source.buffer) >= self.bufferLines:
+                        source.buffer.popleft()
+                        source.dropped += 1
+                    source.buffer.append((streamName, text))
+                    self._condition.notify()
+        except (OSError, RuntimeError, HTTPException) as e:
+            source.error = str(e)
+        finally:
+            with self._condition:
+                source.done = True
+                self._condition.notify()
+
+    def _allow(self, source: LogSource) -> bool:
+        """Take a token from a sources bucket if the rate limit allows another line"""
+        if None is self.maxRate:
+            return True
+        now = monotonic()
+        # The bucket starts full, so the first lines always come through
+        capacity = max(1.0, self.maxRate)
+        tokens = capacity if None is source.tokens else source.tokens + (now - source.lastRefill) * self.maxRate
+        source.tokens = min(capacity, tokens)
+        source.lastRefill = now
+        if 1 > source.tokens:
+            return False
+        source.tokens -= 1
+        return True
+
+    def lines(self, timeout: float = None) -> Generator[tuple[LogSource, str, str], None, None]:
+        """Read the buffered lines of all containers until all streams ended or the multiplexer is closed
+
+        Args:
+            timeout (float): Seconds after which reading stops
+
+        Returns:
+            Generator[tuple[LogSource, str, str]]: The container, the stream name (stdout, stderr or notice)
+                and the text of every line
+        """
+        end = None if None is timeout else monotonic() + timeout
+        while True:
+            with self._condition:
+                remaining = None if None is end else max(0.0, end - monotonic())
+                if not self._condition.wait_for(self._readable, remaining) or self._closed:
+                    return
+                batch = list()
+                for source in self.sources:
+                    # Lost lines are reported in front of the next lines that made it through
+                    if source.dropped and (source.buffer or source.done):
+                        batch.append((source, 'notice', f'{source.dropped} lines dropped, reading is too slow'))
+                        source.dropped = 0
+                    # Skipping is expected with a rate limit, so it is only reported every few seconds
+                    if source.skipped and (source.done or (source.buffer and monotonic() - source.reportedAt > 5)):
+                        source.reportedAt = monotonic()
+                        batch.append((source, 'notice', f'{source.skipped} lines skipped by the rate limit'))
+                        source.skipped = 0
+                    for _ in range(min(self.batchSize, len(source.buffer))):
+                        batch.append((source, *source.buffer.popleft()))
+                    if source.done and None is not source.error:
+                        batch.append((source, 'notice', 'log output failed: ' + source.error))
+                        source.error = None
+                finished = all(source.done and not source.buffer for source in self.sources)
+            yield from batch
+            if finished:
+                return
+
+    def _readable(self) -> bool:
+        """Whether `lines()` has something to do"""
+        return self._closed or all(source.done for source in self.sources) or \
+            any(source.buffer or (source.done and None is not source.error) for source in self.sources)
+
+    def close(self):
+        """Stop reading all containers"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for source in self.sources:
+            if None is not source.stream:
+                source.stream.close()
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+from array import array
+from http.client import HTTPException
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from typing import Callable
+
+import config
+from .DockerApi import DockerApi
+
+
+class MetricSeries:
+    """The latest samples of all metrics in a ring buffer of fixed size
+
+    Every metric is kept in its own array of 32 bit floats, so a series never grows after it was created.
+    """
+    # CPU in percent of one core, memory in bytes and network and block I/O in bytes per second
+    metrics = ('cpu', 'memory', 'netRx', 'netTx', 'blockRead', 'blockWrite')
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity (int): Number of samples kept
+        """
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = {metric: array('f', bytes(4 * capacity)) for metric in self.metrics}
+        self.count = 0
+        self._next = 0
+
+    def add(self, sampleTime: float, values: dict[str, float]):
+        """Add a sample, replacing the oldest one if the buffer is full
+
+        Args:
+            sampleTime (float): Unix timestamp of the sample
+            values (dict[str, float]): Value of every metric
+        """
+        self.times[self._next] = sampleTime
+        for metric in self.metrics:
+            self.values[metric][self._next] = values.get(metric, 0.0)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self) -> dict[str, float]:
+        """The values of the newest sample, None if there is none yet"""
+        if 0 == self.count:
+            return None
+        index = (self._next - 1) % self.capacity
+        return {metric: self.values[metric][index] for metric in self.metrics}
+
+    def history(self, metric: str) -> list[float]:
+        """All kept values of a metric, the oldest first"""
+        values = self.values[metric]
+        start = (self._next - self.count) % self.capacity
+        return [values[(start + offset) % self.capacity] for offset in range(self.count)]
+
+
+class MetricsCollector:
+    """Samples the resource usage of all managed containers
+
+    Every container is followed through its docker stats stream, which sends a sample about every second.
+    Every `metrics_interval` seconds the latest values are summed up per subdomain and per module type and added to
+    ring buffers of `metrics_history` samples, so memory use is bounded regardless of how long it runs.
+    """
+    # One collector per docker socket
+    _instances: dict[str, 'MetricsCollector'] = dict()
+
+    @classmethod
+    def forSocket(cls, socketPath: str) -> 'MetricsCollector':
+        """Get the shared collector of a docker socket
+
+        Args:
+            socketPath (string): Location of the docker socket
+
+        Returns:
+            MetricsCollector: The collector
+        """
+        if socketPath not in cls._instances.keys():
+            cls._instances[socketPath] = cls(DockerApi.forSocket(socketPath))
+        return cls._instances[socketPath]
+
+    def __init__(self, dockerApi: DockerApi):
+        """
+        Args:
+            dockerApi (DockerApi): Client for the docker daemon
+        """
+        self.dockerApi = dockerApi
+        self.interval = getattr(config, 'metrics_interval', 10)
+        self.capacity = getattr(config, 'metrics_history', 360)
+        self._lock = Lock()
+        self._thread: Thread = None
+        # Container id -> (subdomain name, module, latest values) of every followed container
+        self._containers: dict[str, tuple[str, str, dict[str, float]]] = dict()
+        # Series of every subdomain and every module type
+        self.subDomains: dict[str, MetricSeries] = dict()
+        self.modules: dict[str, MetricSeries] = dict()
+        # Module type of every subdomain
+        self.moduleOf: dict[str, str] = dict()
+
+    @property
+    def running(self) -> bool:
+        """Whether samples are being collected"""
+        return None is not self._thread and self._thread.is_alive()
+
+    def start(self, containers: Callable[[], list[tuple[str, str, dict]]]):
+        """Start collecting in a background thread, if the docker socket exists
+
+        Args:
+            containers (Callable[[], list[tuple[str, str, dict]]]): Returns the subdomain name, module type and state
+                (as described in `DockerApi.containerState()`) of every running container, it is called every interval
+                to follow new containers
+        """
+        if not self.running and self.dockerApi.available():
+            self._thread = Thread(target=self._run, args=(containers,), name='MetricsCollector', daemon=True)
+            self._thread.start()
+
+    def _run(self, containers: Callable[[], list[tuple[str, str, dict]]]):
+        """Follow new containers and aggregate the samples every interval"""
+        while True:
+            started = monotonic()
+            try:
+                self._follow(containers())
+            except (OSError, RuntimeError, HTTPException):
+                pass
+            self._aggregate()
+            sleep(max(0.0, self.interval - (monotonic() - started)))
+
+    def _follow(self, containers: list[tuple[str, str, dict]]):
+        """Start following new containers and stop following removed ones"""
+        current = {container['id']: (subDomainName, module) for (subDomainName, module, container) in containers}
+        with self._lock:
+            # Readers end on their own once their container was removed from the dictionary
+            for containerId in self._containers.keys() - current.keys():
+                del self._containers[containerId]
+            for (containerId, (subDomainName, module)) in current.items():
+                if containerId not in self._containers.keys():
+                    self._containers[containerId] = (subDomainName, module, dict())
+                    Thread(target=self._read, args=(containerId,), name='MetricsCollector', daemon=True).start()
+
+    def _read(self, containerId: str):
+        """Turn the samples of a containers stats stream into current values"""
+        previous = None
+        try:
+            for sample in self.dockerApi.stream('/containers/' + containerId + '/stats', stream=1):
+                now = monotonic()
+                counters = self._counters(sample)
+                values = {'cpu': self._cpu(sample), 'memory': self._memory(sample)}
+                if None is not previous:
+                    elapsed = max(now - previous[0], 0.001)
+                    for (metric, counter) in counters.items():
+                        # Counters start over when a container restarts
+                        values[metric] = max(0.0, counter - previous[1][metric]) / elapsed
+                previous = (now, counters)
+                with self._lock:
+                    if containerId not in self._containers.keys():
+                        return
+                    self._containers[containerId][2].update(values)
+        except (OSError, RuntimeError, ValueError, HTTPException):
+            pass
+        finally:
+            with self._lock:
+                self._containers.pop(containerId, None)
+
+    @staticmethod
+    def _cpu(sample: dict) -> float:
+        """CPU usage of a stats sample in percent of one core"""
+        cpu = sample.get('cpu_stats', dict())
+        previous = sample.get('precpu_stats', dict())
+        cpuDelta = cpu.get('cpu_usage', dict()).get('total_usage', 0) - \
+            previous.get('cpu_usage', dict()).get('total_usage', 0)
+        systemDelta = cpu.get('system_cpu_usage', 0) - previous.get('system_cpu_usage', 0)
+        if 0 >= systemDelta or 0 > cpuDelta:
+            return 0.0
+        cores = cpu.get('online_cpus') or len(cpu.get('cpu_usage', dict()).get('percpu_usage') or [1])
+        return cpuDelta / systemDelta * cores * 100
+
+    @staticmethod
+    def _memory(sample: dict) -> float:
+        """Memory usage of a stats sample in bytes, without the page cache like `docker stats` shows it"""
+        memory = sample.get('memory_stats', dict())
+        stats = memory.get('stats', dict())
+        # cgroup v2 reports inactive_file, v1 total_inactive_file
+        cache = stats.get('inactive_file', stats.get('total_inactive_file', 0))
+        return float(max(0, memory.get('usage', 0) - cache))
+
+    @staticmethod
+    def _counters(sample: dict) -> dict[str, float]:
+        """The cumulative network and block I/O byte counters of a stats sample"""
+        networks = (sample.get('networks') or dict()).values()
+        counters = {
+            'netRx': float(sum(network.get('rx_bytes', 0) for network in networks)),
+            'netTx': float(sum(network.get('tx_bytes', 0) for network in networks)),
+            'blockRead': 0.0,
+            'blockWrite': 0.0,
+        }
+        for entry in (sample.get('blkio_stats', dict()).get('io_service_bytes_recursive') or list()):
+            operation = entry.get('op', '').lower()
+            if operation in ('read', 'write'):
+                counters['block' + operation.capitalize()] += entry.get('value', 0)
+        return counters
+
+    def _aggregate(self):
+        """Add the current values of all containers to the series of their subdomain and module type"""
+        totals: dict[str, dict[str, float]] = dict()
+        moduleTotals: dict[str, dict[str, float]] = dict()
+        with self._lock:
+            for (subDomainName, module, values) in self._containers.values():
+                # Containers only count once their first sample arrived
+                if 0 == len(values):
+                    continue
+                self.moduleOf[subDomainName] = module
+                for total in (totals.setdefault(subDomainName, dict()), moduleTotals.setdefault(module, dict())):
+                    for (metric, value) in values.items():
+                        total[metric] = total.get(metric, 0.0) + value
+            now = time()
+            for (series, currentTotals) in ((self.subDomains, totals), (self.modules, moduleTotals)):
+                # Forget about subdomains and modules that aren't running anymore
+                for name in series.keys() - currentTotals.keys():
+                    del series[name]
+                for (name, total) in currentTotals.items():
+                    series.setdefault(name, MetricSeries(self.capacity)).add(now, total)
+
+    def top(self, metric: str = 'cpu', count: int = 10, modules: bool = False) -> list[tuple[str, dict[str, float]]]:
+        """The biggest consumers of a metric right now
+
+        Args:
+            metric (string): One of `MetricSeries.metrics`
+            count (int): Number of consumers
+            modules (bool): Sum up by module type instead of subdomain
+
+        Returns:
+            list[tuple[str, dict[str, float]]]: The subdomain or module name and latest values, the biggest first
+        """
+        with self._lock:
+            latest = [(name, series.latest()) for (name, series) in (self.modules if modules else self.subDomains).items()]
+        latest = [(name, values) for (name, values) in latest if None is not values]
+        return sorted(latest, key=lambda entry: entry[1][metric], reverse=True)[:count]
+
+    def history(self, name: str) -> MetricSeries:
+        """The series of a subdomain or module type, None if it isn't running"""
+        with self._lock:
+            return self.subDomains.get(name, self.modules.get(name))
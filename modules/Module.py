@@ -1,14 +1,27 @@
 #!/usr/bin/python3
+import asyncio
+import hashlib
+import json
+import re
 import secrets
 import shutil
 import string
+from filecmp import cmp
+from inspect import getfile
 from os import makedirs, remove
 from os.path import exists, isfile, isdir, join, dirname
 from shutil import rmtree
-from socketserver import TCPServer
-from subprocess import call, run, CompletedProcess
+from subprocess import CompletedProcess
 
 import config
+from AtomicFile import atomicWrite
+from Tracing import Tracer
+from .ComposeEngine import ComposeEngine
+from .ContainerWatcher import ContainerWatcher
+from .DockerApi import DockerApi
+from .EnvStore import EnvStore
+from .LogArchive import LogArchive
+from .PortAllocator import PortAllocator
 
 
 class Module:
@@ -19,6 +32,13 @@ class Module:
     composeFile: str
     # The local port exposed by a http server
     exposedPort = None
+    # Images used by a compose template, e.g. `image: postgres:${POSTGRES_VERSION:-17.10-alpine}`
+    _imagePattern = re.compile(r'^\s*image:\s*[\'"]?([^\s\'"]+)', re.MULTILINE)
+    _variablePattern = re.compile(r'\$\{(\w+)(?::?-([^}]*))?\}')
+    # Bulk operations bring modules with a lower start order up first and take them down last
+    startOrder = 50
+    # Variables holding host ports assigned from `port_range`, their values are claimed in the port registry
+    portVariables: tuple[str, ...] = ()
 
     def __init__(self, subDomain):
         """
@@ -33,7 +53,10 @@ class Module:
         self.subDomain = subDomain
         self.envFile = join(self.subDomain.rootDir, '.env')
         self.composeFile = join(self.subDomain.rootDir, 'docker-compose.yml')
-        self.moduleTemplate = join(dirname(__file__), 'module-templates', self.name + '.yml')
+        # Hash of the state the containers were last brought up with, see `desiredState`
+        self.appliedStateFile = join(self.subDomain.rootDir, '.applied')
+        # Templates are next to the module's source file, so third party modules can ship their own
+        self.moduleTemplate = self.templateFile()
         # Create all required dirs
         for dirName in self.requiredDirs:
             folderPath = join(self.subDomain.rootDir, dirName)
@@ -42,6 +65,9 @@ class Module:
 
         # Load & Update environment variables on startup
         self.envVars = self._createOrUpdateEnvFile()
+        # The exposed port is whatever was committed to the .env file
+        if 'HTTP_PORT' in self.envVars.keys():
+            self.exposedPort = int(self.envVars['HTTP_PORT'])
 
     def __repr__(self):
         return type(self).__name__
@@ -59,19 +85,26 @@ class Module:
         alphabet = string.ascii_letters + string.digits
         return ''.join(secrets.choice(alphabet) for i in range(length))
 
-    @staticmethod
-    def getFreePort():
-        """Get a port available for binding
+    @property
+    def _portAllocator(self) -> PortAllocator:
+        """The registry of all ports assigned to subdomains"""
+        return PortAllocator.forRootDir(self.subDomain.inventory.rootDir)
+
+    def getFreePort(self):
+        """Reserve a port for this module that isn't assigned to any other module
 
         Returns:
             int: A free port
         """
-        with TCPServer(('localhost', 0), None) as s:
-            return s.server_address[1]
+        return self._portAllocator.allocate(str(self.subDomain))
 
+    @Tracer.traced('module.env')
     def _createOrUpdateEnvFile(self) -> dict[str, str]:
         """Put all required parameters into an .env file in the subdomains root directory, adding new values if unset
 
+        Deferred values (e.g. passwords or ports) are only generated for variables missing from the file
+        and the file is only written if at least one variable was added, see `EnvStore`.
+
         Returns:
             dict[str, str]: The variables committed to file
         """
@@ -85,19 +118,46 @@ class Module:
             'PROXY_NETWORK_NAME'  : config.proxy_network_name,
         }
         # Keys in the latter dictionary take precedence -> subclass method can override default variables
-        combined_vars = default_vars | self._getCustomEnvVars()
+        custom_vars = self._getCustomEnvVars()
+        combined_vars = default_vars | custom_vars
 
         # If file already exists, update new values only
-        if isfile(self.envFile):
-            # Same precedence applies -> values from file take precedence
-            combined_vars = combined_vars | Module.fileToDict(self.envFile)
-
-        # Save combined variables to file
-        with open(self.envFile, 'w') as envFile:
-            envFile.writelines(f'{name}={value}\n' for (name, value) in combined_vars.items())
+        file_vars = EnvStore.read(self.envFile)
+        missing_vars = {name: value for (name, value) in combined_vars.items() if name not in file_vars.keys()}
+        # Only generate deferred values that are actually needed
+        for (name, value) in missing_vars.items():
+            if callable(value):
+                missing_vars[name] = value()
+        # Same precedence applies -> values from file take precedence
+        combined_vars = combined_vars | missing_vars | file_vars
+        # Make sure ports from an existing file are known as taken
+        for name in self.portVariables:
+            if name in file_vars.keys() and file_vars[name].isdigit():
+                self._portAllocator.claim(str(self.subDomain), int(file_vars[name]))
+
+        # Save the added variables behind the existing ones, the file is only written if anything changed
+        if EnvStore.write(self.envFile, file_vars | missing_vars):
+            self.subDomain.inventory.update(self.subDomain)
 
         return combined_vars
 
+    def setEnvVars(self, variables: dict[str, str]) -> bool:
+        """Override variables of the .env file, they are all written at once
+
+        Args:
+            variables (dict[str, str]): The variables and their new values
+
+        Returns:
+            bool: Whether anything changed
+        """
+        if not EnvStore.update(self.envFile, variables):
+            return False
+        self.envVars = self._createOrUpdateEnvFile()
+        if 'HTTP_PORT' in self.envVars.keys():
+            self.exposedPort = int(self.envVars['HTTP_PORT'])
+        self.subDomain.inventory.update(self.subDomain)
+        return True
+
     def _getCustomEnvVars(self) -> dict[str, str]:
         """
         Obtain custom environment variables for this module.
@@ -111,8 +171,13 @@ class Module:
         - `MODULE_URL`: URL to the module's content root
         - `MODULE_PATH`: File system path to the module's content root on the *host disk*
 
+        Values that are expensive to create (like `self.password` or `self.getFreePort`) should be passed
+        uncalled, they are only evaluated if the variable doesn't exist in the `.env`-file yet.
+        A `HTTP_PORT` variable is used as the module's `exposedPort`.
+        Variables holding ports from `self.getFreePort` have to be listed in `portVariables`.
+
         Returns:
-            A dictionary of additional <variable name> : <value> mappings.
+            A dictionary of additional <variable name> : <value or callable> mappings.
 
         """
         return dict()
@@ -126,39 +191,172 @@ class Module:
         Returns:
             dict: The converted file
         """
-        if not isfile(filePath):
-            return dict()
-        envVars = dict()
-        with open(filePath, 'r') as file:
-            for line in file:
-                splitLine = line.strip().split('=', 1)
-                # Skip invalid lines
-                if len(splitLine) != 2:
-                    continue
-                envVars[splitLine[0]] = splitLine[1]
-        return envVars
+        return EnvStore.read(filePath)
 
     def _generateComposeFile(self):
-        """Generate the compose file for this module and save it to the module directory."""
+        """Generate the compose file for this module and save it to the module directory, if it changed."""
         # Since there are no moving parts in the templates, a simple copy is sufficient
-        shutil.copy(self.moduleTemplate, self.composeFile)
+        if not isfile(self.composeFile) or not cmp(self.moduleTemplate, self.composeFile, shallow=False):
+            shutil.copy(self.moduleTemplate, self.composeFile)
+
+    def desiredState(self) -> str:
+        """Hash of everything `up` applies: the compose template, the .env file and the ids of the images used
+
+        Returns:
+            string: The hash, it only matches `appliedState()` if nothing changed since the last `up`
+        """
+        return self.stateOf(self.subDomain.rootDir)
+
+    @classmethod
+    def templateFile(cls) -> str:
+        """Location of this modules compose template, next to the module's source file"""
+        return join(dirname(getfile(cls)), 'module-templates', cls.__name__ + '.yml')
+
+    @classmethod
+    def stateOf(cls, rootDir: str) -> str:
+        """The `desiredState` of a subdomain with this module, without building its module
+
+        Args:
+            rootDir (string): The subdomains directory
+
+        Returns:
+            string: The hash
+        """
+        with open(cls.templateFile(), 'rb') as templateFile:
+            template = templateFile.read()
+        state = hashlib.sha256(template)
+        envPath = join(rootDir, '.env')
+        if isfile(envPath):
+            with open(envPath, 'rb') as envFile:
+                state.update(envFile.read())
+        # A pulled image only replaces the containers on the next `up`
+        for image in cls._images(template.decode(errors='replace'), EnvStore.read(envPath)):
+            state.update(f'\n{image}={cls._imageId(image)}'.encode())
+        return state.hexdigest()
+
+    @classmethod
+    def _images(cls, template: str, envVars: dict) -> list[str]:
+        """The images of a compose template, with variables expanded from the .env file"""
+        def expand(match: re.Match) -> str:
+            return envVars.get(match.group(1)) or match.group(2) or ''
+        return sorted({cls._variablePattern.sub(expand, image) for image in cls._imagePattern.findall(template)})
+
+    @staticmethod
+    def _imageId(image: str) -> str:
+        """Id of a local image, empty if it doesn't exist or docker can't be reached"""
+        dockerApi = DockerApi.forSocket(getattr(config, 'docker_socket', join('/', 'var', 'run', 'docker.sock')))
+        if not dockerApi.available():
+            return ''
+        try:
+            return dockerApi.image(image).get('Id', '')
+        except (OSError, RuntimeError, ValueError):
+            return ''
+
+    def appliedState(self) -> str:
+        """The `desiredState` the containers were last brought up with, None if they weren't or were taken down"""
+        return self.appliedStateOf(self.subDomain.rootDir)
+
+    @staticmethod
+    def appliedStateOf(rootDir: str) -> str:
+        """The `appliedState` of a subdomain, without building its module
+
+        Args:
+            rootDir (string): The subdomains directory
+
+        Returns:
+            string: The hash, None if the containers weren't brought up
+        """
+        appliedStateFile = join(rootDir, '.applied')
+        if not isfile(appliedStateFile):
+            return None
+        with open(appliedStateFile, 'r') as stateFile:
+            return stateFile.read().strip()
+
+    def _saveAppliedState(self, state: str = None):
+        """Remember the state the containers were brought up with, None forgets it"""
+        if None is state:
+            if isfile(self.appliedStateFile):
+                remove(self.appliedStateFile)
+        elif state != self.appliedState():
+            atomicWrite(self.appliedStateFile, state + '\n')
+
+    def _isRunning(self) -> bool:
+        """Whether all containers of this module are running"""
+        try:
+            containers = self.getContainerStates()
+        except (OSError, RuntimeError, ValueError):
+            return False
+        return 0 < len(containers) and all('running' == container['state'] for container in containers)
+
+    def _beforeUp(self):
+        """Prepare the subdomain before the containers come up, subclasses may override this"""
+        pass
+
+    def up(self) -> int:
+        """Bring up this modules containers
+
+        Returns:
+            int: Exit code of docker compose
+        """
+        return ComposeEngine.sync(self.upAsync())
+
+    @Tracer.traced('module.up')
+    async def upAsync(self, prefix: str = None, timeout: float = None) -> int:
+        """Bring up this modules containers
+
+        Args:
+            prefix (str): Prefix for every line of compose output, the output is passed through if omitted
+            timeout (float): Seconds after which docker compose is terminated
 
-    def up(self):
-        """Bring up this modules containers"""
+        Returns:
+            int: Exit code of docker compose
+        """
+        self._beforeUp()
         self._generateComposeFile()
-        # Bring up containers
-        self._call_compose('up', '-d')
+        # Nothing to do for docker compose if nothing changed since the last up and all containers still run
+        appliedState = self.appliedState()
+        if None is not appliedState and appliedState == await asyncio.to_thread(self.desiredState) \
+                and await asyncio.to_thread(self._isRunning):
+            exitCode = 0
+        else:
+            # Bring up containers
+            exitCode = await self._call_compose_async('up', '-d', prefix=prefix, timeout=timeout)
+            if 0 == exitCode:
+                # Images pulled by compose are part of the applied state
+                self._saveAppliedState(await asyncio.to_thread(self.desiredState))
         # Configure haproxy
-        self.subDomain.haproxyConfig()
+        await asyncio.to_thread(self.subDomain.haproxyConfig)
         self.save()
+        return exitCode
 
-    def down(self):
-        """Stop all running containers"""
+    def down(self) -> int:
+        """Stop all running containers
+
+        Returns:
+            int: Exit code of docker compose
+        """
+        return ComposeEngine.sync(self.downAsync())
+
+    @Tracer.traced('module.down')
+    async def downAsync(self, prefix: str = None, timeout: float = None) -> int:
+        """Stop all running containers
+
+        Args:
+            prefix (str): Prefix for every line of compose output, the output is passed through if omitted
+            timeout (float): Seconds after which docker compose is terminated
+
+        Returns:
+            int: Exit code of docker compose
+        """
         self._generateComposeFile()
-        self._call_compose('down')
+        # The containers logs are gone once they are removed
+        await asyncio.to_thread(self.archiveLogs)
+        exitCode = await self._call_compose_async('down', prefix=prefix, timeout=timeout)
+        self._saveAppliedState(None)
         # Configure haproxy
-        self.subDomain.haproxyConfig(True)
+        await asyncio.to_thread(self.subDomain.haproxyConfig, True)
         self.save()
+        return exitCode
 
     def clean(self):
         """Delete all existing data"""
@@ -166,6 +364,7 @@ class Module:
         self._call_compose('rm', '-v')
         remove(self.envFile)
         remove(self.composeFile)
+        self._portAllocator.release(str(self.subDomain))
         # Delete all required dirs
         for dirName in self.requiredDirs:
             dirPath = join(self.subDomain.rootDir, dirName)
@@ -187,25 +386,151 @@ class Module:
             if isfile(moduleFile):
                 remove(moduleFile)
         else:
-            with open(moduleFile, 'w') as file:
-                file.write('MODULE_NAME=' + self.name + '\n')
+            # An unchanged file isn't written again, which would make the inventory read the subdomain again
+            EnvStore.write(moduleFile, {'MODULE_NAME': self.name})
+        self.subDomain.inventory.update(self.subDomain)
 
     def getContainers(self) -> list[str]:
         """Get a string list of all running containers in this module"""
+        cached = self.containerWatcher.containerStates(self.projectName)
+        if None is not cached:
+            return self._runningServices(cached)
+        return ComposeEngine.sync(self.getContainersAsync())
+
+    async def getContainersAsync(self) -> list[str]:
+        """Get a string list of all running containers in this module"""
+        # The watchers cache is a lookup, asking the docker daemon is still much cheaper than starting docker compose
+        cached = self.containerWatcher.containerStates(self.projectName)
+        if None is not cached:
+            return self._runningServices(cached)
+        try:
+            return self._runningServices(await asyncio.to_thread(self._apiContainerStates))
+        except (OSError, RuntimeError):
+            pass
         self._generateComposeFile()
-        out_services: str = self._run_compose('ps', '--services').stdout
+        out_services: str = (await self._run_compose_async('ps', '--services')).stdout
         return out_services.splitlines()
 
+    def getContainerStates(self) -> list[dict]:
+        """Get the state of all containers in this module, including stopped ones
+
+        Returns:
+            list[dict]: The containers `id`, `service`, `name`, `state` (e.g. running), `status` (e.g. Up 2 hours)
+                and `health` (healthy, unhealthy, starting or None)
+        """
+        cached = self.containerWatcher.containerStates(self.projectName)
+        if None is not cached:
+            return cached
+        try:
+            return self._apiContainerStates()
+        except (OSError, RuntimeError):
+            pass
+        self._generateComposeFile()
+        output = self._run_compose('ps', '--all', '--format', 'json').stdout.strip()
+        # Depending on its version docker compose prints a list or one object per line
+        containers = json.loads(output) if output.startswith('[') else [json.loads(line) for line in output.splitlines()]
+        return [{'id': container.get('ID'), 'service': container.get('Service'), 'name': container.get('Name'), 'state': container.get('State'),
+                 'status': container.get('Status'), 'health': container.get('Health') or None}
+                for container in containers]
+
+    @staticmethod
+    def _runningServices(containerStates: list[dict]) -> list[str]:
+        """Names of the services with a running container"""
+        return sorted({container['service'] for container in containerStates if 'running' == container['state']})
+
+    def _apiContainerStates(self) -> list[dict]:
+        """Get the state of all containers in this module from the docker daemon, see `getContainerStates`"""
+        if not self._dockerApi.available():
+            raise FileNotFoundError(self._dockerApi.socketPath)
+        return [DockerApi.containerState(container)
+                for container in self._dockerApi.containers(self.projectName, stopped=True)]
+
+    def inspectContainer(self, containerName: str) -> dict:
+        """Get the details of a container of this module
+
+        Args:
+            containerName (str): The compose service
+
+        Returns:
+            dict: The container as returned by the Docker Engine API, None if it doesn't exist or docker can't be reached
+        """
+        try:
+            for container in self._dockerApi.containers(self.projectName, stopped=True):
+                if containerName == container.get('Labels', dict()).get(DockerApi.serviceLabel):
+                    return self._dockerApi.inspect(container['Id'])
+        except (OSError, RuntimeError):
+            pass
+        return None
+
+    @property
+    def projectName(self) -> str:
+        """Name of this modules docker compose project"""
+        return self.composeProjectName(str(self.subDomain), self.envVars)
+
+    @staticmethod
+    def composeProjectName(subDomainName: str, envVars: dict) -> str:
+        """Name of a subdomains docker compose project, without building its module
+
+        Args:
+            subDomainName (string): Full name of the subdomain
+            envVars (dict): The subdomains environment variables, at least `COMPOSE_PROJECT_NAME` if it is set
+
+        Returns:
+            string: The project name
+        """
+        name = envVars.get('COMPOSE_PROJECT_NAME', '${DOMAIN_ESCAPED}')
+        name = name.replace('${DOMAIN_ESCAPED}', subDomainName.replace('.', '-'))
+        # docker compose normalizes project names the same way
+        return re.sub('[^a-z0-9_-]', '', name.lower())
+
+    @property
+    def _dockerApi(self) -> DockerApi:
+        """Client for the docker daemon"""
+        return DockerApi.forSocket(getattr(config, 'docker_socket', join('/', 'var', 'run', 'docker.sock')))
+
+    @property
+    def containerWatcher(self) -> ContainerWatcher:
+        """Cache of the container states of all modules"""
+        return ContainerWatcher.forSocket(self._dockerApi.socketPath, config.root_dir)
+
+    def archiveLogs(self) -> int:
+        """Archive the new log output of this modules containers, see `LogArchive`
+
+        Returns:
+            int: Number of archived lines
+        """
+        if not self._dockerApi.available():
+            return 0
+        try:
+            containers = self.getContainerStates()
+        except (OSError, RuntimeError, ValueError):
+            return 0
+        return LogArchive.forRootDir(config.root_dir).collect([(str(self.subDomain), container)
+                                                               for container in containers])
+
     def showContainerLogs(self, containerName):
-        if containerName not in self.getContainers():
-            print('Invalid service name')
-            return
         try:
-            self._call_compose('logs', '-f', containerName)
+            ComposeEngine.sync(self.showContainerLogsAsync(containerName))
         except KeyboardInterrupt:
             print()
             print('Log output ended')
 
+    async def showContainerLogsAsync(self, containerName, prefix: str = None, timeout: float = None):
+        """Follow the log output of a container until cancelled
+
+        Args:
+            containerName (str): The compose service to follow
+            prefix (str): Prefix for every log line, the output is passed through if omitted
+            timeout (float): Seconds after which following the log stops
+        """
+        if containerName not in await self.getContainersAsync():
+            print('Invalid service name')
+            return
+        try:
+            await self._call_compose_async('logs', '-f', containerName, prefix=prefix, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
     def runContainerCmd(self, containerName, cmd_binary="/bin/bash", *args):
         if containerName not in self.getContainers():
             print('Invalid service name')
@@ -226,7 +551,22 @@ class Module:
         Returns:
             int: Exit code of the subprocess
         """
-        return call(self._compile_compose_args(*args))
+        return ComposeEngine.sync(self._call_compose_async(*args))
+
+    async def _call_compose_async(self, *args, prefix: str = None, timeout: float = None) -> int:
+        """
+        Execute docker compose with the given arguments.
+
+        Args:
+            *args (str): Compose command to execute. Passed to `_compile_compose_args`
+            prefix (str): Prefix for every output line, the output is passed through if omitted
+            timeout (float): Seconds after which docker compose is terminated
+
+        Returns:
+            int: Exit code of the subprocess
+        """
+        with Tracer.span('compose.' + args[0]):
+            return await ComposeEngine.call(self._compile_compose_args(*args), prefix=prefix, timeout=timeout)
 
     def _run_compose(self, *args) -> CompletedProcess:
         """
@@ -238,7 +578,21 @@ class Module:
         Returns:
             CompletedProcess: Exit code of the subprocess
         """
-        return run(self._compile_compose_args(*args), capture_output=True, text=True)
+        return ComposeEngine.sync(self._run_compose_async(*args))
+
+    async def _run_compose_async(self, *args, timeout: float = None) -> CompletedProcess:
+        """
+        Execute docker compose with the given arguments, capturing text _(i.e. encoded)_ output
+
+        Args:
+            *args (str): Compose command to execute. Passed to `_compile_compose_args`
+            timeout (float): Seconds after which docker compose is terminated
+
+        Returns:
+            CompletedProcess: Exit code of the subprocess
+        """
+        with Tracer.span('compose.' + args[0]):
+            return await ComposeEngine.run(self._compile_compose_args(*args), timeout=timeout)
 
     def _compile_compose_args(self, *args) -> list[str]:
         """
@@ -2,47 +2,35 @@
 
 from os.path import join
 
-from .Codeigniter import Codeigniter
-from .Collabora import Collabora
-from .FreeScout import FreeScout
-from .Leantime import Leantime
-from .LinkStack import LinkStack
+from Tracing import Tracer
 from .Module import Module
-from .Mumble import Mumble
-from .Nextcloud import Nextcloud
+from .ModuleRegistry import ModuleRegistry
 from .NoneModule import NoneModule
-from .OAuthWebserver import OAuthWebserver
-from .Odoo import Odoo
-from .ParseDmarc import ParseDmarc
-from .Registry import Registry
-from .UptimeKuma import UptimeKuma
-from .Webserver import Webserver
-from .WordPress import WordPress
-from .Yopass import Yopass
-from .Zammad import Zammad
 
 
 class ModuleLoader:
-    availableModules = {
-        'Codeigniter'   : Codeigniter,
-        'Collabora'     : Collabora,
-        'FreeScout'     : FreeScout,
-        'Leantime'      : Leantime,
-        'LinkStack'     : LinkStack,
-        'Mumble'        : Mumble,
-        'Nextcloud'     : Nextcloud,
-        'OAuthWebserver': OAuthWebserver,
-        'Odoo'          : Odoo,
-        'ParseDmarc'    : ParseDmarc,
-        'Registry'      : Registry,
-        'UptimeKuma'    : UptimeKuma,
-        'Webserver'     : Webserver,
-        'WordPress'     : WordPress,
-        'Yopass'        : Yopass,
-        'Zammad'        : Zammad,
-    }
+    # Module classes are only imported on first use
+    availableModules = ModuleRegistry({
+        'Codeigniter'   : '.Codeigniter:Codeigniter',
+        'Collabora'     : '.Collabora:Collabora',
+        'FreeScout'     : '.FreeScout:FreeScout',
+        'Leantime'      : '.Leantime:Leantime',
+        'LinkStack'     : '.LinkStack:LinkStack',
+        'Mumble'        : '.Mumble:Mumble',
+        'Nextcloud'     : '.Nextcloud:Nextcloud',
+        'OAuthWebserver': '.OAuthWebserver:OAuthWebserver',
+        'Odoo'          : '.Odoo:Odoo',
+        'ParseDmarc'    : '.ParseDmarc:ParseDmarc',
+        'Registry'      : '.Registry:Registry',
+        'UptimeKuma'    : '.UptimeKuma:UptimeKuma',
+        'Webserver'     : '.Webserver:Webserver',
+        'WordPress'     : '.WordPress:WordPress',
+        'Yopass'        : '.Yopass:Yopass',
+        'Zammad'        : '.Zammad:Zammad',
+    })
 
     @staticmethod
+    @Tracer.traced('module.load')
     def load(subDomain) -> Module:
         """Load a module for the given subdomain, if one exists
 
@@ -58,6 +46,20 @@ class ModuleLoader:
         else:
             return ModuleLoader.availableModules[moduleSettings['MODULE_NAME']](subDomain)
 
+    @staticmethod
+    def inspect(subDomain) -> dict[str, str]:
+        """Read the module settings of the given subdomain without loading the module
+
+        Nothing is created or written, so this is safe to use for listing many subdomains.
+
+        Args:
+            subDomain (SubDomain): The subDomain to inspect
+
+        Returns:
+            dict[str, str]: All variables from the `.env`-file and the `MODULE_NAME`, if a module exists
+        """
+        return Module.fileToDict(join(subDomain.rootDir, '.env')) | Module.fileToDict(join(subDomain.rootDir, '.module'))
+
     @staticmethod
     def new(moduleName, subDomain):
         """Create a new module of the given type
@@ -75,3 +77,10 @@ class ModuleLoader:
         # Otherwise create the module
         else:
             return ModuleLoader.availableModules[moduleName](subDomain)
+
+
+if __name__ == '__main__':
+    # Report how long importing each module takes, run with `python -m modules.ModuleLoader`
+    print("Module import times:")
+    for (moduleName, seconds) in ModuleLoader.availableModules.importReport():
+        print(f"  {seconds * 1000:8.2f} ms  {moduleName}")
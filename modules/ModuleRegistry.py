@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+from collections.abc import Mapping
+from importlib import import_module
+from time import perf_counter
+
+import config
+
+
+class ModuleRegistry(Mapping):
+    """
+    A lazy mapping of module names to module classes.
+
+    Modules are registered by a dotted path in the form `package.module:Class`, the class is only imported
+    the first time it is looked up. Paths starting with a dot are relative to this package.
+
+    Besides the built-in modules, third party modules are discovered from
+    - the `servicemanager.modules` entry point group of installed packages
+    - the `extra_modules` dictionary in config.py
+    """
+    # Entry point group third party packages can register their modules in
+    entryPointGroup = 'servicemanager.modules'
+
+    def __init__(self, modulePaths: dict[str, str]):
+        """
+        Args:
+            modulePaths (dict[str, str]): Module names and their dotted paths
+        """
+        self._modulePaths: dict[str, str] = dict(modulePaths)
+        self._moduleClasses: dict[str, type] = dict()
+        self._discovered = False
+        # Seconds spent importing each module
+        self.importTimes: dict[str, float] = dict()
+
+    def register(self, name: str, path: str):
+        """Register a module without importing it
+
+        Args:
+            name (string): Name of the module
+            path (string): Dotted path to the module class, e.g. `package.module:Class`
+        """
+        self._modulePaths[name] = path
+        self._moduleClasses.pop(name, None)
+
+    def discover(self):
+        """Look for third party modules, this only happens once"""
+        if self._discovered:
+            return
+        self._discovered = True
+        # importlib.metadata is slow to import and only needed for discovery
+        from importlib.metadata import entry_points
+        for entryPoint in entry_points(group=self.entryPointGroup):
+            self._modulePaths.setdefault(entryPoint.name, entryPoint.value)
+        for (name, path) in getattr(config, 'extra_modules', dict()).items():
+            self._modulePaths.setdefault(name, path)
+
+    def _import(self, name: str) -> type:
+        """Import a module class by its registered path
+
+        Args:
+            name (string): Name of the module
+
+        Returns:
+            type: The module class
+        """
+        modulePath, _, className = self._modulePaths[name].partition(':')
+        start = perf_counter()
+        moduleClass = getattr(import_module(modulePath, __package__), className or name)
+        self.importTimes[name] = perf_counter() - start
+        return moduleClass
+
+    def __getitem__(self, name: str) -> type:
+        if name not in self._moduleClasses.keys():
+            if name not in self._modulePaths.keys():
+                self.discover()
+            self._moduleClasses[name] = self._import(name)
+        return self._moduleClasses[name]
+
+    def __contains__(self, name) -> bool:
+        if name not in self._modulePaths.keys():
+            self.discover()
+        return name in self._modulePaths.keys()
+
+    def __iter__(self):
+        self.discover()
+        return iter(self._modulePaths)
+
+    def __len__(self) -> int:
+        self.discover()
+        return len(self._modulePaths)
+
+    def isImported(self, name: str) -> bool:
+        """Whether the given modules class was already imported"""
+        return name in self._moduleClasses.keys()
+
+    def importReport(self) -> list[tuple[str, float]]:
+        """Import every registered module and measure how long each import takes
+
+        Modules already imported by another module are reported with the time needed to look them up only.
+
+        Returns:
+            list[tuple[str, float]]: Module names and their import time in seconds, slowest first
+        """
+        for name in self:
+            self[name]
+        return sorted(self.importTimes.items(), key=lambda item: item[1], reverse=True)
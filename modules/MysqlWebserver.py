@@ -6,6 +6,8 @@ from .Webserver import Webserver
 
 
 class MysqlWebserver(Webserver, MySql, Module):
+    portVariables = ('HTTP_PORT',)
+
     def __init__(self, subDomain):
         """A php Webserver with Mysql
 
@@ -16,9 +18,8 @@ class MysqlWebserver(Webserver, MySql, Module):
         super().__init__(subDomain)
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
-            'HTTP_PORT'          : str(self.exposedPort),
-            'MYSQL_PASSWORD'     : self.password(),
-            'MYSQL_ROOT_PASSWORD': self.password(),
+            'HTTP_PORT'          : self.getFreePort,
+            'MYSQL_PASSWORD'     : self.password,
+            'MYSQL_ROOT_PASSWORD': self.password,
         }
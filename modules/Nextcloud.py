@@ -6,6 +6,8 @@ from .Webserver import Webserver
 
 
 class Nextcloud(Webserver, MySql, Module):
+    portVariables = ('HTTP_PORT',)
+
     def __init__(self, subDomain):
         """A WordPress installation
 
@@ -16,10 +18,9 @@ class Nextcloud(Webserver, MySql, Module):
         super(Nextcloud, self).__init__(subDomain)
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
-            'HTTP_PORT'          : str(self.exposedPort),
-            'MYSQL_PASSWORD'     : self.password(),
-            'MYSQL_ROOT_PASSWORD': self.password(),
-            'REDIS_PASSWORD'     : self.password(),
+            'HTTP_PORT'          : self.getFreePort,
+            'MYSQL_PASSWORD'     : self.password,
+            'MYSQL_ROOT_PASSWORD': self.password,
+            'REDIS_PASSWORD'     : self.password,
         }
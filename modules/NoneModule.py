@@ -26,10 +26,18 @@ class NoneModule(Module):
         """Bring up this modules containers"""
         pass
 
+    async def upAsync(self, prefix=None, timeout=None):
+        """Bring up this modules containers"""
+        pass
+
     def down(self):
         """Stop all running containers"""
         pass
 
+    async def downAsync(self, prefix=None, timeout=None):
+        """Stop all running containers"""
+        pass
+
     def clean(self):
         """Delete all existing data"""
         pass
@@ -6,6 +6,8 @@ from .Module import Module
 
 
 class OAuthWebserver(Module):
+    portVariables = ('HTTP_PORT',)
+
     def __init__(self, subDomain):
         """A NGINX Webserver secured by OAuth2-Proxy
 
@@ -19,8 +21,8 @@ class OAuthWebserver(Module):
             print('Please update the environment variables with your OAuth2 provider configuration!')
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
+            'HTTP_PORT'                         : self.getFreePort,
             'OAUTH2_PROXY_PROVIDER'             : '<PROVIDER ID>',
             'OAUTH2_PROXY_PROVIDER_DISPLAY_NAME': '<PROVIDER DISPLAY NAME>',
             'OAUTH2_PROXY_CLIENT_ID'            : '<CLIENT ID HERE>',
@@ -28,5 +30,5 @@ class OAuthWebserver(Module):
             'OAUTH2_PROXY_LOGIN_URL'            : '<LOGIN URL>',
             'OAUTH2_PROXY_REDEEM_URL'           : '<TOKEN URL>',
             'OAUTH2_PROXY_VALIDATE_URL'         : '<VALIDATION URL>',
-            'OAUTH2_PROXY_COOKIE_SECRET'        : base64.urlsafe_b64encode(os.urandom(32)).decode(),
+            'OAUTH2_PROXY_COOKIE_SECRET'        : lambda: base64.urlsafe_b64encode(os.urandom(32)).decode(),
         }
@@ -6,6 +6,8 @@ from .Module import Module
 
 
 class Odoo(Module):
+    portVariables = ('HTTP_PORT', 'LIVECHAT_PORT')
+
     def __init__(self, subDomain):
         """A odoo instance with Postgres
 
@@ -14,6 +16,7 @@ class Odoo(Module):
         """
         self.requiredDirs = ['postgresql', 'odoo', 'odoo/addons', 'odoo/etc', 'odoo/lib']
         super().__init__(subDomain)
+        self.livechatPort = int(self.envVars['LIVECHAT_PORT'])
         configFilePath = self.subDomain.rootDir + '/odoo/etc/odoo.conf'
         if not isfile(configFilePath):
             with open(configFilePath, 'w') as configFile:
@@ -23,10 +26,8 @@ class Odoo(Module):
                 configFile.write('\n')
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
-        self.livechatPort = self.getFreePort()
         return {
-            'HTTP_PORT'        : str(self.exposedPort),
-            'POSTGRES_PASSWORD': self.password(),
-            'LIVECHAT_PORT'    : str(self.livechatPort),
+            'HTTP_PORT'        : self.getFreePort,
+            'POSTGRES_PASSWORD': self.password,
+            'LIVECHAT_PORT'    : self.getFreePort,
         }
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+import fcntl
+import json
+from contextlib import contextmanager
+from os import makedirs, stat
+from os.path import dirname, isdir, isfile, join
+from threading import RLock
+
+import config
+from AtomicFile import atomicWrite
+
+
+class PortAllocator:
+    """A persistent registry of the host ports assigned to each subdomain
+
+    Ports are handed out from `port_range` in config.py and kept in `tmp/ports.json` below the root directory.
+    The file is locked while it is changed, so separate processes never hand out the same port.
+    """
+    # One allocator per root directory
+    _instances: dict[str, 'PortAllocator'] = dict()
+
+    @classmethod
+    def forRootDir(cls, rootDir: str) -> 'PortAllocator':
+        """Get the shared port allocator of a root directory
+
+        Args:
+            rootDir (string): The root directory all top level domains are in
+
+        Returns:
+            PortAllocator: The port allocator
+        """
+        if rootDir not in cls._instances.keys():
+            cls._instances[rootDir] = cls(rootDir)
+        return cls._instances[rootDir]
+
+    def __init__(self, rootDir: str):
+        """
+        Args:
+            rootDir (string): The root directory all top level domains are in
+        """
+        self.rootDir = rootDir
+        self.registryFile = join(self.rootDir, 'tmp', 'ports.json')
+        self.firstPort, self.lastPort = getattr(config, 'port_range', (20000, 29999))
+        self._lock = RLock()
+        self._mtime = None
+        # Owner of each assigned port
+        self._owners: dict[int, str] = dict()
+        # Ports of each owner
+        self._ports: dict[str, set[int]] = dict()
+        # Unassigned ports below the cursor and the next never assigned port
+        self._free: list[int] = list()
+        self._next = self.firstPort
+
+    @contextmanager
+    def _transaction(self):
+        """Lock the registry file, load its current state and save it afterwards if it was changed"""
+        with self._lock:
+            registryDir = dirname(self.registryFile)
+            if not isdir(registryDir):
+                makedirs(registryDir)
+            with open(self.registryFile + '.lock', 'w') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                try:
+                    # A registry that was just built from the .env-files is saved right away
+                    changes = [self._load()]
+                    yield changes
+                    if changes[0]:
+                        self._save()
+                finally:
+                    fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def _load(self) -> bool:
+        """Load the registry file, if it was changed since it was last read
+
+        Returns:
+            bool: Whether the registry had to be built from the `.env`-files
+        """
+        if not isfile(self.registryFile):
+            self._seed()
+            return True
+        mtime = stat(self.registryFile).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        with open(self.registryFile, 'r') as registryFile:
+            data = json.load(registryFile)
+        self._mtime = mtime
+        self._owners = dict()
+        self._ports = dict()
+        for (port, owner) in data['ports'].items():
+            self._assign(owner, int(port))
+        self._next = max(self.firstPort, data['next'])
+        self._free = [port for port in range(self._next - 1, self.firstPort - 1, -1) if port not in self._owners.keys()]
+        return False
+
+    def _seed(self):
+        """Build the registry from the ports already used in existing `.env`-files
+
+        Only ports inside `port_range` are taken over, the others are container ports like `LEAN_DB_PORT=3306`
+        that many modules share, or host ports handed out before the registry existed, which can't collide.
+        """
+        # Imported here, because the inventory itself depends on the modules package
+        from Inventory import Inventory
+        inventory = Inventory.forRootDir(self.rootDir)
+        inventory.refresh(force=True, deep=True)
+        self._owners = dict()
+        self._ports = dict()
+        for domainName in inventory.domains():
+            for (subDomainName, entry) in inventory.subDomains(domainName).items():
+                for port in entry['ports'].values():
+                    if self.firstPort <= port <= self.lastPort:
+                        self._assign(subDomainName, port)
+
+    def _save(self):
+        """Write the registry file"""
+        data = {'next': self._next, 'ports': {str(port): owner for (port, owner) in self._owners.items()}}
+        atomicWrite(self.registryFile, json.dumps(data))
+        self._mtime = stat(self.registryFile).st_mtime_ns
+
+    def _assign(self, owner: str, port: int):
+        """Record a port as assigned to an owner"""
+        previousOwner = self._owners.get(port)
+        if None is not previousOwner and owner != previousOwner:
+            print('Port', port, 'of', owner, 'is also used by', previousOwner)
+            self._ports[previousOwner].discard(port)
+        self._owners[port] = owner
+        self._ports.setdefault(owner, set()).add(port)
+
+    def allocate(self, owner: str) -> int:
+        """Assign an unused port to an owner
+
+        Args:
+            owner (string): Name of the subdomain the port is for
+
+        Returns:
+            int: The assigned port
+        """
+        with self._transaction() as changes:
+            # Reuse released ports first, then continue with ports never assigned before
+            port = None
+            while 0 < len(self._free):
+                candidate = self._free.pop()
+                if candidate not in self._owners.keys():
+                    port = candidate
+                    break
+            while None is port and self._next <= self.lastPort:
+                if self._next not in self._owners.keys():
+                    port = self._next
+                self._next += 1
+            if None is port:
+                raise RuntimeError(f'No free port left in port_range {self.firstPort}-{self.lastPort}')
+            self._assign(owner, port)
+            changes[0] = True
+            return port
+
+    def claim(self, owner: str, port: int):
+        """Record a port that is already in use by an owner, e.g. from its `.env`-file
+
+        Args:
+            owner (string): Name of the subdomain the port is used by
+            port (int): The port
+        """
+        with self._lock:
+            # Avoid locking the file if nothing changes
+            if owner == self._owners.get(port) and None is not self._mtime:
+                return
+        with self._transaction() as changes:
+            if owner != self._owners.get(port):
+                self._assign(owner, port)
+                changes[0] = True
+
+    def release(self, owner: str):
+        """Release all ports of an owner
+
+        Args:
+            owner (string): Name of the subdomain the ports were assigned to
+        """
+        with self._transaction() as changes:
+            for port in self._ports.pop(owner, set()):
+                if owner == self._owners.get(port):
+                    del self._owners[port]
+                    if self.firstPort <= port < self._next:
+                        self._free.append(port)
+                changes[0] = True
+
+    def portsOf(self, owner: str) -> set[int]:
+        """All ports assigned to an owner
+
+        Args:
+            owner (string): Name of the subdomain
+
+        Returns:
+            set[int]: The assigned ports
+        """
+        with self._transaction():
+            return set(self._ports.get(owner, set()))
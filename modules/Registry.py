@@ -15,6 +15,8 @@ class Registry(Module):
     """
     envKeyUser = 'REGISTRY_BUILDER_USER'
     envKeyPass = 'REGISTRY_BUILDER_PASS'
+    # Other modules may pull their images from this registry
+    startOrder = 10
 
     def __init__(self, subDomain):
         self.requiredDirs = ['builder', 'registry']
@@ -44,7 +46,7 @@ class Registry(Module):
     def _getCustomEnvVars(self) -> dict[str, str]:
         return {
             self.envKeyUser: 'builder',
-            self.envKeyPass: self.password(255),
+            self.envKeyPass: self.password,
         }
 
     def clean(self):
@@ -4,6 +4,8 @@ from .Module import Module
 
 
 class UptimeKuma(Module):
+    portVariables = ('HTTP_PORT',)
+
     def __init__(self, subDomain):
         """A Uptime Kuma instance
 
@@ -14,7 +16,6 @@ class UptimeKuma(Module):
         super().__init__(subDomain)
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
-            'HTTP_PORT': str(self.exposedPort),
+            'HTTP_PORT': self.getFreePort,
         }
@@ -4,8 +4,6 @@ from os import makedirs
 from os.path import isdir, join
 from pathlib import Path
 
-from distutils.dir_util import copy_tree
-
 from .Module import Module
 from .MySql import MySql
 
@@ -20,11 +18,11 @@ class Webserver(MySql, Module):
         self.requiredDirs = ['php']
         super().__init__(subDomain)
 
-    def up(self):
+    def _beforeUp(self):
         # Create php.ini file - otherwise, docker compose will make the mount a directory
         Path(join(self.subDomain.rootDir, 'php.ini')).touch()
         # Call super
-        super().up()
+        super()._beforeUp()
 
     def copyData(self, dataDir, webDir='httpdocs'):
         """Import a web directory
@@ -35,6 +33,8 @@ class Webserver(MySql, Module):
         """
         if not isdir(dataDir) or 'DOMAIN_PATH' not in self.envVars.keys():
             return
+        # distutils is slow to import and only needed here
+        from distutils.dir_util import copy_tree
         if not isdir(self.envVars['DOMAIN_PATH']):
             makedirs(self.envVars['DOMAIN_PATH'])
         print(copy_tree(dataDir, self.envVars['DOMAIN_PATH'] + '/' + webDir, preserve_mode=1, preserve_times=1, preserve_symlinks=1, update=0, verbose=1, dry_run=0))
@@ -6,6 +6,8 @@ from .Module import Module
 
 
 class WordPress(Module):
+    portVariables = ('HTTP_PORT',)
+
     def __init__(self, subDomain):
         """A WordPress installation
 
@@ -15,17 +17,17 @@ class WordPress(Module):
         self.requiredDirs = ['mariadb', 'wordpress']
         super().__init__(subDomain)
 
-    def up(self):
+    def _beforeUp(self):
         # Create php.ini file - otherwise, docker compose will make the mount a directory
         Path(join(self.subDomain.rootDir, 'php.ini')).touch()
         # Call super
-        super().up()
+        super()._beforeUp()
 
     def _getCustomEnvVars(self) -> dict[str, str]:
-        self.exposedPort = self.getFreePort()
         return {
-            'MARIADB_PASSWORD'     : self.password(),
-            'MARIADB_ROOT_PASSWORD': self.password(),
+            'HTTP_PORT'            : self.getFreePort,
+            'MARIADB_PASSWORD'     : self.password,
+            'MARIADB_ROOT_PASSWORD': self.password,
             'SMTP_HOST'            : 'localhost',
             'SMTP_USERNAME'        : 'root@localhost',
             'SMTP_PASSWORD'        : 'thisisaplaceholder',
@@ -16,6 +16,6 @@ class Zammad(Module):
     def _getCustomEnvVars(self) -> dict[str, str]:
         return {
             'POSTGRES_USER': 'zammad',
-            'POSTGRES_PASS': self.password(30),
+            'POSTGRES_PASS': lambda: self.password(30),
             'VERSION'      : '7',
         }
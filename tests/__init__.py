@@ -0,0 +1,14 @@
+"""Tests of the ServiceManager
+
+Run them from the repository with `python -m pytest tests` or `python -m unittest`.
+They don't read the local config.py, every test starts from the defaults in config_example.py
+and only changes what it needs. docker, haproxy and certbot are replaced by stand-ins.
+"""
+import sys
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import config_example
+
+sys.modules.setdefault('config', config_example)
@@ -0,0 +1,147 @@
+import json
+import sys
+import tempfile
+import unittest
+from os.path import isfile, join
+from time import monotonic, sleep
+from types import SimpleNamespace
+from unittest import mock
+
+import config
+from CertificateQueue import CertificateQueue
+from Haproxy import Haproxy
+
+# Stand-in for `certbot certonly`: logs its arguments, fails for cert names listed in the fail file
+# and otherwise writes pem files to CONFIG_DIR/live/CERT_NAME like certbot does
+fakeCertbot = '''import json, os, sys
+args = sys.argv[1:]
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, 'runs.log'), 'a') as log:
+    log.write(json.dumps(args) + '\\n')
+name = args[args.index('--cert-name') + 1]
+with open(os.path.join(directory, 'fail')) as failFile:
+    if name in failFile.read().split():
+        print('Some challenges have failed.')
+        sys.exit(1)
+live = os.path.join(args[args.index('--config-dir') + 1], 'live', name)
+os.makedirs(live, exist_ok=True)
+for pem in ('fullchain.pem', 'privkey.pem'):
+    with open(os.path.join(live, pem), 'w') as pemFile:
+        pemFile.write(pem + ' of ' + name + '\\n')
+print('Successfully received certificate.')
+'''
+
+
+class CertificateQueueTest(unittest.TestCase):
+    """Certificates are issued in the background by a fake certbot"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        script = join(self.directory.name, 'certbot.py')
+        with open(script, 'w') as scriptFile:
+            scriptFile.write(fakeCertbot)
+        self.failFile = join(self.directory.name, 'fail')
+        self.fail()
+        patches = [
+            mock.patch.object(config, 'certbot_command', [sys.executable, script]),
+            mock.patch.object(config, 'certbot_config_dir', join(self.directory.name, 'letsencrypt')),
+            mock.patch.object(CertificateQueue, 'collectDelay', 0.2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.queue = CertificateQueue(join(self.directory.name, 'root'))
+        self.queue.rateLimit = (100, 3600)
+        self.queue.retryDelay = 3600
+
+    def fail(self, *certNames: str):
+        """Make certbot fail for these certificates"""
+        with open(self.failFile, 'w') as failFile:
+            failFile.write('\n'.join(certNames))
+
+    def subDomain(self, name: str, topLevelDomain: str = 'example.com'):
+        return SimpleNamespace(name=name, topLevelDomain=SimpleNamespace(name=topLevelDomain),
+                               _sslCertificateFile=join(self.directory.name, 'ssl', name, 'cert.pem'))
+
+    def runs(self) -> list[list[str]]:
+        """Arguments of every certbot run"""
+        log = join(self.directory.name, 'runs.log')
+        if not isfile(log):
+            return list()
+        with open(log, 'r') as logFile:
+            return [json.loads(line) for line in logFile]
+
+    def waitFor(self, name: str, *states: str):
+        """Wait until the request of a subdomain reached one of the states"""
+        deadline = monotonic() + 10
+        while self.queue.status(name)[0] not in states:
+            self.assertLess(monotonic(), deadline, f'{name} is {self.queue.status(name)}, expected {states}')
+            sleep(0.01)
+
+    def testIssuesAndInstallsCertificate(self):
+        blog = self.subDomain('blog.example.com')
+        self.assertEqual('queued', self.queue.request(blog))
+        self.assertTrue(self.queue.wait(10))
+        self.assertEqual('issued', self.queue.status(blog.name)[0])
+        with open(blog._sslCertificateFile, 'r') as certificate:
+            self.assertEqual('fullchain.pem of blog.example.com\nprivkey.pem of blog.example.com\n', certificate.read())
+        self.assertIn('--config-dir', self.runs()[0])
+
+    def testPendingRequestsAreDeduplicated(self):
+        blog = self.subDomain('blog.example.com')
+        # Without a worker running, both requests stay queued
+        with mock.patch.object(self.queue, '_ensureWorker'):
+            self.assertEqual('queued', self.queue.request(blog))
+            self.assertEqual('queued', self.queue.request(blog, force=True))
+        self.assertEqual(1, len(self.queue._queued))
+        self.queue._ensureWorker()
+        self.assertTrue(self.queue.wait(10))
+        self.assertEqual(1, len(self.runs()))
+
+    def testGroupsSubdomainsOfATopLevelDomain(self):
+        self.queue.grouping = True
+        for name in ('blog', 'shop', 'wiki'):
+            self.queue.request(self.subDomain(name + '.example.com'))
+        self.queue.request(self.subDomain('www.example.org', 'example.org'))
+        self.assertTrue(self.queue.wait(10))
+        runs = {run[run.index('--cert-name') + 1]: run for run in self.runs()}
+        self.assertEqual({'example.com', 'example.org'}, runs.keys())
+        domains = [runs['example.com'][index + 1] for (index, arg) in enumerate(runs['example.com']) if '-d' == arg]
+        self.assertEqual(['blog.example.com', 'shop.example.com', 'wiki.example.com'], domains)
+        self.assertEqual('example.com', self.queue.certificateName(self.subDomain('shop.example.com')))
+
+    def testRateLimitDefersRequests(self):
+        self.queue.rateLimit = (1, 3600)
+        self.queue.request(self.subDomain('blog.example.com'))
+        self.waitFor('blog.example.com', 'issued')
+        self.queue.request(self.subDomain('shop.example.com'))
+        self.waitFor('shop.example.com', 'waiting')
+        self.assertIn('next attempt in', self.queue.status('shop.example.com')[1])
+        self.assertFalse(self.queue.wait(0.3))
+        self.assertEqual(1, len(self.runs()))
+
+    def testWorkerSurvivesFailedCertbot(self):
+        self.fail('blog.example.com')
+        self.queue.request(self.subDomain('blog.example.com'))
+        self.waitFor('blog.example.com', 'failed', 'waiting')
+        self.assertIn('Some challenges have failed.', self.queue.status('blog.example.com')[1])
+        # The failed request is retried later, others are issued in the meantime
+        self.assertIn('blog.example.com', self.queue._queued.keys())
+        self.queue.request(self.subDomain('shop.example.com'))
+        self.waitFor('shop.example.com', 'issued')
+        self.assertTrue(self.queue._worker.is_alive())
+
+    def testWorkerSurvivesFailedHaproxyUpdate(self):
+        with mock.patch.object(config, 'used_proxy', config.Proxy.haproxy), \
+                mock.patch.object(Haproxy, 'updateCertificates', side_effect=FileNotFoundError('haproxy.cfg')):
+            self.queue.request(self.subDomain('blog.example.com'))
+            self.waitFor('blog.example.com', 'failed', 'waiting')
+            self.assertIn('haproxy.cfg', self.queue.status('blog.example.com')[1])
+        self.queue.request(self.subDomain('shop.example.com'))
+        self.waitFor('shop.example.com', 'issued')
+        self.assertTrue(self.queue._worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
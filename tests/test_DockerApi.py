@@ -0,0 +1,161 @@
+import json
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from os.path import join
+from urllib.parse import parse_qs, urlsplit
+
+from modules.DockerApi import DockerApi
+
+
+def container(name: str, project: str = None, state: str = 'running') -> dict:
+    labels = {DockerApi.serviceLabel: name} if None is project else \
+        {DockerApi.projectLabel: project, DockerApi.serviceLabel: name}
+    return {'Id': name + '-id', 'Names': ['/' + name], 'State': state, 'Status': 'Up 2 hours', 'Labels': labels}
+
+
+def frame(streamName: str, payload: bytes) -> bytes:
+    """A frame of the multiplexed log output"""
+    return bytes([2 if 'stderr' == streamName else 1, 0, 0, 0]) + len(payload).to_bytes(4, 'big') + payload
+
+
+class DockerStandIn(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers the parts of the Docker Engine API the client uses with keep-alive connections like the daemon"""
+    daemon_threads = True
+
+    def __init__(self, socketPath: str):
+        self.containers = [
+            container('blog-wordpress', 'blog'),
+            container('blog-db', 'blog', 'exited'),
+            container('shop-app', 'shop'),
+            container('unrelated'),
+        ]
+        # The log output of every container, sent in pieces of this many bytes
+        self.logs: dict[str, bytes] = dict()
+        self.pieceSize = 3
+        self.paths: list[str] = list()
+        self.connections = list()
+        super().__init__(socketPath, DockerHandler)
+
+    def dropConnections(self):
+        """Close all open connections like the daemon does with idle ones"""
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+
+    def listContainers(self, query: dict[str, list[str]]) -> list[dict]:
+        labels = json.loads(query.get('filters', ['{}'])[0]).get('label', list())
+        listed = list()
+        for entry in self.containers:
+            if '0' == query.get('all', ['0'])[0] and 'running' != entry['State']:
+                continue
+            if all(entry['Labels'].get(label.partition('=')[0]) == label.partition('=')[2] if '=' in label
+                   else label in entry['Labels'].keys() for label in labels):
+                listed.append(entry)
+        return listed
+
+
+class DockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections.append(self.connection)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        url = urlsplit(self.path)
+        if '/containers/json' == url.path:
+            self.sendJson(self.server.listContainers(parse_qs(url.query)))
+        elif url.path.startswith('/containers/') and url.path.endswith('/logs'):
+            self.sendLogs(self.server.logs[url.path.split('/')[2]])
+        else:
+            self.sendJson({'message': 'page not found'}, 404)
+
+    def sendJson(self, content: object, status: int = 200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendLogs(self, output: bytes):
+        """Send the output chunked in small pieces, so frames and their headers are split across reads"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(output), self.server.pieceSize):
+            piece = output[start:start + self.server.pieceSize]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.flush()
+            time.sleep(0.001)
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class DockerApiTest(unittest.TestCase):
+    """The client talks to the docker socket with pooled keep-alive connections"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.standIn = DockerStandIn(join(self.directory.name, 'docker.sock'))
+        threading.Thread(target=self.standIn.serve_forever, daemon=True).start()
+        self.api = DockerApi(self.standIn.server_address, timeout=5)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(self.standIn.server_close)
+        self.addCleanup(self.standIn.shutdown)
+
+    def names(self, containers: list[dict]) -> list[str]:
+        return [DockerApi.containerState(entry)['name'] for entry in containers]
+
+    def testContainersAreFilteredByProject(self):
+        self.assertEqual(['blog-wordpress'], self.names(self.api.containers('blog')))
+        self.assertEqual(['blog-wordpress', 'blog-db'], self.names(self.api.containers('blog', stopped=True)))
+        # Containers started without compose aren't listed
+        self.assertEqual(['blog-wordpress', 'shop-app'], self.names(self.api.containers()))
+        query = parse_qs(urlsplit(self.standIn.paths[0]).query)
+        self.assertEqual({'label': [DockerApi.projectLabel + '=blog']}, json.loads(query['filters'][0]))
+
+    def testConnectionIsReused(self):
+        for _ in range(3):
+            self.api.containers('blog')
+        self.assertEqual(3, len(self.standIn.paths))
+        self.assertEqual(1, len(self.standIn.connections))
+
+    def testReconnectsAfterTheServerClosedTheConnection(self):
+        self.api.containers('blog')
+        self.standIn.dropConnections()
+        self.assertEqual(['shop-app'], self.names(self.api.containers('shop')))
+        self.assertEqual(2, len(self.standIn.connections))
+
+    def testFailedRequestRaises(self):
+        with self.assertRaisesRegex(RuntimeError, 'page not found'):
+            self.api.inspect('missing')
+        # The connection stays usable after an error
+        self.assertEqual(['shop-app'], self.names(self.api.containers('shop')))
+        self.assertEqual(1, len(self.standIn.connections))
+
+    def testMultiplexedLogsAreSplitIntoLines(self):
+        self.standIn.logs['blog-wordpress'] = frame('stdout', b'hello\nwor') + frame('stderr', b'oops\r\n') + \
+            frame('stdout', b'ld\n') + frame('stderr', b'no newline')
+        lines = list(self.api.logs('blog-wordpress', follow=False, tty=False))
+        self.assertEqual([('stdout', b'hello'), ('stderr', b'oops'), ('stdout', b'world'), ('stderr', b'no newline')],
+                         lines)
+        query = parse_qs(urlsplit(self.standIn.paths[-1]).query)
+        self.assertEqual(('0', '1', '1'), (query['follow'][0], query['stdout'][0], query['stderr'][0]))
+
+    def testTerminalLogsAreSentAsIs(self):
+        self.standIn.logs['blog-wordpress'] = b'first\r\nsecond\nlast'
+        lines = list(self.api.logs('blog-wordpress', follow=False, tty=True))
+        self.assertEqual([('stdout', b'first'), ('stdout', b'second'), ('stdout', b'last')], lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import socketserver
+import tempfile
+import threading
+import unittest
+from os.path import join
+from types import SimpleNamespace
+from unittest import mock
+
+import config
+from Haproxy import Haproxy
+from HaproxyRuntime import HaproxyRuntime
+
+# A config with the http frontend host rules are added to
+haproxyConfig = '''global
+\tstats socket /run/haproxy/admin.sock mode 660 level admin
+
+frontend http
+\tbind *:80
+\t# END OF SERVICES
+
+# END OF SERVICES
+'''
+
+
+class RuntimeStandIn(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers the map commands of the haproxy runtime API like haproxy does, one command per connection"""
+    daemon_threads = True
+
+    def __init__(self, socketPath: str):
+        self.commands: list[str] = list()
+        # Maps by file, like the maps haproxy loaded
+        self.maps: dict[str, dict[str, str]] = dict()
+        # Commands starting with one of these are refused
+        self.refuse: tuple[str, ...] = ()
+        super().__init__(socketPath, RuntimeHandler)
+
+    def answer(self, command: str) -> str:
+        self.commands.append(command)
+        tokens = command.split()
+        if command.startswith(self.refuse):
+            return 'Unknown command.\n'
+        entries = self.maps.setdefault(tokens[2], dict()) if 3 <= len(tokens) else dict()
+        if command.startswith('add map '):
+            entries[tokens[3]] = tokens[4]
+            return '\n'
+        if command.startswith('set map '):
+            if tokens[3] not in entries.keys():
+                return 'entry not found.\n'
+            entries[tokens[3]] = tokens[4]
+            return '\n'
+        if command.startswith('del map '):
+            if None is entries.pop(tokens[3], None):
+                return 'Key not found.\n'
+            return '\n'
+        if command.startswith('show map '):
+            return ''.join(f'0x{index:x} {key} {value}\n' for (index, (key, value)) in enumerate(entries.items()))
+        return 'Unknown command.\n'
+
+
+class RuntimeHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode().strip()
+        self.wfile.write(self.server.answer(command).encode())
+
+
+class HaproxyMapRoutingTest(unittest.TestCase):
+    """Map routing changes hosts through the runtime API and only reloads haproxy when it has to"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.configFile = join(self.directory.name, 'haproxy.cfg')
+        self.mapFile = join(self.directory.name, 'subdomains.map')
+        with open(self.configFile, 'w') as configFile:
+            configFile.write(haproxyConfig)
+        self.standIn = RuntimeStandIn(join(self.directory.name, 'admin.sock'))
+        threading.Thread(target=self.standIn.serve_forever, daemon=True).start()
+        # Like haproxy, the stand-in reads the map file again when it is reloaded
+        self.reloads = mock.Mock(side_effect=lambda: self.standIn.maps.update({self.mapFile: self.mapFileEntries()}))
+        patches = [
+            mock.patch.object(Haproxy, 'configFile', self.configFile),
+            mock.patch.object(Haproxy, 'routing', 'map'),
+            mock.patch.object(Haproxy, 'mapFile', self.mapFile),
+            mock.patch.object(Haproxy, 'certificates', 'inline'),
+            mock.patch.object(Haproxy, 'runtime', HaproxyRuntime(self.standIn.server_address)),
+            mock.patch.object(Haproxy, '_files', dict()),
+            mock.patch.object(Haproxy, 'reload', self.reloads),
+            mock.patch.object(config, 'haproxy_validate', False, create=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(self.standIn.server_close)
+        self.addCleanup(self.standIn.shutdown)
+
+    def subDomain(self, name: str, port: int = 20000):
+        module = SimpleNamespace(name='WordPress', exposedPort=port)
+        return SimpleNamespace(name=name, activeModule=module,
+                               _sslCertificateFile=join(self.directory.name, name + '.pem'))
+
+    def mapFileEntries(self) -> dict[str, str]:
+        with open(self.mapFile, 'r') as mapFile:
+            return dict(line.split() for line in mapFile if '' != line.strip())
+
+    def testNewBackendNeedsReload(self):
+        Haproxy.update(self.subDomain('blog.example.com'))
+        self.assertEqual(1, self.reloads.call_count)
+        self.assertEqual([], self.standIn.commands)
+        self.assertEqual({'blog.example.com': 'blog-example-com'}, self.mapFileEntries())
+
+    def testKnownBackendIsChangedAtRuntime(self):
+        blog = self.subDomain('blog.example.com')
+        Haproxy.update(blog)
+        # The backend stays in the config when a subdomain goes down, so it comes back without a reload
+        Haproxy.update(blog, delete=True)
+        self.assertEqual([f'del map {self.mapFile} blog.example.com'], self.standIn.commands)
+        self.assertEqual(dict(), self.mapFileEntries())
+        Haproxy.update(blog)
+        self.assertEqual(f'add map {self.mapFile} blog.example.com blog-example-com', self.standIn.commands[-1])
+        self.assertEqual({'blog.example.com': 'blog-example-com'}, self.mapFileEntries())
+        self.assertEqual(self.mapFileEntries(), Haproxy.runtime.showMap(self.mapFile))
+        self.assertEqual(1, self.reloads.call_count)
+
+    def testRefusedCommandFallsBackToReload(self):
+        blog = self.subDomain('blog.example.com')
+        Haproxy.update(blog)
+        Haproxy.update(blog, delete=True)
+        self.standIn.refuse = ('add map',)
+        Haproxy.update(blog)
+        self.assertEqual(2, self.reloads.call_count)
+        # A reload reads the map file, so it has to hold the change anyway
+        self.assertEqual({'blog.example.com': 'blog-example-com'}, self.mapFileEntries())
+
+    def testMissingSocketFallsBackToReload(self):
+        blog = self.subDomain('blog.example.com')
+        Haproxy.update(blog)
+        with mock.patch.object(Haproxy, 'runtime', HaproxyRuntime(join(self.directory.name, 'missing.sock'))):
+            Haproxy.update(blog, delete=True)
+        self.assertEqual(2, self.reloads.call_count)
+        self.assertEqual(dict(), self.mapFileEntries())
+
+    def testBatchReloadsOnce(self):
+        with Haproxy.batch():
+            for name in ('blog', 'shop', 'wiki'):
+                Haproxy.update(self.subDomain(name + '.example.com'))
+        self.assertEqual(1, self.reloads.call_count)
+        self.assertEqual(3, len(self.mapFileEntries()))
+
+
+if __name__ == '__main__':
+    unittest.main()